@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_remove_user_created_by_staffinvite_and_more'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['date_joined', 'id'], name='auth_user_date_jo_8fe6fa_idx'),
+        ),
+    ]
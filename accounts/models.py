@@ -30,6 +30,9 @@ class User(AbstractUser):
 
     class Meta:
         db_table = 'auth_user'
+        indexes = [
+            models.Index(fields=['date_joined', 'id']),
+        ]
 
 
 class StaffInvite(models.Model):
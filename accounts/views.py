@@ -5,6 +5,7 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.http import JsonResponse
 from django.db.models import Q
+from library_management.pagination import CursorPaginator
 from .models import User
 from .forms import ReaderRegistrationForm, UserProfileForm, UserManagementForm, CustomUserCreationForm, LoginForm
 
@@ -126,7 +127,7 @@ def create_staff_user_view(request):
 @user_passes_test(is_librarian)
 def user_management_view(request):
     """Управление пользователями для IT staff и выше"""
-    users = User.objects.all().order_by('-date_joined')
+    users = User.objects.all()
 
     # Поиск пользователей
     query = request.GET.get('q')
@@ -144,8 +145,12 @@ def user_management_view(request):
     if user_type:
         users = users.filter(user_type=user_type)
 
+    paginator = CursorPaginator(users, 25, ('-date_joined', '-id'))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+
     return render(request, 'accounts/user_management.html', {
-        'users': users,
+        'users': page_obj,
+        'page_obj': page_obj,
         'user_types': User.USER_TYPES
     })
 
@@ -5,6 +5,8 @@ from books.models import Genre, Author, Book
 from loans.models import Loan, Reservation
 from notifications.models import Notification, NotificationPreference
 
+BATCH_MAX_ITEMS = 500
+
 
 class UserSerializer(serializers.ModelSerializer):
     user_type_display = serializers.CharField(source='get_user_type_display', read_only=True)
@@ -91,6 +93,13 @@ class BookSerializer(serializers.ModelSerializer):
         ]
 
 
+class TrendingBookSerializer(BookSerializer):
+    loan_count = serializers.IntegerField(read_only=True)
+
+    class Meta(BookSerializer.Meta):
+        fields = BookSerializer.Meta.fields + ['loan_count']
+
+
 class LoanSerializer(serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.username', read_only=True)
     book_title = serializers.CharField(source='book.title', read_only=True)
@@ -108,6 +117,29 @@ class LoanSerializer(serializers.ModelSerializer):
         read_only_fields = ['borrowed_date', 'status', 'renewals']
 
 
+class BatchItemSerializer(serializers.Serializer):
+    isbn = serializers.CharField(max_length=13)
+    membership_id = serializers.CharField(max_length=20)
+
+
+class BatchReturnSerializer(serializers.Serializer):
+    loan_ids = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    items = BatchItemSerializer(many=True, required=False, default=list)
+
+    def validate(self, attrs):
+        size = len(attrs['loan_ids']) + len(attrs['items'])
+        if not size:
+            raise serializers.ValidationError("Provide loan_ids or items")
+        if size > BATCH_MAX_ITEMS:
+            raise serializers.ValidationError(f"A batch may contain at most {BATCH_MAX_ITEMS} items")
+        return attrs
+
+
+class BatchCheckoutSerializer(serializers.Serializer):
+    items = BatchItemSerializer(many=True, allow_empty=False, max_length=BATCH_MAX_ITEMS)
+    due_date = serializers.DateTimeField(required=False)
+
+
 class ReservationSerializer(serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.username', read_only=True)
     book_title = serializers.CharField(source='book.title', read_only=True)
@@ -1,3 +1,109 @@
 from django.test import TestCase
 
-# Create your tests here.
+from accounts.models import User
+from books.models import Author, Book
+from loans import circulation
+from loans.models import Loan, Reservation
+from .serializers import BATCH_MAX_ITEMS
+
+
+class BatchCirculationTests(TestCase):
+    """Массовые выдача и возврат: результат по каждому элементу, лимит размера, доступ только библиотекарям."""
+
+    def setUp(self):
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        self.book = Book.objects.create(title='War and Peace', author=author, isbn='9780000000001',
+                                        publication_year=1869, publisher='Russky Vestnik', total_copies=3,
+                                        available_copies=3)
+        self.readers = [User.objects.create_user(f'reader-{i}', password='secret') for i in range(4)]
+        self.librarian = User.objects.create_user('librarian', password='secret', user_type='librarian')
+        self.client.force_login(self.librarian)
+
+    def post(self, action, data):
+        return self.client.post(f'/api/loans/{action}/', data, content_type='application/json')
+
+    def item(self, reader, isbn=None):
+        return {'isbn': isbn or self.book.isbn, 'membership_id': reader.membership_id}
+
+    def available_copies(self):
+        self.book.refresh_from_db()
+        return self.book.available_copies
+
+    def test_only_librarians_and_above(self):
+        self.client.force_login(self.readers[0])
+        self.assertEqual(self.post('batch_checkout', {'items': [self.item(self.readers[0])]}).status_code, 403)
+        self.assertEqual(self.post('batch_return', {'loan_ids': [1]}).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.post('batch_return', {'loan_ids': [1]}).status_code, 403)
+        self.assertFalse(Loan.objects.exists())
+
+    def test_checkout_of_one_book_several_times(self):
+        response = self.post('batch_checkout', {'items': [self.item(reader) for reader in self.readers]})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['processed'], body['succeeded']), (4, 3))
+        self.assertEqual([result['ok'] for result in body['results']], [True, True, True, False])
+        self.assertEqual(body['results'][3]['error'], 'This book is not available for borrowing.')
+        self.assertEqual(self.available_copies(), 0)
+        self.assertEqual(Loan.objects.filter(book=self.book, returned_date__isnull=True).count(), 3)
+
+    def test_checkout_partial_failure(self):
+        circulation.borrow_book(self.readers[1], self.book)
+        items = [
+            self.item(self.readers[0]),
+            {'isbn': self.book.isbn, 'membership_id': 'MEMUNKNOWN'},
+            self.item(self.readers[2], isbn='9789999999999'),
+            self.item(self.readers[1]),
+            self.item(self.readers[0]),
+        ]
+        body = self.post('batch_checkout', {'items': items}).json()
+        self.assertEqual([result['error'] for result in body['results']], [
+            '', 'Unknown membership ID.', 'Unknown ISBN.', 'Reader already has this book on loan.',
+            'Reader already has this book on loan.',
+        ])
+        self.assertEqual(body['succeeded'], 1)
+        loan = Loan.objects.get(user=self.readers[0])
+        self.assertEqual(body['results'][0]['loan_id'], loan.pk)
+        self.assertEqual(self.available_copies(), 1)
+
+    def test_return_partial_failure(self):
+        loans = [circulation.borrow_book(reader, self.book) for reader in self.readers[:3]]
+        circulation.return_loan(loans[2])
+        body = self.post('batch_return', {
+            'loan_ids': [loans[0].pk, loans[0].pk, loans[2].pk, 999999],
+            'items': [self.item(self.readers[1]), self.item(self.readers[3])],
+        }).json()
+        self.assertEqual([(result['ok'], result['error']) for result in body['results']], [
+            (True, ''), (False, 'Duplicate item in batch.'), (False, 'No active loan found.'),
+            (False, 'No active loan found.'), (True, ''), (False, 'No active loan found.'),
+        ])
+        # Три экземпляра одной книги в пакете: два возвращены сейчас, один раньше
+        self.assertEqual(self.available_copies(), 3)
+        self.assertFalse(Loan.objects.filter(returned_date__isnull=True).exists())
+
+    def test_return_of_one_book_several_times_serves_queue_first(self):
+        loans = [circulation.borrow_book(reader, self.book) for reader in self.readers[:3]]
+        hold = circulation.place_hold(self.readers[3], self.book)
+        body = self.post('batch_return', {'loan_ids': [loan.pk for loan in loans]}).json()
+        self.assertEqual(body['succeeded'], 3)
+        hold.refresh_from_db()
+        self.assertEqual(hold.status, 'available')
+        self.assertEqual(self.available_copies(), 2)
+
+        # Отложенный экземпляр выдаётся своему читателю без списания с полки
+        body = self.post('batch_checkout', {'items': [self.item(self.readers[3])]}).json()
+        self.assertEqual(body['succeeded'], 1)
+        self.assertEqual(Reservation.objects.get(pk=hold.pk).status, 'fulfilled')
+        self.assertEqual(self.available_copies(), 2)
+
+    def test_batch_size_is_capped(self):
+        too_many = [self.item(self.readers[0])] * (BATCH_MAX_ITEMS + 1)
+        self.assertEqual(self.post('batch_checkout', {'items': too_many}).status_code, 400)
+        response = self.post('batch_return', {'loan_ids': list(range(1, BATCH_MAX_ITEMS)), 'items': too_many[:2]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(f'at most {BATCH_MAX_ITEMS} items', response.content.decode())
+        self.assertFalse(Loan.objects.exists())
+
+        response = self.post('batch_return', {'loan_ids': list(range(1, BATCH_MAX_ITEMS + 1))})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['processed'], BATCH_MAX_ITEMS)
@@ -2,14 +2,15 @@ from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.db.models import Q
-from django.utils import timezone
-from datetime import timedelta
 
 from accounts.models import User
 from books.models import Book, Author, Genre
+from books.search import search_books
+from loans import circulation
 from loans.models import Loan, Reservation
+from notifications.live import schedule_unread_bump
 from notifications.models import Notification, NotificationPreference
+from reports.popularity import top_books
 from .serializers import *
 
 
@@ -52,15 +53,22 @@ class BookViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def search(self, request):
         query = request.query_params.get('q', '')
-        books = Book.objects.filter(
-            Q(title__icontains=query) |
-            Q(author__first_name__icontains=query) |
-            Q(author__last_name__icontains=query) |
-            Q(isbn__icontains=query)
-        )
+        books = Book.objects.select_related('author', 'genre')
+        if query:
+            books = search_books(query, books)
         serializer = self.get_serializer(books, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        period = request.query_params.get('period', 'week')
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            limit = 10
+        books = top_books(period, limit=limit)
+        return Response(TrendingBookSerializer(books, many=True, context={'request': request}).data)
+
 
 class AuthorViewSet(viewsets.ModelViewSet):
     queryset = Author.objects.all()  # ⬅️ ДОБАВЛЕНО
@@ -86,35 +94,73 @@ class LoanViewSet(viewsets.ModelViewSet):
         return Loan.objects.all()
 
     def perform_create(self, serializer):
-        book = serializer.validated_data['book']
-        if book.available_copies <= 0:
-            raise serializers.ValidationError("Book is not available for loan")
-
-        loan = serializer.save(user=self.request.user)
-        return loan
+        try:
+            serializer.instance = circulation.borrow_book(
+                self.request.user,
+                serializer.validated_data['book'],
+                due_date=serializer.validated_data.get('due_date')
+            )
+        except circulation.CirculationError as e:
+            raise serializers.ValidationError(str(e))
+
+    def perform_update(self, serializer):
+        # Отметка о возврате проводится через circulation, иначе экземпляр не вернётся на полку
+        loan = serializer.instance
+        for field, value in serializer.validated_data.items():
+            setattr(loan, field, value)
+        try:
+            circulation.save_loan(loan)
+        except circulation.CirculationError as e:
+            raise serializers.ValidationError({'returned_date': str(e)})
 
     @action(detail=True, methods=['post'])
     def renew(self, request, pk=None):
         loan = self.get_object()
-        if loan.can_renew():
-            loan.renewals += 1
-            loan.due_date = timezone.now() + timedelta(days=14)
-            loan.save()
-            serializer = self.get_serializer(loan)
-            return Response(serializer.data)
-        return Response(
-            {'error': 'Cannot renew this loan'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+        try:
+            circulation.renew_loan(loan)
+        except circulation.CirculationError:
+            return Response(
+                {'error': 'Cannot renew this loan'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = self.get_serializer(loan)
+        return Response(serializer.data)
 
     @action(detail=True, methods=['post'])
     def return_book(self, request, pk=None):
         loan = self.get_object()
-        loan.returned_date = timezone.now()
-        loan.save()
+        try:
+            circulation.return_loan(loan)
+        except circulation.CirculationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         serializer = self.get_serializer(loan)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsLibrarianOrHigher])
+    def batch_return(self, request):
+        serializer = BatchReturnSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['loan_ids'] + [
+            (item['isbn'], item['membership_id']) for item in serializer.validated_data['items']
+        ]
+        return Response(_batch_response(circulation.batch_return(items)))
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsLibrarianOrHigher])
+    def batch_checkout(self, request):
+        serializer = BatchCheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = [(item['isbn'], item['membership_id']) for item in serializer.validated_data['items']]
+        results = circulation.batch_checkout(items, due_date=serializer.validated_data.get('due_date'))
+        return Response(_batch_response(results))
+
+
+def _batch_response(results):
+    return {
+        'processed': len(results),
+        'succeeded': sum(1 for result in results if result['ok']),
+        'results': results,
+    }
+
 
 class ReservationViewSet(viewsets.ModelViewSet):
     queryset = Reservation.objects.all()  # ⬅️ ДОБАВЛЕНО
@@ -132,17 +178,10 @@ class ReservationViewSet(viewsets.ModelViewSet):
         if book.available_copies > 0:
             raise serializers.ValidationError("Book is available, no need to reserve")
 
-        existing_reservation = Reservation.objects.filter(
-            user=self.request.user,
-            book=book,
-            status__in=['pending', 'available']
-        ).exists()
-
-        if existing_reservation:
-            raise serializers.ValidationError("You already have an active reservation for this book")
-
-        reservation = serializer.save(user=self.request.user)
-        return reservation
+        try:
+            serializer.instance = circulation.place_hold(self.request.user, book)
+        except circulation.CirculationError as e:
+            raise serializers.ValidationError(str(e))
 
 
 class NotificationViewSet(viewsets.ModelViewSet):
@@ -170,6 +209,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
         self.get_queryset().filter(is_read=False).update(is_read=True)
+        schedule_unread_bump([request.user.pk])
         return Response({'status': 'all notifications marked as read'})
 
 
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books'
-    verbose_name = 'Book Management'
\ No newline at end of file
+    verbose_name = 'Book Management'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,302 @@
+"""
+Индекс автодополнения для поиска в навигационной панели.
+
+Индекс хранится в памяти каждого воркера: отсортированные пары
+(слово, id книги) по словам названия, имени автора и ISBN. Для каждого слова
+запроса диапазон префикса находится бинарным поиском, затем множества id
+пересекаются. К базе обращаемся только за текущим
+количеством доступных экземпляров найденных книг (выборка по первичному ключу).
+
+Если все слова запроса частые (диапазон больше MAX_SCAN), книги сначала
+берутся по отсортированным названиям, начинающимся с запроса, — они и так
+идут первыми в выдаче; полный просмотр диапазона нужен, только если таких
+книг меньше limit.
+
+Поколение в кэше (GENERATION_CACHE_KEY) увеличивает каждый воркер, изменивший
+свой индекс. Если до увеличения в кэше было не то поколение, с которым
+воркер работал, он пропустил чужие изменения и перестраивает индекс.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Book
+from .search import tokenize
+
+GENERATION_CACHE_KEY = 'books:autocomplete:generation'
+MAX_SCAN = 2000
+KEY_SENTINEL = '\U0010ffff'
+# Поколение индекса, пропустившего чужие изменения: не равно никакому значению в кэше
+STALE = object()
+
+
+def _book_tokens(title, author, isbn):
+    tokens = tokenize(title) + tokenize(author)
+    if isbn:
+        tokens.append(isbn.lower())
+    return tuple(dict.fromkeys(tokens))
+
+
+def _entry(title, author, isbn, cover_url):
+    tokens = _book_tokens(title, author, isbn)
+    # ' слово1 слово2 ...' позволяет проверить префикс одним поиском подстроки
+    return (title, author, cover_url, tokens, ' '.join(tokenize(title)), ' ' + ' '.join(tokens))
+
+
+class AutocompleteIndex:
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        # Параллельные массивы, отсортированные по (слово, id книги)
+        self._tokens = []
+        self._ids = []
+        self._entries = {}
+        # Названия (нормализованные) и id, отсортированные по названию
+        self._titles = []
+        self._title_ids = []
+        self._loaded_at = None
+        self._generation = None
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Строит индекс из кортежей (id, title, author, isbn, cover_url) без обращения к БД."""
+        index = cls()
+        index._fill(rows)
+        return index
+
+    def _fill(self, rows):
+        keys = []
+        entries = {}
+        for book_id, title, author, isbn, cover_url in rows:
+            entry = entries[book_id] = _entry(title, author, isbn, cover_url)
+            keys.extend((token, book_id) for token in entry[3])
+        keys.sort()
+        titles = sorted((entry[4], book_id) for book_id, entry in entries.items())
+        with self._lock:
+            self._tokens = [token for token, _ in keys]
+            self._ids = [book_id for _, book_id in keys]
+            self._entries = entries
+            self._titles = [title for title, _ in titles]
+            self._title_ids = [book_id for _, book_id in titles]
+            self._loaded_at = time.monotonic()
+
+    def _rows_from_db(self, queryset):
+        storage = Book._meta.get_field('cover_image').storage
+        for book_id, title, isbn, cover, first_name, last_name in queryset.values_list(
+            'id', 'title', 'isbn', 'cover_image', 'author__first_name', 'author__last_name'
+        ).iterator(chunk_size=5000):
+            yield book_id, title, f"{first_name} {last_name}", isbn, storage.url(cover) if cover else ''
+
+    def load(self):
+        generation = cache.get(GENERATION_CACHE_KEY)
+        self._fill(self._rows_from_db(Book.objects.all()))
+        self._generation = generation
+
+    def _is_stale(self):
+        return (
+            self._loaded_at is None
+            or cache.get(GENERATION_CACHE_KEY) != self._generation
+            or (self.max_age is not None and time.monotonic() - self._loaded_at > self.max_age)
+        )
+
+    def ensure_loaded(self):
+        if self._is_stale():
+            with self._lock:
+                # Пока ждали блокировку, индекс мог перестроить другой поток
+                if self._is_stale():
+                    self.load()
+
+    def _bump_generation(self):
+        # Остальные воркеры увидят новое поколение и перестроят свой индекс
+        try:
+            generation = cache.incr(GENERATION_CACHE_KEY)
+        except ValueError:
+            # Ключа нет (кэш очищен или вытеснен): с какого поколения начат индекс, неизвестно
+            if not cache.add(GENERATION_CACHE_KEY, 1, None):
+                return self._bump_generation()
+            self._generation = STALE
+            return
+        # Своим считаем новое поколение, только если предыдущее было нашим
+        self._generation = generation if generation - 1 == self._generation else STALE
+
+    def _position(self, token, book_id):
+        position = bisect_left(self._tokens, token)
+        while (position < len(self._tokens) and self._tokens[position] == token
+               and self._ids[position] < book_id):
+            position += 1
+        return position
+
+    def _insert(self, book_id, title, author, isbn, cover_url):
+        entry = self._entries[book_id] = _entry(title, author, isbn, cover_url)
+        for token in entry[3]:
+            position = self._position(token, book_id)
+            self._tokens.insert(position, token)
+            self._ids.insert(position, book_id)
+        position = bisect_left(self._titles, entry[4])
+        while (position < len(self._titles) and self._titles[position] == entry[4]
+               and self._title_ids[position] < book_id):
+            position += 1
+        self._titles.insert(position, entry[4])
+        self._title_ids.insert(position, book_id)
+
+    def _remove(self, book_id):
+        entry = self._entries.pop(book_id, None)
+        if entry is None:
+            return
+        for token in entry[3]:
+            position = self._position(token, book_id)
+            if (position < len(self._tokens) and self._tokens[position] == token
+                    and self._ids[position] == book_id):
+                del self._tokens[position]
+                del self._ids[position]
+        position = bisect_left(self._titles, entry[4])
+        while position < len(self._titles) and self._titles[position] == entry[4]:
+            if self._title_ids[position] == book_id:
+                del self._titles[position]
+                del self._title_ids[position]
+                break
+            position += 1
+
+    def update_books(self, book_ids):
+        if self._loaded_at is None:
+            # Своего индекса нет — только сообщаем остальным воркерам
+            self._bump_generation()
+            return
+        rows = {row[0]: row for row in self._rows_from_db(Book.objects.filter(pk__in=book_ids))}
+        with self._lock:
+            # Книги, запись которых в индексе не изменилась, другим воркерам перестраивать незачем
+            changed = [
+                book_id for book_id in set(book_ids)
+                if self._entries.get(book_id) != (_entry(*rows[book_id][1:]) if book_id in rows else None)
+            ]
+            if not changed:
+                return
+            for book_id in changed:
+                self._remove(book_id)
+                if book_id in rows:
+                    self._insert(*rows[book_id])
+            self._bump_generation()
+
+    def remove_book(self, book_id):
+        if self._loaded_at is None:
+            self._bump_generation()
+            return
+        with self._lock:
+            self._remove(book_id)
+            self._bump_generation()
+
+    def _search_frequent(self, terms, ranges, limit):
+        """
+        Поиск, когда все слова запроса частые (ranges — их диапазоны (lo, hi)):
+        сначала книги, название которых начинается с запроса.
+        """
+        needles = [' ' + term for term in terms]
+        entries = self._entries
+        prefix = ' '.join(terms)
+        start = bisect_left(self._titles, prefix)
+        end = bisect_left(self._titles, prefix + KEY_SENTINEL)
+        best = []
+        for book_id in self._title_ids[start:end]:
+            if all(needle in entries[book_id][5] for needle in needles):
+                best.append(book_id)
+                if len(best) == limit:
+                    return best
+
+        # Таких книг меньше limit — дополняем остальными совпадениями по названию
+        rest = set(self._ids[slice(*ranges[0])])
+        for lo, hi in ranges[1:]:
+            rest.intersection_update(self._ids[lo:hi])
+        rest.difference_update(best)
+        return best + heapq.nsmallest(limit - len(best), rest, key=lambda book_id: entries[book_id][4])
+
+    def search(self, query, limit=10):
+        """Возвращает (id, запись) книг, все слова которых совпадают со словами запроса по префиксу."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        with self._lock:
+            tokens = self._tokens
+            ids = self._ids
+            entries = self._entries
+
+            # Пересекаем множества id, начиная с самого селективного слова;
+            # слишком частые префиксы проверяем по словам уже найденных книг
+            ranges = []
+            for term in terms:
+                lo = bisect_left(tokens, term)
+                hi = bisect_left(tokens, term + KEY_SENTINEL)
+                ranges.append((hi - lo, term, lo, hi))
+            ranges.sort()
+            if ranges[0][0] > MAX_SCAN:
+                best = self._search_frequent(terms, [(lo, hi) for _, _, lo, hi in ranges], limit)
+                return [(book_id, entries[book_id]) for book_id in best]
+
+            candidates = None
+            deferred = []
+            for size, term, lo, hi in ranges:
+                if candidates is None:
+                    candidates = set(ids[lo:hi])
+                elif size > MAX_SCAN:
+                    deferred.append(term)
+                else:
+                    candidates &= set(ids[lo:hi])
+                if not candidates:
+                    return []
+
+            if deferred:
+                needles = [' ' + term for term in deferred]
+                candidates = [
+                    book_id for book_id in candidates
+                    if all(needle in entries[book_id][5] for needle in needles)
+                ]
+
+            # Книги, название которых начинается с запроса, показываем первыми
+            prefix = ' '.join(terms)
+            best = heapq.nsmallest(limit, candidates, key=lambda book_id: (
+                not entries[book_id][4].startswith(prefix),
+                entries[book_id][4],
+            ))
+            return [(book_id, entries[book_id]) for book_id in best]
+
+    def suggest(self, query, limit=10):
+        self.ensure_loaded()
+        matches = self.search(query, limit=limit)
+        availability = dict(
+            Book.objects.filter(pk__in=[book_id for book_id, _ in matches])
+            .values_list('id', 'available_copies')
+        )
+
+        results = []
+        for book_id, (title, author, cover_url, *_) in matches:
+            if book_id not in availability:
+                continue
+            available_copies = availability[book_id]
+            results.append({
+                'id': book_id,
+                'title': title,
+                'author': author,
+                'is_available': available_copies > 0,
+                'available_copies': available_copies,
+                'cover_url': cover_url,
+                'detail_url': f'/books/{book_id}/'
+            })
+        return results
+
+
+autocomplete_index = AutocompleteIndex(
+    max_age=getattr(settings, 'BOOK_AUTOCOMPLETE_MAX_AGE', 600)
+)
+
+
+def schedule_index_update(book_ids):
+    transaction.on_commit(lambda: autocomplete_index.update_books(list(book_ids)))
+
+
+def schedule_index_removal(book_id):
+    transaction.on_commit(lambda: autocomplete_index.remove_book(book_id))
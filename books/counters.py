@@ -0,0 +1,97 @@
+"""
+Денормализованные счётчики книг у жанров и авторов.
+
+book_count — число книг, available_book_count — число книг, у которых есть
+свободные экземпляры. Счётчики меняются F()-выражениями в той же транзакции,
+что и сама книга; rebuild_book_counters() пересчитывает их одним запросом
+на таблицу, если они разошлись с данными.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Author, Book, Genre
+
+
+def book_counter_state(author_id, genre_id, available_copies):
+    return (author_id, genre_id, available_copies > 0)
+
+
+def _apply(author_id, genre_id, books, available):
+    updates = {}
+    if books:
+        updates['book_count'] = F('book_count') + books
+    if available:
+        updates['available_book_count'] = F('available_book_count') + available
+    if not updates:
+        return
+    if author_id:
+        Author.objects.filter(pk=author_id).update(**updates)
+    if genre_id:
+        Genre.objects.filter(pk=genre_id).update(**updates)
+
+
+def apply_book_change(old_state, new_state):
+    """
+    Переносит книгу из old_state в new_state; состояние — (author_id, genre_id, is_available)
+    или None для несуществующей книги. Вызывать внутри транзакции.
+    """
+    if old_state == new_state:
+        return
+
+    if old_state and new_state and old_state[:2] == new_state[:2]:
+        # Изменилась только доступность
+        _apply(new_state[0], new_state[1], 0, int(new_state[2]) - int(old_state[2]))
+        return
+
+    if old_state:
+        _apply(old_state[0], old_state[1], -1, -int(old_state[2]))
+    if new_state:
+        _apply(new_state[0], new_state[1], 1, int(new_state[2]))
+
+
+def apply_availability_change(book_ids_to_available=(), book_ids_to_unavailable=()):
+    """Учитывает переходы доступности группы книг (например, после массового возврата)."""
+    for book_ids, delta in ((book_ids_to_available, 1), (book_ids_to_unavailable, -1)):
+        if not book_ids:
+            continue
+        rows = Book.objects.filter(pk__in=book_ids).values_list('author_id', 'genre_id')
+        for author_id, genre_id in rows:
+            _apply(author_id, genre_id, 0, delta)
+
+
+def _count_subquery(related_field, available_only=False):
+    books = Book.objects.filter(**{related_field: OuterRef('pk')})
+    if available_only:
+        books = books.filter(available_copies__gt=0)
+    return Coalesce(
+        Subquery(
+            books.order_by().values(related_field).annotate(total=Count('id')).values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def rebuild_book_counters():
+    authors = Author.objects.update(
+        book_count=_count_subquery('author'),
+        available_book_count=_count_subquery('author', available_only=True),
+    )
+    genres = Genre.objects.update(
+        book_count=_count_subquery('genre'),
+        available_book_count=_count_subquery('genre', available_only=True),
+    )
+    return authors, genres
+
+
+def counters_out_of_sync():
+    """Количество авторов и жанров, у которых счётчики расходятся с фактическими данными."""
+    authors = Author.objects.annotate(
+        actual=Count('books'),
+        actual_available=Count('books', filter=Q(books__available_copies__gt=0)),
+    ).exclude(book_count=F('actual'), available_book_count=F('actual_available')).count()
+    genres = Genre.objects.annotate(
+        actual=Count('books'),
+        actual_available=Count('books', filter=Q(books__available_copies__gt=0)),
+    ).exclude(book_count=F('actual'), available_book_count=F('actual_available')).count()
+    return authors, genres
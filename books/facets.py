@@ -0,0 +1,73 @@
+"""
+Фасеты каталога: количество книг по жанрам, десятилетиям публикации и
+доступности для текущей выборки. Все три фасета считаются одним
+сгруппированным запросом и кэшируются по нормализованным параметрам поиска.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import BooleanField, Case, Count, F, Value, When
+
+FACET_CACHE_TIMEOUT = 60  # секунд
+
+
+def facet_cache_key(params):
+    normalized = json.dumps(
+        {name: str(value).strip().lower() for name, value in params.items() if value not in (None, '')},
+        sort_keys=True,
+    )
+    return 'books:facets:' + hashlib.md5(normalized.encode()).hexdigest()
+
+
+def compute_facets(queryset):
+    rows = (
+        queryset.order_by()
+        .annotate(
+            decade=F('publication_year') / 10 * 10,
+            in_stock=Case(
+                When(available_copies__gt=0, then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            ),
+        )
+        .values('genre_id', 'genre__name', 'decade', 'in_stock')
+        .annotate(count=Count('id'))
+    )
+
+    genres = {}
+    decades = {}
+    availability = {'available': 0, 'unavailable': 0}
+    total = 0
+    for row in rows:
+        count = row['count']
+        total += count
+
+        genre = genres.setdefault(row['genre_id'], {
+            'id': row['genre_id'],
+            'name': row['genre__name'] or 'No Genre',
+            'count': 0,
+        })
+        genre['count'] += count
+
+        decades[row['decade']] = decades.get(row['decade'], 0) + count
+        availability['available' if row['in_stock'] else 'unavailable'] += count
+
+    return {
+        'total': total,
+        'genres': sorted(genres.values(), key=lambda genre: (-genre['count'], genre['name'])),
+        'decades': [
+            {'decade': decade, 'count': count}
+            for decade, count in sorted(decades.items(), reverse=True)
+        ],
+        'availability': availability,
+    }
+
+
+def get_facets(queryset, params):
+    key = facet_cache_key(params)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset)
+        cache.set(key, facets, FACET_CACHE_TIMEOUT)
+    return facets
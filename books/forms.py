@@ -15,4 +15,5 @@ class BookSearchForm(forms.Form):
     query = forms.CharField(required=False, label='Search')
     genre = forms.ModelChoiceField(queryset=Genre.objects.all(), required=False, empty_label='All Genres')
     publication_year = forms.IntegerField(required=False, min_value=1000, max_value=2100)
+    decade = forms.IntegerField(required=False, min_value=1000, max_value=2100, widget=forms.HiddenInput)
     author = forms.ModelChoiceField(queryset=Author.objects.all(), required=False, empty_label='All Authors')
\ No newline at end of file
@@ -0,0 +1,87 @@
+import random
+import statistics
+import string
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from books.autocomplete import GENERATION_CACHE_KEY, AutocompleteIndex
+
+
+WORDS = [
+    'war', 'peace', 'crime', 'punishment', 'pride', 'prejudice', 'history', 'garden', 'night',
+    'river', 'secret', 'shadow', 'winter', 'summer', 'stone', 'empire', 'journey', 'kingdom',
+    'silent', 'ocean', 'mountain', 'letters', 'memory', 'island', 'fire', 'glass', 'house',
+]
+
+
+def _percentiles(timings):
+    timings = sorted(timings)
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+def _word(rng):
+    if rng.random() < 0.5:
+        return rng.choice(WORDS)
+    return ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure typeahead latency on synthetic catalogs: the in-memory index alone '
+        'and suggest() with its availability query'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+        parser.add_argument('--queries', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        for size in options['sizes']:
+            rows = [
+                (
+                    book_id,
+                    ' '.join(_word(rng) for _ in range(rng.randint(1, 5))).title(),
+                    f"{_word(rng).title()} {_word(rng).title()}",
+                    f"{9780000000000 + book_id}",
+                    '',
+                )
+                for book_id in range(1, size + 1)
+            ]
+
+            started = time.perf_counter()
+            index = AutocompleteIndex.from_rows(rows)
+            build_seconds = time.perf_counter() - started
+
+            queries = []
+            for _ in range(options['queries']):
+                title = rng.choice(rows)[1].lower().split()
+                words = title[:rng.randint(1, len(title))]
+                words[-1] = words[-1][:rng.randint(1, len(words[-1]))]
+                queries.append(' '.join(words))
+
+            # Синтетический индекс считается актуальным, иначе suggest() перестроит его из БД
+            index._generation = cache.get(GENERATION_CACHE_KEY)
+
+            search_timings = []
+            suggest_timings = []
+            for query in queries:
+                started = time.perf_counter()
+                index.search(query)
+                search_timings.append((time.perf_counter() - started) * 1000)
+
+                # Полный путь запроса: поиск по индексу и выборка доступных экземпляров из БД
+                started = time.perf_counter()
+                index.suggest(query)
+                suggest_timings.append((time.perf_counter() - started) * 1000)
+
+            search_p50, search_p99 = _percentiles(search_timings)
+            suggest_p50, suggest_p99 = _percentiles(suggest_timings)
+            self.stdout.write(
+                f'{size:>9} titles: build {build_seconds:.1f}s, '
+                f'index p50 {search_p50:.3f}ms p99 {search_p99:.3f}ms, '
+                f'suggest p50 {suggest_p50:.3f}ms p99 {suggest_p99:.3f}ms over {len(queries)} queries'
+            )
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from books.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for all books'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = rebuild_search_index(batch_size=options['batch_size'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully indexed {count} books')
+        )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from books.counters import counters_out_of_sync, rebuild_book_counters
+
+
+class Command(BaseCommand):
+    help = 'Rebuild denormalized book counters on genres and authors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report counters that are out of sync')
+
+    def handle(self, *args, **options):
+        authors, genres = counters_out_of_sync()
+        self.stdout.write(f'{authors} authors and {genres} genres have out-of-sync counters')
+
+        if options['check']:
+            return
+
+        authors, genres = rebuild_book_counters()
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt counters for {authors} authors and {genres} genres')
+        )
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:19
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_search_vector_index(apps, schema_editor):
+    # GIN-индекс по tsvector поддерживается только PostgreSQL
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS books_book_search_vector_gin '
+            'ON books_book USING gin (search_vector)'
+        )
+
+
+def drop_search_vector_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS books_book_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_document',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='BookSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100)),
+                ('weight', models.PositiveSmallIntegerField(default=1)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='books.book')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('term', 'book'), name='unique_book_search_term')],
+            },
+        ),
+        migrations.RunPython(create_search_vector_index, drop_search_vector_index),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:31
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+
+    def count_books(related_field, available_only=False):
+        books = Book.objects.filter(**{related_field: OuterRef('pk')})
+        if available_only:
+            books = books.filter(available_copies__gt=0)
+        return Coalesce(
+            Subquery(
+                books.order_by().values(related_field).annotate(total=Count('id')).values('total'),
+                output_field=IntegerField(),
+            ),
+            0,
+        )
+
+    for model_name, related_field in (('Author', 'author'), ('Genre', 'genre')):
+        apps.get_model('books', model_name).objects.update(
+            book_count=count_books(related_field),
+            available_book_count=count_books(related_field, available_only=True),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_listing_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='available_book_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='author',
+            name='book_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='available_book_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='book_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
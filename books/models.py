@@ -1,9 +1,12 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
 
 
 class Genre(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
+    book_count = models.PositiveIntegerField(default=0, editable=False)
+    available_book_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
@@ -18,15 +21,31 @@ class Author(models.Model):
     bio = models.TextField(blank=True)
     date_of_birth = models.DateField(null=True, blank=True)
     date_of_death = models.DateField(null=True, blank=True)
+    book_count = models.PositiveIntegerField(default=0, editable=False)
+    available_book_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Имя автора входит в поисковый документ каждой его книги
+        from .autocomplete import schedule_index_update
+        from .search import update_search_index
+        books = list(self.books.all())
+        for book in books:
+            book.author = self
+            update_search_index(book)
+        if books:
+            schedule_index_update([book.pk for book in books])
+
     class Meta:
         ordering = ['last_name', 'first_name']
 
 
 class Book(models.Model):
+    SEARCH_FIELDS = {'title', 'author', 'isbn', 'publisher', 'description'}
+
     title = models.CharField(max_length=200)
     author = models.ForeignKey(Author, on_delete=models.CASCADE, related_name='books')
     isbn = models.CharField(max_length=13, unique=True)
@@ -39,6 +58,8 @@ class Book(models.Model):
     cover_image = models.ImageField(upload_to='book_covers/', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    search_document = models.TextField(blank=True, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self):
         return self.title
@@ -48,7 +69,32 @@ class Book(models.Model):
             self.available_copies = self.total_copies
         if self.available_copies < 0:
             self.available_copies = 0
-        super().save(*args, **kwargs)
+
+        from .counters import apply_book_change, book_counter_state
+        with transaction.atomic():
+            old_state = None
+            old_indexed = None
+            if not self._state.adding:
+                row = Book.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'author_id', 'genre_id', 'available_copies', 'title', 'isbn', 'cover_image'
+                ).first()
+                if row:
+                    old_state = book_counter_state(*row[:3])
+                    old_indexed = (row[0], row[3], row[4], row[5] or '')
+            super().save(*args, **kwargs)
+            apply_book_change(
+                old_state,
+                book_counter_state(self.author_id, self.genre_id, self.available_copies)
+            )
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or set(update_fields) & self.SEARCH_FIELDS:
+            from .autocomplete import schedule_index_update
+            from .search import update_search_index
+            update_search_index(self)
+            # Изменение индекса автодополнения перестраивает его во всех воркерах — только если менялись его поля
+            if old_indexed != (self.author_id, self.title, self.isbn, self.cover_image.name or ''):
+                schedule_index_update([self.pk])
 
     @property
     def is_available(self):
@@ -58,6 +104,22 @@ class Book(models.Model):
         ordering = ['title']
         indexes = [
             models.Index(fields=['title']),
+            models.Index(fields=['title', 'id']),
             models.Index(fields=['isbn']),
             models.Index(fields=['publication_year']),
-        ]
\ No newline at end of file
+        ]
+
+
+class BookSearchTerm(models.Model):
+    """Inverted index of the catalog for databases without full-text search."""
+    term = models.CharField(max_length=100)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='search_terms')
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.term} -> {self.book_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'book'], name='unique_book_search_term'),
+        ]
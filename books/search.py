@@ -0,0 +1,133 @@
+"""
+Полнотекстовый поиск по каталогу.
+
+Для каждой книги хранится поисковый документ (название, авторы, издатель,
+ISBN, описание). В PostgreSQL он индексируется как tsvector с GIN-индексом,
+на остальных базах (SQLite для локальной разработки) используется встроенный
+инвертированный индекс BookSearchTerm.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, F, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .models import Book, BookSearchTerm
+
+SEARCH_CONFIG = 'simple'
+TERM_MAX_LENGTH = 100
+MAX_QUERY_TERMS = 8
+# ts_rank возвращает real: в курсоре keyset-пагинации он не совпал бы с хранимым
+# значением, поэтому ранг округляется до numeric, и по нему же идёт сортировка
+RANK_FIELD = DecimalField(max_digits=12, decimal_places=6)
+
+# Веса полей: буквы для tsvector, числа для инвертированного индекса
+FIELD_WEIGHTS = {
+    'title': ('A', 8),
+    'author': ('A', 8),
+    'isbn': ('A', 8),
+    'publisher': ('B', 4),
+    'description': ('C', 1),
+}
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    return [token[:TERM_MAX_LENGTH] for token in TOKEN_RE.findall((text or '').lower())]
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def book_document_fields(book):
+    author = book.author
+    return {
+        'title': book.title,
+        'author': f"{author.first_name} {author.last_name}",
+        'isbn': book.isbn,
+        'publisher': book.publisher,
+        'description': book.description,
+    }
+
+
+def update_search_index(book):
+    fields = book_document_fields(book)
+    document = ' '.join(tokenize(' '.join(fields.values())))
+
+    if uses_postgres():
+        vector = None
+        for name, text in fields.items():
+            part = SearchVector(Value(text), weight=FIELD_WEIGHTS[name][0], config=SEARCH_CONFIG)
+            vector = part if vector is None else vector + part
+        Book.objects.filter(pk=book.pk).update(search_document=document, search_vector=vector)
+        return
+
+    terms = {}
+    for name, text in fields.items():
+        weight = FIELD_WEIGHTS[name][1]
+        for token in tokenize(text):
+            terms[token] = max(terms.get(token, 0), weight)
+
+    with transaction.atomic():
+        Book.objects.filter(pk=book.pk).update(search_document=document)
+        BookSearchTerm.objects.filter(book=book).delete()
+        BookSearchTerm.objects.bulk_create([
+            BookSearchTerm(term=term, book_id=book.pk, weight=weight)
+            for term, weight in terms.items()
+        ])
+
+
+def rebuild_search_index(batch_size=500):
+    count = 0
+    books = Book.objects.select_related('author').order_by('pk')
+    for book in books.iterator(chunk_size=batch_size):
+        update_search_index(book)
+        count += 1
+    return count
+
+
+def search_books(query, queryset=None):
+    """
+    Возвращает книги, содержащие все слова запроса (по префиксу),
+    отсортированные по релевантности. Аннотирует поле search_rank — точное
+    значение (numeric или целое), пригодное для keyset-пагинации.
+    """
+    if queryset is None:
+        queryset = Book.objects.all()
+
+    terms = tokenize(query)[:MAX_QUERY_TERMS]
+    if not terms:
+        return queryset.none()
+
+    if uses_postgres():
+        tsquery = SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms),
+            search_type='raw',
+            config=SEARCH_CONFIG,
+        )
+        return queryset.filter(search_vector=tsquery).annotate(
+            search_rank=Cast(SearchRank(F('search_vector'), tsquery), output_field=RANK_FIELD)
+        ).order_by('-search_rank', 'title', 'pk')
+
+    # Каждое слово запроса должно совпасть хотя бы с одним термином книги
+    hits = {
+        f'hit_{i}': Max(Case(When(term__startswith=term, then=Value(1)), default=Value(0)))
+        for i, term in enumerate(terms)
+    }
+    prefix_match = Q()
+    for term in terms:
+        prefix_match |= Q(term__startswith=term)
+
+    ranked = (
+        BookSearchTerm.objects.filter(prefix_match, book=OuterRef('pk'))
+        .values('book')
+        .annotate(rank=Sum('weight'), **hits)
+        .filter(**{name: 1 for name in hits})
+        .values('rank')
+    )
+    return queryset.annotate(
+        search_rank=Subquery(ranked[:1])
+    ).filter(search_rank__isnull=False).order_by('-search_rank', 'title', 'pk')
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .autocomplete import schedule_index_removal
+from .counters import apply_book_change, book_counter_state
+from .models import Book
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    # Срабатывает и при каскадном удалении (например, вместе с автором)
+    apply_book_change(
+        book_counter_state(instance.author_id, instance.genre_id, instance.available_copies),
+        None
+    )
+    schedule_index_removal(instance.pk)
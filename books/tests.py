@@ -1,3 +1,263 @@
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+
+from accounts.models import User
+from loans import circulation
+from . import autocomplete
+from .autocomplete import GENERATION_CACHE_KEY, STALE, AutocompleteIndex
+from .counters import counters_out_of_sync
+from .models import Author, Book, BookSearchTerm, Genre
+from .search import FIELD_WEIGHTS, search_books, tokenize, update_search_index, uses_postgres
+
+
+class AutocompleteSearchTests(TestCase):
+    def test_frequent_terms_are_not_truncated(self):
+        rows = [(book_id, f'Zeta alpha {book_id}', 'Ann Lee', f'97800000{book_id:05d}', '')
+                for book_id in range(1, 40)]
+        rows += [(100, 'Alpha and omega', 'Ann Lee', '9780000000100', ''),
+                 (101, 'Alpaca tales', 'Ann Lee', '9780000000101', '')]
+        index = AutocompleteIndex.from_rows(rows)
+
+        def expected(query, limit):
+            terms = tokenize(query)
+            prefix = ' '.join(terms)
+            matches = [
+                (' '.join(tokenize(title)), book_id) for book_id, title, author, *_ in rows
+                if all(any(token.startswith(term) for token in tokenize(f'{title} {author}')) for term in terms)
+            ]
+            matches.sort(key=lambda match: (not match[0].startswith(prefix), match))
+            return [book_id for _, book_id in matches[:limit]]
+
+        with mock.patch.object(autocomplete, 'MAX_SCAN', 5):
+            for query, limit in (('alp', 3), ('alp', 10), ('alpha ann', 10), ('lee ann', 45)):
+                self.assertEqual([book_id for book_id, _ in index.search(query, limit)], expected(query, limit))
+
+
+class AutocompleteGenerationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        self.book = Book.objects.create(title='War and Peace', author=author, isbn='9780000000001',
+                                        publication_year=1869, publisher='Russky Vestnik')
+        cache.set(GENERATION_CACHE_KEY, 1, None)
+
+    def test_own_generation_only_when_previous_was_own(self):
+        first, second = AutocompleteIndex(), AutocompleteIndex()
+        first.load()
+        second.load()
+
+        Book.objects.filter(pk=self.book.pk).update(title='Anna Karenina')
+        first.update_books([self.book.pk])
+        self.assertEqual(first._generation, 2)
+        self.assertFalse(first._is_stale())
+        self.assertTrue(second._is_stale())
+
+        # second не видел изменения first — после своего увеличения поколения он устарел
+        Book.objects.filter(pk=self.book.pk).update(title='Resurrection')
+        second.update_books([self.book.pk])
+        self.assertIs(second._generation, STALE)
+        self.assertTrue(first._is_stale())
+
+    def test_unchanged_books_do_not_bump_generation(self):
+        index = AutocompleteIndex()
+        index.load()
+        index.update_books([self.book.pk])
+        self.assertEqual(cache.get(GENERATION_CACHE_KEY), 1)
+
+    def test_lost_generation_key_marks_index_stale(self):
+        index = AutocompleteIndex()
+        index.load()
+        cache.clear()
+        Book.objects.filter(pk=self.book.pk).update(title='Anna Karenina')
+        index.update_books([self.book.pk])
+        self.assertEqual(cache.get(GENERATION_CACHE_KEY), 1)
+        self.assertTrue(index._is_stale())
+
+    def test_ensure_loaded_rechecks_under_lock(self):
+        index = AutocompleteIndex()
+        # Индекс перестроил другой поток, пока этот ждал блокировку
+        with mock.patch.object(index, '_is_stale', side_effect=[True, False]), \
+                mock.patch.object(index, 'load') as load:
+            index.ensure_loaded()
+        load.assert_not_called()
+
+    def test_book_save_schedules_update_only_for_indexed_fields(self):
+        with mock.patch.object(autocomplete, 'schedule_index_update') as schedule:
+            self.book.publisher = 'The Russian Messenger'
+            self.book.available_copies = 0
+            self.book.save()
+            schedule.assert_not_called()
+
+            self.book.title = 'Anna Karenina'
+            self.book.save()
+            schedule.assert_called_once_with([self.book.pk])
+
+
+class RankedPaginationTests(TestCase):
+    def test_pages_of_ranked_search_cover_every_match_once(self):
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        for i in range(30):
+            # Разные ранги и много равных внутри ранга
+            Book.objects.create(
+                title=f'War {i}' if i % 3 else f'Peace {i}', author=author, isbn=f'97800000{i:05d}',
+                publication_year=1869, publisher='Russky Vestnik', description='war' if i % 2 else '',
+            )
+        expected = list(search_books('war').values_list('pk', flat=True))
+
+        seen = []
+        cursor = ''
+        while True:
+            page = self.client.get(reverse('book_list'), {'query': 'war', 'cursor': cursor}).context['page_obj']
+            seen.extend(book.pk for book in page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 25)
+
+
+@skipIf(uses_postgres(), 'инвертированный индекс BookSearchTerm используется только вне PostgreSQL')
+class SearchIndexFallbackTests(TestCase):
+    """Поиск через BookSearchTerm: веса полей, совпадение всех слов, переиндексация при смене автора."""
+
+    def setUp(self):
+        self.author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+
+    def make_book(self, title, isbn, description=''):
+        return Book.objects.create(title=title, author=self.author, isbn=isbn, publication_year=1869,
+                                   publisher='Russky Vestnik', description=description)
+
+    def test_terms_keep_the_heaviest_field_weight(self):
+        book = self.make_book('Winter Garden', '9780000000001', description='A garden in winter, and snow')
+        weights = dict(BookSearchTerm.objects.filter(book=book).values_list('term', 'weight'))
+        self.assertEqual(weights['winter'], FIELD_WEIGHTS['title'][1])
+        self.assertEqual(weights['snow'], FIELD_WEIGHTS['description'][1])
+        self.assertEqual(weights['tolstoy'], FIELD_WEIGHTS['author'][1])
+
+        # Повторная индексация не дублирует термины
+        update_search_index(book)
+        self.assertEqual(BookSearchTerm.objects.filter(book=book).count(), len(weights))
+
+    def test_title_match_ranks_above_description_match(self):
+        in_description = self.make_book('Anna Karenina', '9780000000001', description='Set in a winter garden')
+        in_title = self.make_book('Winter Garden', '9780000000002')
+        results = list(search_books('garden'))
+        self.assertEqual(results, [in_title, in_description])
+        self.assertGreater(results[0].search_rank, results[1].search_rank)
+
+    def test_every_query_term_must_match_by_prefix(self):
+        both = self.make_book('Winter Garden', '9780000000001')
+        self.make_book('Winter Night', '9780000000002')
+        self.make_book('Summer Garden', '9780000000003')
+        self.assertEqual(list(search_books('gard wint')), [both])
+        self.assertEqual(list(search_books('winter ocean')), [])
+        self.assertEqual(list(search_books('  ,. ')), [])
+
+    def test_author_rename_reindexes_books(self):
+        book = self.make_book('Anna Karenina', '9780000000001')
+        self.assertEqual(list(search_books('tolstoy')), [book])
+
+        self.author.last_name = 'Dostoevsky'
+        self.author.save()
+        self.assertEqual(list(search_books('tolstoy')), [])
+        self.assertEqual(list(search_books('dostoevsky anna')), [book])
+        book.refresh_from_db()
+        self.assertIn('dostoevsky', book.search_document.split())
+
+
+class BookCounterTests(TestCase):
+    """Счётчики жанров и авторов следуют за выдачей, возвратом и изменением книг."""
+
+    def setUp(self):
+        self.author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        self.genre = Genre.objects.create(name='Novel')
+        self.single = self.add_book('War and Peace', '9780000000001', copies=1)
+        self.double = self.add_book('Anna Karenina', '9780000000002', copies=2)
+        self.readers = [User.objects.create_user(f'reader-{i}', password='secret') for i in range(2)]
+
+    def add_book(self, title, isbn, copies):
+        return Book.objects.create(title=title, author=self.author, genre=self.genre, isbn=isbn,
+                                   publication_year=1869, publisher='Russky Vestnik', total_copies=copies,
+                                   available_copies=copies)
+
+    def assert_counts(self, books, available):
+        for owner in (self.author, self.genre):
+            owner.refresh_from_db()
+            self.assertEqual((owner.book_count, owner.available_book_count), (books, available))
+
+    def assert_copies(self, book, available):
+        book.refresh_from_db()
+        self.assertEqual(book.available_copies, available)
+
+    def test_borrow_and_return(self):
+        self.assert_counts(2, 2)
+        loan = circulation.borrow_book(self.readers[0], self.single)
+        self.assert_copies(self.single, 0)
+        self.assert_counts(2, 1)
+
+        # Книга с двумя экземплярами остаётся доступной после первой выдачи
+        circulation.borrow_book(self.readers[0], self.double)
+        self.assert_copies(self.double, 1)
+        self.assert_counts(2, 1)
+        circulation.borrow_book(self.readers[1], self.double)
+        self.assert_copies(self.double, 0)
+        self.assert_counts(2, 0)
+
+        circulation.return_loan(loan)
+        self.assert_copies(self.single, 1)
+        self.assert_counts(2, 1)
+        with self.assertRaises(circulation.CirculationError):
+            circulation.return_loan(loan)
+        self.assert_copies(self.single, 1)
+
+    def test_restock(self):
+        for reader in self.readers:
+            circulation.borrow_book(reader, self.double)
+        circulation.borrow_book(self.readers[0], self.single)
+        self.assert_counts(2, 0)
+
+        circulation.restock_copies({self.double.pk: 2, self.single.pk: 1})
+        self.assert_copies(self.double, 2)
+        self.assert_copies(self.single, 1)
+        self.assert_counts(2, 2)
+
+        # Экземпляров не больше, чем всего есть
+        circulation.restock_copies({self.double.pk: 1})
+        self.assert_copies(self.double, 2)
+        self.assert_counts(2, 2)
+
+    def test_book_moves_and_deletion(self):
+        other = Genre.objects.create(name='Drama')
+        self.single.available_copies = 0
+        self.single.genre = other
+        self.single.save()
+        other.refresh_from_db()
+        self.assertEqual((other.book_count, other.available_book_count), (1, 0))
+        self.genre.refresh_from_db()
+        self.assertEqual((self.genre.book_count, self.genre.available_book_count), (1, 1))
+
+        self.double.delete()
+        self.genre.refresh_from_db()
+        self.assertEqual((self.genre.book_count, self.genre.available_book_count), (0, 0))
+        self.author.refresh_from_db()
+        self.assertEqual((self.author.book_count, self.author.available_book_count), (1, 0))
+
+    def test_reconcile_repairs_drifted_counters(self):
+        # Обновление мимо save() и сигналов — счётчики расходятся с данными
+        Book.objects.filter(pk=self.single.pk).update(available_copies=0)
+        Genre.objects.filter(pk=self.genre.pk).update(book_count=7)
+        self.assertEqual(counters_out_of_sync(), (1, 1))
+
+        out = StringIO()
+        call_command('reconcile_book_counters', '--check', stdout=out)
+        self.assertIn('1 authors and 1 genres have out-of-sync counters', out.getvalue())
+        self.assertEqual(counters_out_of_sync(), (1, 1))
 
-# Create your tests here.
+        call_command('reconcile_book_counters', stdout=StringIO())
+        self.assertEqual(counters_out_of_sync(), (0, 0))
+        self.assert_counts(2, 1)
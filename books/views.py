@@ -1,11 +1,13 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.db.models import Q
 from django.http import JsonResponse
-from django.core.paginator import Paginator
+from library_management.pagination import CursorPaginator
 from .models import Book, Author, Genre
 from .forms import BookForm, BookSearchForm
+from .autocomplete import autocomplete_index
+from .facets import get_facets
+from .search import search_books
 
 
 def is_librarian(user):
@@ -15,23 +17,26 @@ def is_librarian(user):
 def book_list(request):
     form = BookSearchForm(request.GET or None)
     books = Book.objects.all().select_related('author', 'genre')
+    facet_params = {}
 
     if form.is_valid():
         query = form.cleaned_data.get('query')
         genre = form.cleaned_data.get('genre')
         publication_year = form.cleaned_data.get('publication_year')
+        decade = form.cleaned_data.get('decade')
         author = form.cleaned_data.get('author')
         available_only = request.GET.get('available_only')
+        facet_params = {
+            'query': query,
+            'genre': genre.pk if genre else None,
+            'publication_year': publication_year,
+            'decade': decade,
+            'author': author.pk if author else None,
+            'available_only': available_only,
+        }
 
         if query:
-            books = books.filter(
-                Q(title__icontains=query) |
-                Q(author__first_name__icontains=query) |
-                Q(author__last_name__icontains=query) |
-                Q(isbn__icontains=query) |
-                Q(publisher__icontains=query) |
-                Q(description__icontains=query)
-            )
+            books = search_books(query, books)
 
         if genre:
             books = books.filter(genre=genre)
@@ -39,16 +44,21 @@ def book_list(request):
         if publication_year:
             books = books.filter(publication_year=publication_year)
 
+        if decade:
+            books = books.filter(publication_year__gte=decade, publication_year__lt=decade + 10)
+
         if author:
             books = books.filter(author=author)
 
         if available_only:
             books = books.filter(available_copies__gt=0)
 
-    # Пагинация
-    paginator = Paginator(books, 12)  # 12 книг на страницу
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    facets = get_facets(books, facet_params)
+    ordering = ('-search_rank', 'title', 'id') if facet_params.get('query') else ('title', 'id')
+
+    # Пагинация: 12 книг на страницу, общее количество уже посчитано в фасетах
+    paginator = CursorPaginator(books, 12, ordering, count=facets['total'])
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
     genres = Genre.objects.all()
     authors = Author.objects.all()
@@ -57,7 +67,8 @@ def book_list(request):
         'page_obj': page_obj,
         'form': form,
         'genres': genres,
-        'authors': authors
+        'authors': authors,
+        'facets': facets
     })
 
 
@@ -151,15 +162,10 @@ def book_delete(request, pk):
 
 def book_search(request):
     query = request.GET.get('q', '')
-    books = Book.objects.all()
+    books = Book.objects.all().select_related('author', 'genre')
 
     if query:
-        books = books.filter(
-            Q(title__icontains=query) |
-            Q(author__first_name__icontains=query) |
-            Q(author__last_name__icontains=query) |
-            Q(isbn__icontains=query)
-        )[:20]  # Ограничиваем результаты
+        books = search_books(query, books)[:20]  # Ограничиваем результаты
 
     return render(request, 'books/search.html', {
         'books': books,
@@ -169,34 +175,17 @@ def book_search(request):
 
 def book_search_api(request):
     query = request.GET.get('q', '')
-    if query:
-        books = Book.objects.filter(
-            Q(title__icontains=query) |
-            Q(author__first_name__icontains=query) |
-            Q(author__last_name__icontains=query) |
-            Q(isbn__icontains=query)
-        )[:10]
-
-        results = [{
-            'id': book.id,
-            'title': book.title,
-            'author': str(book.author),
-            'is_available': book.is_available,
-            'available_copies': book.available_copies,
-            'cover_url': book.cover_image.url if book.cover_image else '',
-            'detail_url': f'/books/{book.id}/'
-        } for book in books]
-    else:
-        results = []
-
+    results = autocomplete_index.suggest(query) if query else []
     return JsonResponse({'results': results})
 
 
 def genre_list(request):
-    genres = Genre.objects.all().prefetch_related('books')
-    return render(request, 'books/genre_list.html', {'genres': genres})
+    paginator = CursorPaginator(Genre.objects.all(), 30, ('name', 'id'))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    return render(request, 'books/genre_list.html', {'genres': page_obj, 'page_obj': page_obj})
 
 
 def author_list(request):
-    authors = Author.objects.all().prefetch_related('books')
-    return render(request, 'books/author_list.html', {'authors': authors})
\ No newline at end of file
+    paginator = CursorPaginator(Author.objects.all(), 30, ('last_name', 'first_name', 'id'))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    return render(request, 'books/author_list.html', {'authors': page_obj, 'page_obj': page_obj})
\ No newline at end of file
@@ -3,6 +3,13 @@ ASGI config for library_management project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The unread-notification stream (notifications.views.unread_count_stream) keeps
+a connection open per browser tab and is only served over ASGI, e.g.:
+
+    gunicorn library_management.asgi:application -k uvicorn.workers.UvicornWorker
+
+Under WSGI the stream answers 204 and pages fall back to ETag polling.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
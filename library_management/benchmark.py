@@ -0,0 +1,18 @@
+"""
+Базовый класс команд benchmark_*.
+
+Бенчмарки создают и удаляют собственные строки и нагружают базу, поэтому
+запускаются только с DEBUG=True — с рабочими настройками команда откажется.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class BenchmarkCommand(BaseCommand):
+    def execute(self, *args, **options):
+        if not settings.DEBUG:
+            raise CommandError(
+                'Benchmarks write to the configured database; run them with DEBUG=True '
+                'against a development database.'
+            )
+        return super().execute(*args, **options)
@@ -0,0 +1,236 @@
+"""
+Keyset-пагинация (seek method) для больших списков.
+
+В отличие от django.core.paginator.Paginator не делает COUNT(*) и OFFSET:
+каждая страница выбирается условием по индексированной паре (ключ сортировки, id)
+относительно последней строки предыдущей страницы. Курсоры непрозрачны для клиента.
+"""
+import base64
+import binascii
+import datetime
+import json
+import math
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Q
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(data):
+    raw = json.dumps(data, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    if not isinstance(data, dict):
+        return None
+    return data
+
+
+def _page_number(data, default):
+    # None — номер неизвестен (страницы, отсчитанные от последней без COUNT)
+    if data.get('p') is None:
+        return default
+    try:
+        return max(1, int(data['p']))
+    except (TypeError, ValueError):
+        return default
+
+
+def _shift(number, delta):
+    return None if number is None else number + delta
+
+
+def estimate_count(queryset):
+    """
+    Оценка количества строк. В PostgreSQL берётся из плана запроса (без сканирования),
+    на остальных базах выполняется обычный COUNT.
+    """
+    if connection.vendor == 'postgresql':
+        try:
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            return int(plan[0]['Plan']['Plan Rows'])
+        except (ValueError, KeyError, IndexError, TypeError):
+            pass
+    return queryset.count()
+
+
+class CursorPage:
+    def __init__(self, object_list, paginator, number, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.number = number
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return self.paginator.cursor_for(self.object_list[-1], 'n', _shift(self.number, 1))
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        return self.paginator.cursor_for(self.object_list[0], 'p', _shift(self.number, -1))
+
+    @property
+    def last_cursor(self):
+        return encode_cursor({'d': 'last'})
+
+    @property
+    def count(self):
+        return self.paginator.count
+
+    @property
+    def count_is_estimate(self):
+        return self.paginator.count_is_estimate
+
+    @property
+    def num_pages(self):
+        return self.paginator.num_pages
+
+
+class CursorPaginator:
+    """
+    ordering — последовательность полей вида ('-borrowed_date', '-id');
+    последнее поле должно быть уникальным, чтобы порядок был строгим.
+    Значения ключей должны быть точными (не float): курсор сравнивает их на
+    равенство с сохранёнными в нём значениями.
+
+    count: 'exact' — точный COUNT, 'estimate' — оценка по плану запроса,
+    None — не считать; также можно передать уже известное число.
+    """
+
+    def __init__(self, queryset, per_page, ordering, count='estimate'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self._count_mode = count
+        self._count = None
+
+    @property
+    def fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    @property
+    def count(self):
+        if self._count is None:
+            if isinstance(self._count_mode, int):
+                self._count = self._count_mode
+            elif self._count_mode == 'exact':
+                self._count = self.queryset.count()
+            elif self._count_mode == 'estimate':
+                self._count = estimate_count(self.queryset)
+        return self._count
+
+    @property
+    def count_is_estimate(self):
+        return self._count_mode == 'estimate' and connection.vendor == 'postgresql'
+
+    @property
+    def num_pages(self):
+        if self.count is None:
+            return None
+        return max(1, math.ceil(self.count / self.per_page))
+
+    def cursor_for(self, obj, direction, number):
+        values = [_encode_value(getattr(obj, name)) for name, _ in self.fields]
+        return encode_cursor({'v': values, 'd': direction, 'p': number})
+
+    def _seek_filter(self, values, forward):
+        # (a, b) после (x, y): a > x OR (a = x AND b > y); для убывающих полей — наоборот
+        fields = self.fields
+        condition = Q()
+        for i, (name, descending) in enumerate(fields):
+            lookup = 'lt' if descending == forward else 'gt'
+            clause = Q(**{f'{name}__{lookup}': values[i]})
+            for j in range(i):
+                clause &= Q(**{fields[j][0]: values[j]})
+            condition |= clause
+        return condition
+
+    def _reversed_ordering(self):
+        return [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+
+    def _fetch(self, ordering, values, forward, limit):
+        """Строки после values (или с начала, если values is None) в порядке ordering."""
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._seek_filter(values, forward=forward))
+        return list(queryset.order_by(*ordering)[:limit])
+
+    def page(self, cursor=None):
+        try:
+            return self._page(cursor)
+        except (ValidationError, ValueError, TypeError):
+            # Подделанный или устаревший курсор — показываем первую страницу
+            return self._page(None)
+
+    def _page(self, cursor):
+        data = decode_cursor(cursor) if cursor else None
+        direction = data.get('d') if data else None
+        values = data.get('v') if data else None
+
+        if direction in ('n', 'p') and (not isinstance(values, list) or len(values) != len(self.ordering)):
+            direction = None
+
+        if direction == 'last':
+            rows = self._fetch(self._reversed_ordering(), None, False, self.per_page + 1)
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            # Без COUNT номер последней страницы неизвестен, если она не единственная
+            number = self.num_pages or (None if has_previous else 1)
+            return CursorPage(rows, self, number, has_next=False, has_previous=has_previous)
+
+        if direction == 'p':
+            rows = self._fetch(self._reversed_ordering(), values, False, self.per_page + 1)
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            number = _page_number(data, None)
+            return CursorPage(rows, self, number, has_next=True, has_previous=has_previous)
+
+        number = 1
+        if direction == 'n':
+            number = _page_number(data, None)
+        else:
+            values = None
+        rows = self._fetch(self.ordering, values, True, self.per_page + 1)
+        has_next = len(rows) > self.per_page
+        return CursorPage(rows[:self.per_page], self, number, has_next=has_next, has_previous=direction == 'n')
+
+    def get_page(self, cursor=None):
+        return self.page(cursor)
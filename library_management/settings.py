@@ -74,6 +74,16 @@ DATABASES = {
     )
 }
 
+# Cache: общий для всех процессов (веб-воркеры, команды рассылки) через Redis.
+# Без REDIS_URL — кэш процесса: блокировки и сброс кэшей действуют только внутри него.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
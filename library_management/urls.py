@@ -4,6 +4,8 @@ from django.views.generic import TemplateView
 from django.conf import settings
 from django.conf.urls.static import static
 
+from reports.views import dashboard
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('accounts.urls')),
@@ -12,7 +14,7 @@ urlpatterns = [
     path('notifications/', include('notifications.urls')),
     path('reports/', include('reports.urls')),
     path('', TemplateView.as_view(template_name='index.html'), name='home'),
-    path('dashboard/', TemplateView.as_view(template_name='dashboard.html'), name='dashboard'),
+    path('dashboard/', dashboard, name='dashboard'),
     path('api/', include('api.urls')),
     path('api-auth/', include('rest_framework.urls')),
 ]
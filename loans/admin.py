@@ -1,9 +1,41 @@
+from django import forms
 from django.contrib import admin
+from . import circulation
 from .models import Loan, Reservation
 
 
+class LoanAdminForm(forms.ModelForm):
+    class Meta:
+        model = Loan
+        fields = '__all__'
+
+    def clean_returned_date(self):
+        returned_date = self.cleaned_data['returned_date']
+        if self.instance.pk and self.instance.returned_date and not returned_date:
+            raise forms.ValidationError('A returned loan cannot be reopened.')
+        return returned_date
+
+
+class ReservationAdminForm(forms.ModelForm):
+    class Meta:
+        model = Reservation
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        user, book = cleaned_data.get('user'), cleaned_data.get('book')
+        if self.instance.pk or not user or not book:
+            return cleaned_data
+        if Reservation.objects.filter(user=user, book=book, status__in=['pending', 'available']).exists():
+            raise forms.ValidationError('This reader already has an active reservation for this book.')
+        if Loan.objects.filter(user=user, book=book, returned_date__isnull=True).exists():
+            raise forms.ValidationError('This reader already has this book on loan.')
+        return cleaned_data
+
+
 @admin.register(Loan)
 class LoanAdmin(admin.ModelAdmin):
+    form = LoanAdminForm
     list_display = ('book', 'user', 'borrowed_date', 'due_date', 'returned_date', 'status', 'is_overdue')
     list_filter = ('status', 'borrowed_date', 'due_date', 'returned_date')
     search_fields = ('book__title', 'user__username', 'user__first_name', 'user__last_name')
@@ -25,15 +57,39 @@ class LoanAdmin(admin.ModelAdmin):
     is_overdue.boolean = True
     is_overdue.short_description = 'Overdue'
 
+    def save_model(self, request, obj, form, change):
+        # Возврат проводится через circulation: экземпляр возвращается на полку или следующему в очереди
+        circulation.save_loan(obj)
+
 
 @admin.register(Reservation)
 class ReservationAdmin(admin.ModelAdmin):
+    form = ReservationAdminForm
     list_display = ('book', 'user', 'reserved_date', 'expiry_date', 'status', 'is_expired')
     list_filter = ('status', 'reserved_date', 'expiry_date')
     search_fields = ('book__title', 'user__username')
     readonly_fields = ('reserved_date',)
     date_hierarchy = 'reserved_date'
 
+    def get_fields(self, request, obj=None):
+        # Новая бронь встаёт в конец очереди: статус, срок и номер назначает place_hold
+        if obj is None:
+            return ('user', 'book')
+        return super().get_fields(request, obj)
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return ()
+        return self.readonly_fields + ('priority',)
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            obj.save()
+            return
+        reservation = circulation.place_hold(obj.user, obj.book)
+        obj.pk = reservation.pk
+        obj.refresh_from_db()
+
     def is_expired(self, obj):
         return obj.is_expired()
 
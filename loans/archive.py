@@ -0,0 +1,186 @@
+"""
+Архив закрытых займов.
+
+Займы, возвращённые раньше LOAN_ARCHIVE_AFTER_DAYS дней назад, переносятся
+пачками из loans_loan в loans_archivedloan с сохранением id. Горячая таблица
+остаётся маленькой, а история и отчёты обращаются к архиву только тогда,
+когда запрошенный диапазон дат заходит в архивную часть: все архивные займы
+взяты не позже archive_horizon().
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from library_management.pagination import CursorPaginator
+from .models import ArchivedLoan, Loan
+
+ARCHIVE_AFTER = timedelta(days=getattr(settings, 'LOAN_ARCHIVE_AFTER_DAYS', 365))
+BATCH_SIZE = 5000
+
+
+def _loan_columns():
+    return [field.column for field in Loan._meta.concrete_fields]
+
+
+def _move_batch_sql(source, target, where, params, batch_size):
+    # PostgreSQL: перенос пачки одним запросом DELETE ... RETURNING + INSERT
+    columns = ', '.join(_loan_columns())
+    sql = (
+        f'WITH moved AS ('
+        f' DELETE FROM {source} WHERE id IN ('
+        f'  SELECT id FROM {source} WHERE {where} ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED'
+        f' ) RETURNING {columns}'
+        f')'
+    )
+    if target == ArchivedLoan._meta.db_table:
+        sql += f' INSERT INTO {target} ({columns}, archived_at) SELECT {columns}, %s FROM moved'
+        params = [*params, batch_size, timezone.now()]
+    else:
+        sql += f' INSERT INTO {target} ({columns}) SELECT {columns} FROM moved'
+        params = [*params, batch_size]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def _copy_fields(obj):
+    return {field.attname: getattr(obj, field.attname) for field in Loan._meta.concrete_fields}
+
+
+def _move_batch(source_queryset, target_model, batch_size):
+    with transaction.atomic():
+        batch = list(source_queryset.select_for_update().order_by('pk')[:batch_size])
+        if not batch:
+            return 0
+        rows = [_copy_fields(obj) for obj in batch]
+        target_model.objects.bulk_create([target_model(**row) for row in rows])
+        # auto_now_add (Loan.borrowed_date) при вставке ставит текущее время — возвращаем исходные даты
+        stamped = [
+            field.name for field in target_model._meta.concrete_fields
+            if getattr(field, 'auto_now_add', False) and field.attname in rows[0]
+        ]
+        if stamped:
+            target_model.objects.bulk_update([target_model(**row) for row in rows], stamped)
+        source_queryset.model.objects.filter(pk__in=[obj.pk for obj in batch]).delete()
+        return len(batch)
+
+
+def archive_loans(older_than=None, batch_size=BATCH_SIZE, max_batches=None):
+    """Переносит возвращённые давнее older_than займы в архив; возвращает их количество."""
+    cutoff = timezone.now() - (older_than or ARCHIVE_AFTER)
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        if connection.vendor == 'postgresql':
+            with transaction.atomic():
+                moved = _move_batch_sql(
+                    Loan._meta.db_table, ArchivedLoan._meta.db_table,
+                    'returned_date < %s', [cutoff], batch_size
+                )
+        else:
+            moved = _move_batch(Loan.objects.filter(returned_date__lt=cutoff), ArchivedLoan, batch_size)
+        total += moved
+        batches += 1
+        if moved < batch_size:
+            break
+    return total
+
+
+def restore_loans(user=None, since=None, batch_size=BATCH_SIZE):
+    """Возвращает архивные займы (всё, одного читателя или начиная с даты) в горячую таблицу."""
+    queryset = ArchivedLoan.objects.all()
+    where = ['TRUE']
+    params = []
+    if user is not None:
+        queryset = queryset.filter(user=user)
+        where.append('user_id = %s')
+        params.append(user.pk)
+    if since is not None:
+        queryset = queryset.filter(borrowed_date__gte=since)
+        where.append('borrowed_date >= %s')
+        params.append(since)
+
+    total = 0
+    while True:
+        if connection.vendor == 'postgresql':
+            with transaction.atomic():
+                moved = _move_batch_sql(
+                    ArchivedLoan._meta.db_table, Loan._meta.db_table,
+                    ' AND '.join(where), params, batch_size
+                )
+        else:
+            moved = _move_batch(queryset, Loan, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
+
+
+def archive_horizon(user=None, date_field='borrowed_date'):
+    """Самая поздняя дата date_field среди архивных займов (None — архив пуст)."""
+    queryset = ArchivedLoan.objects.all()
+    if user is not None:
+        queryset = queryset.filter(user=user)
+    return queryset.aggregate(horizon=Max(date_field))['horizon']
+
+
+def needs_archive(start=None, date_field='borrowed_date'):
+    """Нужен ли архив для диапазона date_field >= start (None — за всё время)."""
+    horizon = archive_horizon(date_field=date_field)
+    return horizon is not None and (start is None or start <= horizon)
+
+
+def count_loans(start=None, date_field='borrowed_date', **filters):
+    """Количество займов с date_field >= start по горячей таблице и, если нужно, по архиву."""
+    if start is not None:
+        filters[f'{date_field}__gte'] = start
+    total = Loan.objects.filter(**filters).count()
+    if needs_archive(start, date_field):
+        total += ArchivedLoan.objects.filter(**filters).count()
+    return total
+
+
+class LoanHistoryPaginator(CursorPaginator):
+    """
+    Keyset-пагинация по объединению горячих и архивных займов с порядком
+    ('-borrowed_date', '-id'). Архив запрашивается, только если страница
+    доходит до archive_horizon(); id в обеих таблицах общие, поэтому курсор
+    одинаково работает для обеих.
+    """
+
+    def __init__(self, hot_queryset, archived_queryset, per_page, horizon):
+        super().__init__(hot_queryset, per_page, ('-borrowed_date', '-id'), count='exact')
+        self.archived_queryset = archived_queryset
+        self.horizon = horizon
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = self.queryset.count()
+            if self.horizon is not None:
+                self._count += self.archived_queryset.count()
+        return self._count
+
+    def _needs_archive(self, rows, ordering, values, limit):
+        if self.horizon is None:
+            return False
+        if ordering[0].startswith('-'):
+            # Идём к более старым займам
+            return len(rows) < limit or rows[-1].borrowed_date <= self.horizon
+        # Идём к более новым займам от values (или от самого старого)
+        return values is None or parse_datetime(values[0]) <= self.horizon
+
+    def _fetch(self, ordering, values, forward, limit):
+        rows = super()._fetch(ordering, values, forward, limit)
+        if not self._needs_archive(rows, ordering, values, limit):
+            return rows
+
+        archived = self.archived_queryset
+        if values is not None:
+            archived = archived.filter(self._seek_filter(values, forward=forward))
+        rows += list(archived.order_by(*ordering)[:limit])
+        rows.sort(key=lambda loan: (loan.borrowed_date, loan.pk), reverse=ordering[0].startswith('-'))
+        return rows[:limit]
@@ -0,0 +1,458 @@
+"""
+Сервис выдачи и возврата книг.
+
+Все операции выполняются в одной транзакции, а количество свободных экземпляров
+меняется условным UPDATE (available_copies = available_copies - 1
+WHERE available_copies > 0), поэтому при одновременных запросах книга не может
+быть выдана больше раз, чем есть экземпляров, а возврат не учитывается дважды.
+
+Очередь броней: у каждой книги брони упорядочены по priority — порядковому
+номеру, который выдаётся под блокировкой строки книги и только растёт.
+Возвращённый экземпляр сначала откладывается для первого в очереди (бронь
+становится available), и лишь при пустой очереди возвращается на полку.
+Отложенный экземпляр не входит в available_copies.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from accounts.models import User
+from books.counters import apply_availability_change
+from books.models import Book
+from notifications.live import schedule_unread_bump
+from notifications.models import Notification
+from .models import Loan, Reservation
+from .signals import send_circulation_changed
+
+MAX_ACTIVE_LOANS = 5
+LOAN_PERIOD = timedelta(days=14)
+HOLD_PERIOD = timedelta(hours=48)
+
+
+class CirculationError(Exception):
+    pass
+
+
+def take_copy(book_id):
+    updated = Book.objects.filter(pk=book_id, available_copies__gt=0).update(
+        available_copies=F('available_copies') - 1
+    )
+    if not updated:
+        raise CirculationError('This book is not available for borrowing.')
+    # Строка книги заблокирована нашим UPDATE до конца транзакции
+    if Book.objects.filter(pk=book_id, available_copies=0).exists():
+        apply_availability_change(book_ids_to_unavailable=[book_id])
+
+
+def borrow_book(user, book, due_date=None, check_limits=True):
+    with transaction.atomic():
+        # Блокируем читателя, чтобы параллельные запросы не обошли лимит займов
+        User.objects.select_for_update().filter(pk=user.pk).first()
+
+        active_loans = Loan.objects.filter(user=user, returned_date__isnull=True)
+        if active_loans.filter(book=book).exists():
+            raise CirculationError('You already have this book on loan.')
+        if check_limits and active_loans.count() >= MAX_ACTIVE_LOANS:
+            raise CirculationError(
+                f'You have reached the maximum number of active loans ({MAX_ACTIVE_LOANS}).'
+            )
+
+        # Если для читателя отложен экземпляр, выдаём его, иначе берём с полки
+        held = Reservation.objects.filter(user=user, book=book, status='available').update(status='fulfilled')
+        if not held:
+            take_copy(book.pk)
+        loan = Loan.objects.create(
+            user=user,
+            book=book,
+            due_date=due_date or timezone.now() + LOAN_PERIOD
+        )
+        send_circulation_changed(borrowed_book_ids=[book.pk])
+        return loan
+
+
+def return_loan(loan, returned_date=None):
+    with transaction.atomic():
+        now = timezone.now()
+        returned_date = returned_date or now
+        updated = Loan.objects.filter(pk=loan.pk, returned_date__isnull=True).update(
+            returned_date=returned_date,
+            status='returned'
+        )
+        if not updated:
+            raise CirculationError('This loan has already been returned.')
+
+        restock_copies({loan.book_id: 1}, now)
+
+    loan.returned_date = returned_date
+    loan.status = 'returned'
+    return loan
+
+
+def save_loan(loan):
+    """
+    Сохраняет заём, изменённый в админке или через API. Появившаяся дата
+    возврата проводится через return_loan, чтобы экземпляр вернулся в оборот;
+    снять отметку о возврате нельзя.
+    """
+    if loan.pk is None:
+        loan.save()
+        return loan
+    returned_date = loan.returned_date
+    with transaction.atomic():
+        # Блокируем строку: параллельный возврат не затрётся устаревшим returned_date
+        stored = Loan.objects.select_for_update().values_list('returned_date', flat=True).get(pk=loan.pk)
+        if stored is not None and returned_date is None:
+            raise CirculationError('A returned loan cannot be reopened.')
+        if stored is None and returned_date is not None:
+            loan.returned_date = None
+            loan.save()
+            return_loan(loan, returned_date)
+        else:
+            loan.save()
+    return loan
+
+
+def renew_loan(loan):
+    now = timezone.now()
+    due_date = now + LOAN_PERIOD
+    with transaction.atomic():
+        updated = Loan.objects.filter(
+            pk=loan.pk,
+            returned_date__isnull=True,
+            due_date__gte=now,
+            renewals__lt=F('max_renewals'),
+        ).update(
+            renewals=F('renewals') + 1,
+            due_date=due_date,
+            status='active'
+        )
+        if not updated:
+            raise CirculationError(
+                'This loan cannot be renewed. You may have reached the maximum renewal limit or the book is overdue.'
+            )
+        send_circulation_changed(renewed_loan_ids=[loan.pk], now=now)
+
+    loan.refresh_from_db(fields=['renewals', 'due_date', 'status'])
+    return loan
+
+
+def _promote_holds(reservations, now):
+    """Откладывает экземпляр для каждой брони и уведомляет читателей в той же транзакции."""
+    if not reservations:
+        return
+    expiry_date = now + HOLD_PERIOD
+    Reservation.objects.filter(pk__in=[reservation.pk for reservation in reservations]).update(
+        status='available',
+        expiry_date=expiry_date,
+        notified=True
+    )
+    Notification.objects.bulk_create([
+        Notification(
+            user_id=reservation.user_id,
+            title='Reservation Available',
+            message=f'"{reservation.book.title}" is waiting for you at the circulation desk until '
+                    f'{expiry_date.strftime("%B %d, %Y %H:%M")}.',
+            notification_type='reservation_available',
+            related_object_id=reservation.pk,
+            related_content_type='reservation'
+        )
+        for reservation in reservations
+    ])
+    # bulk_create не вызывает сигналов — счётчики непрочитанных обновляем явно
+    schedule_unread_bump(reservation.user_id for reservation in reservations)
+    for reservation in reservations:
+        reservation.status = 'available'
+        reservation.expiry_date = expiry_date
+
+
+def restock_copies(copies, now=None):
+    """
+    Возвращает экземпляры в оборот: copies — {book_id: количество}. Экземпляры
+    сначала откладываются для первых броней в очереди, остаток идёт на полку.
+    Вызывать внутри транзакции.
+    """
+    now = now or timezone.now()
+    # Блокируем книги в порядке id, чтобы параллельные операции не взаимоблокировались
+    list(Book.objects.select_for_update().filter(pk__in=copies).order_by('pk').values_list('pk'))
+
+    queued = set(
+        Reservation.objects.filter(book_id__in=copies, status='pending')
+        .values_list('book_id', flat=True).distinct()
+    )
+    promoted = []
+    deltas = {}
+    for book_id, count in copies.items():
+        if book_id in queued:
+            heads = list(
+                Reservation.objects.select_for_update().select_related('book')
+                .filter(book_id=book_id, status='pending').order_by('priority')[:count]
+            )
+            promoted.extend(heads)
+            count -= len(heads)
+        if count:
+            deltas[book_id] = count
+
+    _promote_holds(promoted, now)
+    _apply_copy_deltas(deltas)
+    send_circulation_changed()
+    return promoted
+
+
+def place_hold(user, book):
+    """Ставит читателя в конец очереди на книгу."""
+    with transaction.atomic():
+        # Блокировка книги сериализует выдачу порядковых номеров очереди
+        available_copies = Book.objects.select_for_update().values_list(
+            'available_copies', flat=True
+        ).get(pk=book.pk)
+
+        if Reservation.objects.filter(user=user, book=book, status__in=['pending', 'available']).exists():
+            raise CirculationError('You already have an active reservation for this book.')
+        if Loan.objects.filter(user=user, book=book, returned_date__isnull=True).exists():
+            raise CirculationError('You already have this book on loan.')
+
+        last = Reservation.objects.filter(book=book).aggregate(last=Max('priority'))['last'] or 0
+        reservation = Reservation.objects.create(user=user, book=book, priority=last + 1)
+
+        if available_copies > 0:
+            # Очередь пуста (иначе экземпляр был бы отложен) — сразу откладываем экземпляр с полки
+            take_copy(book.pk)
+            reservation.book = book
+            _promote_holds([reservation], timezone.now())
+
+    return reservation
+
+
+def _release_holds(reservation_ids, status, now):
+    """Закрывает отложенные брони и передаёт их экземпляры следующим в очереди."""
+    held = list(
+        Reservation.objects.select_for_update()
+        .filter(pk__in=reservation_ids, status='available')
+        .values_list('pk', 'book_id')
+    )
+    if not held:
+        return 0
+    Reservation.objects.filter(pk__in=[pk for pk, _ in held]).update(status=status)
+
+    copies = {}
+    for _, book_id in held:
+        copies[book_id] = copies.get(book_id, 0) + 1
+    restock_copies(copies, now)
+    return len(held)
+
+
+def cancel_hold(reservation):
+    with transaction.atomic():
+        now = timezone.now()
+        if not _release_holds([reservation.pk], 'cancelled', now):
+            updated = Reservation.objects.filter(pk=reservation.pk, status='pending').update(status='cancelled')
+            if not updated:
+                raise CirculationError('This reservation is no longer active.')
+            send_circulation_changed()
+
+    reservation.status = 'cancelled'
+    return reservation
+
+
+def expire_holds(now=None):
+    """Истёкшие отложенные брони переходят в expired, экземпляр получает следующий в очереди."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        expired_ids = list(
+            Reservation.objects.filter(status='available', expiry_date__lt=now).values_list('pk', flat=True)
+        )
+        return _release_holds(expired_ids, 'expired', now)
+
+
+def queue_position(reservation):
+    if reservation.status != 'pending':
+        return None
+    return Reservation.objects.filter(
+        book_id=reservation.book_id,
+        status='pending',
+        priority__lt=reservation.priority
+    ).count() + 1
+
+
+def fulfil_reservation(reservation):
+    with transaction.atomic():
+        status = Reservation.objects.select_for_update().filter(
+            pk=reservation.pk
+        ).values_list('status', flat=True).first()
+        if status == 'pending':
+            # Выдача вне очереди — экземпляр берётся с полки
+            Reservation.objects.filter(pk=reservation.pk).update(status='fulfilled')
+        elif status != 'available':
+            raise CirculationError('This reservation is no longer active.')
+
+        # borrow_book сама закроет отложенную бронь и заберёт её экземпляр
+        loan = borrow_book(reservation.user, reservation.book, check_limits=False)
+
+    reservation.status = 'fulfilled'
+    return loan
+
+
+def _item_result(item, ok, loan=None, error=''):
+    return {
+        'item': item,
+        'ok': ok,
+        'loan_id': loan.pk if loan else None,
+        'error': error,
+    }
+
+
+def _apply_copy_deltas(deltas):
+    """
+    Применяет изменения available_copies {book_id: delta} одним bulk_update.
+    Строки книг к этому моменту должны быть заблокированы.
+    """
+    if not deltas:
+        return
+    rows = Book.objects.filter(pk__in=deltas).values_list('id', 'available_copies', 'total_copies')
+    books = []
+    became_available = []
+    became_unavailable = []
+    for book_id, available, total in rows:
+        new_available = min(max(available + deltas[book_id], 0), total)
+        if new_available == available:
+            continue
+        if available == 0:
+            became_available.append(book_id)
+        elif new_available == 0:
+            became_unavailable.append(book_id)
+        books.append(Book(pk=book_id, available_copies=new_available))
+    Book.objects.bulk_update(books, ['available_copies'])
+    apply_availability_change(became_available, became_unavailable)
+
+
+def batch_return(items):
+    """
+    Массовый возврат. Элемент — id займа или пара (ISBN, membership_id).
+    Возвращает результат по каждому элементу в исходном порядке.
+    """
+    loan_ids = [item for item in items if isinstance(item, int)]
+    pairs = [item for item in items if not isinstance(item, int)]
+
+    with transaction.atomic():
+        active = Loan.objects.select_for_update().filter(returned_date__isnull=True)
+        by_id = {loan.pk: loan for loan in active.filter(pk__in=loan_ids)}
+
+        by_pair = {}
+        if pairs:
+            loans = active.filter(
+                book__isbn__in={isbn for isbn, _ in pairs},
+                user__membership_id__in={membership_id for _, membership_id in pairs},
+            ).select_related('book', 'user')
+            for loan in loans:
+                by_pair[(loan.book.isbn, loan.user.membership_id)] = loan
+
+        results = []
+        returned = {}
+        for item in items:
+            loan = by_id.get(item) if isinstance(item, int) else by_pair.get(tuple(item))
+            if loan is None:
+                results.append(_item_result(item, False, error='No active loan found.'))
+            elif loan.pk in returned:
+                results.append(_item_result(item, False, loan, 'Duplicate item in batch.'))
+            else:
+                returned[loan.pk] = loan
+                results.append(_item_result(item, True, loan))
+
+        if returned:
+            now = timezone.now()
+            Loan.objects.filter(pk__in=returned).update(returned_date=now, status='returned')
+
+            copies = {}
+            for loan in returned.values():
+                copies[loan.book_id] = copies.get(loan.book_id, 0) + 1
+            restock_copies(copies, now)
+
+    return results
+
+
+def batch_checkout(items, due_date=None):
+    """
+    Массовая выдача по парам (ISBN, membership_id). Лимит активных займов
+    и наличие экземпляров проверяются так же, как в borrow_book.
+    """
+    with transaction.atomic():
+        users = {
+            user.membership_id: user
+            for user in User.objects.select_for_update().filter(
+                membership_id__in={membership_id for _, membership_id in items}
+            ).order_by('pk')
+        }
+        books = {
+            book.isbn: book
+            for book in Book.objects.select_for_update().filter(
+                isbn__in={isbn for isbn, _ in items}
+            ).order_by('pk')
+        }
+
+        active = Loan.objects.filter(
+            returned_date__isnull=True,
+            user__in=users.values()
+        ).values_list('user_id', 'book_id')
+        on_loan = set(active)
+        loan_counts = {}
+        for user_id, _ in on_loan:
+            loan_counts[user_id] = loan_counts.get(user_id, 0) + 1
+        books_by_id = {book.pk: book for book in books.values()}
+        remaining = {book.pk: book.available_copies for book in books.values()}
+        # Отложенные для читателя экземпляры выдаются без списания с полки
+        holds = {
+            (user_id, book_id): pk
+            for pk, user_id, book_id in Reservation.objects.select_for_update().filter(
+                status='available',
+                user__in=users.values(),
+                book__in=books.values()
+            ).values_list('pk', 'user_id', 'book_id')
+        }
+        fulfilled_holds = []
+
+        due_date = due_date or timezone.now() + LOAN_PERIOD
+        results = []
+        new_loans = []
+        for isbn, membership_id in items:
+            item = (isbn, membership_id)
+            user = users.get(membership_id)
+            book = books.get(isbn)
+            if user is None:
+                error = 'Unknown membership ID.'
+            elif book is None:
+                error = 'Unknown ISBN.'
+            elif (user.pk, book.pk) in on_loan:
+                error = 'Reader already has this book on loan.'
+            elif loan_counts.get(user.pk, 0) >= MAX_ACTIVE_LOANS:
+                error = f'Reader has reached the maximum number of active loans ({MAX_ACTIVE_LOANS}).'
+            elif (user.pk, book.pk) not in holds and remaining[book.pk] <= 0:
+                error = 'This book is not available for borrowing.'
+            else:
+                error = ''
+                on_loan.add((user.pk, book.pk))
+                loan_counts[user.pk] = loan_counts.get(user.pk, 0) + 1
+                if (user.pk, book.pk) in holds:
+                    fulfilled_holds.append(holds[(user.pk, book.pk)])
+                else:
+                    remaining[book.pk] -= 1
+                new_loans.append(Loan(user=user, book=book, due_date=due_date, status='active'))
+
+            results.append((item, error))
+
+        Loan.objects.bulk_create(new_loans)
+        send_circulation_changed(borrowed_book_ids=[loan.book_id for loan in new_loans])
+        Reservation.objects.filter(pk__in=fulfilled_holds).update(status='fulfilled')
+
+        deltas = {}
+        for book_id, count in remaining.items():
+            if count != books_by_id[book_id].available_copies:
+                deltas[book_id] = count - books_by_id[book_id].available_copies
+        _apply_copy_deltas(deltas)
+
+    created = iter(new_loans)
+    return [
+        _item_result(item, False, error=error) if error else _item_result(item, True, next(created))
+        for item, error in results
+    ]
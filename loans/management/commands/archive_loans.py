@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from loans.archive import ARCHIVE_AFTER, BATCH_SIZE, archive_loans
+from loans.signals import send_circulation_changed
+
+
+class Command(BaseCommand):
+    help = 'Move returned loans older than the given age from the loan table into the archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ARCHIVE_AFTER.days,
+                            help='Archive loans returned more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches')
+
+    def handle(self, *args, **options):
+        archived = archive_loans(
+            older_than=timedelta(days=options['days']),
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches']
+        )
+        if archived:
+            send_circulation_changed()
+        self.stdout.write(self.style.SUCCESS(f'Successfully archived {archived} loans'))
@@ -0,0 +1,85 @@
+import statistics
+import time
+import uuid
+
+from django.utils import timezone
+
+from accounts.models import User
+from books.models import Author, Book
+from library_management.benchmark import BenchmarkCommand
+from loans import circulation
+from loans.models import Loan, Reservation
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+class Command(BenchmarkCommand):
+    help = 'Measure hold queue operations on a book with thousands of queued reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--holds', type=int, nargs='+', default=[1000, 5000])
+        parser.add_argument('--rounds', type=int, default=50)
+
+    def handle(self, *args, **options):
+        for size in options['holds']:
+            prefix = f'holdbench-{uuid.uuid4().hex[:8]}'
+            author = Author.objects.create(first_name='Bench', last_name=prefix)
+            book = Book.objects.create(
+                title=prefix, author=author, isbn=uuid.uuid4().hex[:13],
+                publication_year=2000, publisher='bench', total_copies=1, available_copies=1
+            )
+            try:
+                self._run(book, prefix, size, options['rounds'])
+            finally:
+                Loan.objects.filter(book=book).delete()
+                Reservation.objects.filter(book=book).delete()
+                book.refresh_from_db()
+                book.delete()
+                author.delete()
+                User.objects.filter(username__startswith=prefix).delete()
+
+    def _run(self, book, prefix, size, rounds):
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}-{i}')
+            for i in range(size + rounds + 1)
+        ])
+        borrower = users[-1]
+        loan = circulation.borrow_book(borrower, book)
+        Reservation.objects.bulk_create([
+            Reservation(user=user, book=book, priority=i + 1, expiry_date=timezone.now())
+            for i, user in enumerate(users[:size])
+        ])
+        spare = iter(users[size:-1])
+
+        timings = {'enqueue': [], 'position': [], 'cancel': [], 'return+promote': [], 'expire+roll': []}
+        for i in range(rounds):
+            reservation, ms = _timed(circulation.place_hold, next(spare), book)
+            timings['enqueue'].append(ms)
+
+            _, ms = _timed(circulation.queue_position, reservation)
+            timings['position'].append(ms)
+
+            middle = Reservation.objects.filter(book=book, status='pending').order_by('priority')[size // 2]
+            _, ms = _timed(circulation.cancel_hold, middle)
+            timings['cancel'].append(ms)
+
+            _, ms = _timed(circulation.return_loan, loan)
+            timings['return+promote'].append(ms)
+
+            _, ms = _timed(circulation.expire_holds, timezone.now() + circulation.HOLD_PERIOD * 2)
+            timings['expire+roll'].append(ms)
+
+            # Читатель с отложенным экземпляром забирает его, следующий возврат снова продвинет очередь
+            head = Reservation.objects.select_related('user').get(book=book, status='available')
+            loan = circulation.borrow_book(head.user, book)
+
+        self.stdout.write(f'{size} queued holds:')
+        for name, values in timings.items():
+            values.sort()
+            p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+            self.stdout.write(f'  {name:<16} p50 {statistics.median(values):.2f} ms, p99 {p99:.2f} ms')
+        self.stdout.write(self.style.SUCCESS(f'Successfully benchmarked a queue of {size} holds'))
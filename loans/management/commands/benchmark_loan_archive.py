@@ -0,0 +1,112 @@
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from accounts.models import User
+from books.models import Author, Book
+from library_management.benchmark import BenchmarkCommand
+from loans.archive import LoanHistoryPaginator, archive_horizon, archive_loans, count_loans
+from loans.models import ArchivedLoan, Loan
+
+
+def _dashboard_queries(user):
+    week_ago = timezone.now() - timedelta(days=7)
+    Loan.objects.filter(status__in=['active', 'overdue']).count()
+    Loan.objects.filter(status='overdue').count()
+    count_loans(week_ago)
+    count_loans(week_ago, date_field='returned_date')
+    Loan.objects.aggregate(
+        total_loans=Count('id'),
+        active_loans=Count('id', filter=Q(status='active')),
+        overdue_loans=Count('id', filter=Q(status='overdue')),
+        returned_loans=Count('id', filter=Q(status='returned')),
+    )
+    paginator = LoanHistoryPaginator(
+        Loan.objects.filter(user=user), ArchivedLoan.objects.filter(user=user), 20, archive_horizon(user=user)
+    )
+    list(paginator.get_page(None))
+
+
+class Command(BenchmarkCommand):
+    help = 'Measure dashboard query time before and after archiving a large synthetic loan history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=5000000)
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--years', type=int, default=5)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def _measure(self, user, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            _dashboard_queries(user)
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = f'archbench-{uuid.uuid4().hex[:8]}'
+        author = Author.objects.create(first_name='Bench', last_name=prefix)
+        books = Book.objects.bulk_create([
+            Book(title=f'{prefix} {i}', author=author, isbn=f'{i:04d}{uuid.uuid4().hex[:9]}',
+                 publication_year=2000, publisher='bench', total_copies=1000000, available_copies=1000000)
+            for i in range(200)
+        ])
+        # bulk_create не обновляет счётчики автора, а удаление книг в конце их уменьшит
+        Author.objects.filter(pk=author.pk).update(book_count=len(books), available_book_count=len(books))
+        users = User.objects.bulk_create([User(username=f'{prefix}-{i}') for i in range(options['users'])])
+
+        try:
+            self._populate(rng, books, users, options)
+            before = self._measure(users[0], options['repeat'])
+            self.stdout.write(f'Before archiving: {Loan.objects.count()} hot loans, dashboard {before:.1f} ms')
+
+            started = time.perf_counter()
+            archived = archive_loans()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'Archived {archived} loans in {elapsed:.1f} s')
+
+            after = self._measure(users[0], options['repeat'])
+            self.stdout.write(f'After archiving: {Loan.objects.count()} hot loans, dashboard {after:.1f} ms')
+            self.stdout.write(self.style.SUCCESS(
+                f'Successfully benchmarked archiving: {before:.1f} ms -> {after:.1f} ms'
+            ))
+        finally:
+            Loan.objects.filter(user__in=users).delete()
+            ArchivedLoan.objects.filter(user__in=users).delete()
+            User.objects.filter(username__startswith=prefix).delete()
+            Book.objects.filter(title__startswith=prefix).delete()
+            author.delete()
+
+    def _populate(self, rng, books, users, options):
+        now = timezone.now()
+        span = options['years'] * 365 * 86400
+        # bulk_create иначе перезапишет дату выдачи текущим временем
+        borrowed_field = Loan._meta.get_field('borrowed_date')
+        borrowed_field.auto_now_add = False
+        try:
+            remaining = options['loans']
+            while remaining:
+                batch = []
+                for _ in range(min(remaining, 20000)):
+                    borrowed = now - timedelta(seconds=rng.randint(0, span))
+                    due = borrowed + timedelta(days=14)
+                    returned = borrowed + timedelta(days=rng.randint(1, 20))
+                    if returned > now:
+                        returned = None
+                    batch.append(Loan(
+                        user=rng.choice(users), book=rng.choice(books),
+                        borrowed_date=borrowed, due_date=due, returned_date=returned,
+                        status='returned' if returned else ('overdue' if due < now else 'active')
+                    ))
+                Loan.objects.bulk_create(batch)
+                remaining -= len(batch)
+        finally:
+            borrowed_field.auto_now_add = True
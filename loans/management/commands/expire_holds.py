@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from loans.circulation import expire_holds
+
+
+class Command(BaseCommand):
+    help = 'Expire uncollected holds and pass their copies to the next readers in the queue'
+
+    def handle(self, *args, **options):
+        expired = expire_holds()
+        self.stdout.write(self.style.SUCCESS(f'Successfully expired {expired} holds'))
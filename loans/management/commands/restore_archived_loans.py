@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from django.utils import timezone
+from datetime import datetime
+
+from accounts.models import User
+from loans.archive import BATCH_SIZE, restore_loans
+from loans.signals import send_circulation_changed
+
+
+class Command(BaseCommand):
+    help = 'Move archived loans back into the loan table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only restore loans of this username')
+        parser.add_argument('--since', help='Only restore loans borrowed on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--all', action='store_true', help='Restore the whole archive')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if not (options['user'] or options['since'] or options['all']):
+            raise CommandError('Specify --user, --since or --all')
+
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'User "{options["user"]}" does not exist')
+
+        since = None
+        if options['since']:
+            date = parse_date(options['since'])
+            if date is None:
+                raise CommandError('--since must be a date in YYYY-MM-DD format')
+            since = timezone.make_aware(datetime.combine(date, datetime.min.time()))
+
+        restored = restore_loans(user=user, since=since, batch_size=options['batch_size'])
+        if restored:
+            send_circulation_changed()
+        self.stdout.write(self.style.SUCCESS(f'Successfully restored {restored} loans'))
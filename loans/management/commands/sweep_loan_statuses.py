@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+from loans.sweeper import sweep_overdue_loans
+
+
+class Command(BaseCommand):
+    help = 'Move loans that have passed their due date to the overdue status'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=int, metavar='SECONDS',
+                            help='Keep running and sweep every SECONDS instead of exiting after one pass')
+
+    def handle(self, *args, **options):
+        while True:
+            updated = sweep_overdue_loans()
+            self.stdout.write(self.style.SUCCESS(f'Successfully marked {updated} loans as overdue'))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
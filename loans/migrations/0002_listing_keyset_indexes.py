@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_listing_keyset_indexes'),
+        ('loans', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['borrowed_date', 'id'], name='loans_loan_borrowe_8691f7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['reserved_date', 'id'], name='loans_reser_reserve_9ff44d_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:35
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def sync_statuses(apps, schema_editor):
+    Loan = apps.get_model('loans', 'Loan')
+    Loan.objects.filter(returned_date__isnull=False).exclude(status='returned').update(status='returned')
+    Loan.objects.filter(status='active', due_date__lt=timezone.now()).update(status='overdue')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0002_listing_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['status', 'due_date'], name='loans_loan_status_196efd_idx'),
+        ),
+        migrations.RunPython(sync_statuses, migrations.RunPython.noop),
+    ]
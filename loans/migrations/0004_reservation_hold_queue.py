@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:37
+
+from django.db import migrations, models
+
+
+def renumber_queues(apps, schema_editor):
+    # Старые priority считались через COUNT и могли повторяться — нумеруем заново по порядку бронирования
+    Reservation = apps.get_model('loans', 'Reservation')
+    changed = []
+    positions = {}
+    for reservation in Reservation.objects.order_by('book_id', 'priority', 'reserved_date', 'id'):
+        position = positions[reservation.book_id] = positions.get(reservation.book_id, 0) + 1
+        if reservation.priority != position:
+            reservation.priority = position
+            changed.append(reservation)
+    Reservation.objects.bulk_update(changed, ['priority'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0003_loan_status_due_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reservation',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('available', 'Available'), ('fulfilled', 'Fulfilled'), ('cancelled', 'Cancelled'), ('expired', 'Expired')], default='pending', max_length=20),
+        ),
+        migrations.RunPython(renumber_queues, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['book', 'status', 'priority'], name='loans_reser_book_id_e2ebd7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['status', 'expiry_date'], name='loans_reser_status_3d1ccc_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(fields=('book', 'priority'), name='unique_reservation_queue_position'),
+        ),
+    ]
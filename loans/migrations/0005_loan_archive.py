@@ -0,0 +1,56 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_counters'),
+        ('loans', '0004_reservation_hold_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedLoan',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('borrowed_date', models.DateTimeField()),
+                ('due_date', models.DateTimeField()),
+                ('returned_date', models.DateTimeField()),
+                ('status', models.CharField(choices=[('active', 'Active'), ('returned', 'Returned'), ('overdue', 'Overdue')], default='returned', max_length=20)),
+                ('renewals', models.IntegerField(default=0)),
+                ('max_renewals', models.IntegerField(default=2)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['returned_date'], name='loans_loan_returne_58957d_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedloan',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_loans', to='books.book'),
+        ),
+        migrations.AddField(
+            model_name='archivedloan',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_loans', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='archivedloan',
+            index=models.Index(fields=['borrowed_date', 'id'], name='loans_archi_borrowe_acd5eb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedloan',
+            index=models.Index(fields=['user', 'borrowed_date', 'id'], name='loans_archi_user_id_806f69_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedloan',
+            index=models.Index(fields=['returned_date'], name='loans_archi_returne_20f1bb_idx'),
+        ),
+    ]
@@ -1,10 +1,40 @@
 from django.db import models
+from django.db.models import Case, ExpressionWrapper, F, Q, Value, When
 from django.utils import timezone
 from datetime import timedelta
 from accounts.models import User
 from books.models import Book
 
 
+class LoanQuerySet(models.QuerySet):
+    def with_overdue(self, now=None):
+        """
+        Аннотирует просрочку и возможность продления вычислением в SQL, чтобы
+        шаблоны не вызывали is_overdue()/can_renew() для каждой строки:
+        overdue — bool, overdue_for — timedelta просрочки или None, renewable — bool.
+        """
+        now = now or timezone.now()
+        is_overdue = Q(returned_date__isnull=True, due_date__lt=now)
+        return self.annotate(
+            overdue=Case(When(is_overdue, then=Value(True)), default=Value(False), output_field=models.BooleanField()),
+            overdue_for=Case(
+                When(is_overdue, then=ExpressionWrapper(Value(now) - F('due_date'), output_field=models.DurationField())),
+                default=None,
+                output_field=models.DurationField()
+            ),
+            renewable=Case(
+                When(
+                    returned_date__isnull=True,
+                    due_date__gte=now,
+                    renewals__lt=F('max_renewals'),
+                    then=Value(True)
+                ),
+                default=Value(False),
+                output_field=models.BooleanField()
+            ),
+        )
+
+
 class Loan(models.Model):
     STATUS_CHOICES = (
         ('active', 'Active'),
@@ -21,6 +51,8 @@ class Loan(models.Model):
     renewals = models.IntegerField(default=0)
     max_renewals = models.IntegerField(default=2)
 
+    objects = LoanQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         if not self.due_date and not self.pk:
             self.due_date = timezone.now() + timedelta(days=14)
@@ -32,14 +64,7 @@ class Loan(models.Model):
         else:
             self.status = 'active'
 
-        if not self.pk:
-            self.book.available_copies -= 1
-            self.book.save()
-        elif self.returned_date and self.status == 'returned':
-            if self.book.available_copies < self.book.total_copies:
-                self.book.available_copies += 1
-                self.book.save()
-
+        # Количество экземпляров меняет loans.circulation, а не модель
         super().save(*args, **kwargs)
 
     def can_renew(self):
@@ -58,11 +83,61 @@ class Loan(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.book.title}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['borrowed_date', 'id']),
+            models.Index(fields=['status', 'due_date']),
+            models.Index(fields=['returned_date']),
+        ]
+
+
+class ArchivedLoan(models.Model):
+    """
+    Закрытый заём, перенесённый из Loan командой archive_loans. Поля и id
+    совпадают с Loan, поэтому запись можно вернуть обратно без изменений.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_loans')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='archived_loans')
+    borrowed_date = models.DateTimeField()
+    due_date = models.DateTimeField()
+    returned_date = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Loan.STATUS_CHOICES, default='returned')
+    renewals = models.IntegerField(default=0)
+    max_renewals = models.IntegerField(default=2)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    is_archived = True
+    # Те же атрибуты, что даёт LoanQuerySet.with_overdue()
+    overdue = False
+    overdue_for = None
+    renewable = False
+
+    def can_renew(self):
+        return False
+
+    def is_overdue(self):
+        return False
+
+    def days_overdue(self):
+        return 0
+
+    def __str__(self):
+        return f"{self.user.username} - {self.book.title} (archived)"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['borrowed_date', 'id']),
+            models.Index(fields=['user', 'borrowed_date', 'id']),
+            models.Index(fields=['returned_date']),
+        ]
+
 
 class Reservation(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
         ('available', 'Available'),
+        ('fulfilled', 'Fulfilled'),
         ('cancelled', 'Cancelled'),
         ('expired', 'Expired'),
     )
@@ -73,23 +148,28 @@ class Reservation(models.Model):
     expiry_date = models.DateTimeField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     notified = models.BooleanField(default=False)
+    # Порядковый номер в очереди на книгу; выдаёт loans.circulation.place_hold под блокировкой
+    # книги, поэтому брони создаются только через неё
     priority = models.IntegerField(default=0)
 
     def save(self, *args, **kwargs):
         if not self.expiry_date:
             self.expiry_date = timezone.now() + timedelta(days=3)
 
-        if not self.pk:
-            existing_reservations = Reservation.objects.filter(
-                book=self.book,
-                status__in=['pending', 'available']
-            ).count()
-            self.priority = existing_reservations + 1
-
         super().save(*args, **kwargs)
 
     def is_expired(self):
         return timezone.now() > self.expiry_date
 
     def __str__(self):
-        return f"{self.user.username} - {self.book.title}"
\ No newline at end of file
+        return f"{self.user.username} - {self.book.title}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['reserved_date', 'id']),
+            models.Index(fields=['book', 'status', 'priority']),
+            models.Index(fields=['status', 'expiry_date']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'priority'], name='unique_reservation_queue_position'),
+        ]
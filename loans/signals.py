@@ -0,0 +1,27 @@
+"""
+Сигналы выдачи для других приложений.
+
+Массовые операции (bulk_create, UPDATE, архивирование) не вызывают сигналов
+моделей — после них отправляется circulation_changed, чтобы подписчики
+(например, сводка reports.stats) сбросили свои кэши. Выдачи и продления
+передаются в сигнале (borrowed_book_ids, renewed_loan_ids): по ним reports
+ведёт рейтинги популярности и ежедневные итоги, а loans от reports не зависит.
+Сигнал отправляется синхронно, поэтому внутри транзакции записи подписчиков
+фиксируются или откатываются вместе с операцией.
+"""
+from django.dispatch import Signal
+
+from .models import Loan
+
+circulation_changed = Signal()
+
+
+def send_circulation_changed(borrowed_book_ids=(), renewed_loan_ids=(), now=None):
+    """
+    Вызывать после массового изменения займов, броней или экземпляров (внутри
+    транзакции или после неё). borrowed_book_ids — книги новых выдач (id
+    повторяется для каждой выдачи), renewed_loan_ids — продлённые займы.
+    """
+    circulation_changed.send(
+        sender=Loan, borrowed_book_ids=list(borrowed_book_ids), renewed_loan_ids=list(renewed_loan_ids), now=now
+    )
@@ -0,0 +1,45 @@
+"""
+Перевод просроченных займов в статус overdue.
+
+Раньше статус пересчитывался только в Loan.save(), поэтому займы с истёкшим
+сроком оставались active, пока их кто-нибудь не сохранит. sweep_overdue_loans()
+делает это одним UPDATE по индексу (status, due_date): условие
+status = 'active' AND due_date < now выбирает только займы, просроченные
+после прошлого запуска, — уже переведённые в overdue повторно не трогаются.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Loan
+from .signals import send_circulation_changed
+
+SWEEP_INTERVAL = getattr(settings, 'LOAN_STATUS_SWEEP_INTERVAL', 60)  # секунд
+SWEEP_THROTTLE_CACHE_KEY = 'loans:status_sweep:throttle'
+LAST_SWEEP_CACHE_KEY = 'loans:status_sweep:last_run'
+
+
+def sweep_overdue_loans(now=None, loans=None):
+    """loans — перевести только эти займы (время общего прогона тогда не запоминается)."""
+    now = now or timezone.now()
+    scoped = loans is not None
+    loans = loans if scoped else Loan.objects.all()
+    updated = loans.filter(status='active', due_date__lt=now).update(status='overdue')
+    if not scoped:
+        cache.set(LAST_SWEEP_CACHE_KEY, now, None)
+    if updated:
+        send_circulation_changed()
+    return updated
+
+
+def ensure_loan_statuses_fresh():
+    """
+    Хук для представлений и отчётов, которые фильтруют по status: запускает
+    sweep не чаще раза в SWEEP_INTERVAL, даже если cron-задача не настроена.
+    """
+    if cache.add(SWEEP_THROTTLE_CACHE_KEY, True, SWEEP_INTERVAL):
+        sweep_overdue_loans()
+
+
+def last_sweep_time():
+    return cache.get(LAST_SWEEP_CACHE_KEY)
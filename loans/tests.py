@@ -1,3 +1,363 @@
-from django.test import TestCase
+import random
+import threading
+import time
+from datetime import timedelta
 
-# Create your tests here.
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from books.models import Author, Book
+from notifications.models import Notification
+
+from . import archive, circulation
+from .models import ArchivedLoan, Loan, Reservation
+
+
+def make_book(copies=1, isbn='9780000000001'):
+    author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+    return Book.objects.create(title='War and Peace', author=author, isbn=isbn, publication_year=1869,
+                               publisher='Russky Vestnik', total_copies=copies, available_copies=copies)
+
+
+class ReaderPagesQueryCountTests(TestCase):
+    """Число запросов страниц читателя не зависит от числа его займов и броней."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.few = cls.make_reader('few', 3)
+        cls.many = cls.make_reader('many', 300)
+
+    @staticmethod
+    def make_reader(username, count):
+        reader = User.objects.create_user(username, password='secret')
+        # Отдельные книга и автор на каждый заём — обращение к связанной записи на строку будет видно
+        authors = Author.objects.bulk_create([
+            Author(first_name=username, last_name=str(i)) for i in range(count)
+        ])
+        books = Book.objects.bulk_create([
+            Book(title=f'{username} {i}', author=author, isbn=f'{username[:4]}{i:09d}',
+                 publication_year=2000, publisher='Test', total_copies=2, available_copies=1)
+            for i, author in enumerate(authors)
+        ])
+        now = timezone.now()
+        Loan.objects.bulk_create([
+            Loan(user=reader, book=book, due_date=now + timedelta(days=14 - i % 20),
+                 returned_date=now if i % 3 == 0 else None, status='returned' if i % 3 == 0 else 'active')
+            for i, book in enumerate(books)
+        ])
+        Reservation.objects.bulk_create([
+            Reservation(user=reader, book=book, expiry_date=now + timedelta(days=3), priority=1)
+            for book in books
+        ])
+        return reader
+
+    def count_queries(self, reader, url):
+        self.client.force_login(reader)
+        # Первый запрос прогревает кэш (sweep статусов, сессия)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def assert_constant(self, url, paged=0):
+        # paged — запросы, которые добавляет пагинатор, когда есть следующая страница
+        expected = self.count_queries(self.few, url) + paged
+        self.client.force_login(self.many)
+        self.client.get(url)
+        with self.assertNumQueries(expected):
+            self.client.get(url)
+
+    def test_my_loans(self):
+        self.assert_constant(reverse('my_loans'))
+
+    def test_loan_history(self):
+        # 3 займа — одна страница; при 300 для подписи пагинатора считается COUNT
+        self.assert_constant(reverse('loan_history'), paged=1)
+
+    def test_my_reservations(self):
+        self.assert_constant(reverse('my_reservations'))
+
+
+class ReturnedDateUpdateTests(TestCase):
+    """Дата возврата, выставленная через API или админку, возвращает экземпляр в оборот."""
+
+    def setUp(self):
+        self.book = make_book(copies=1)
+        self.reader = User.objects.create_user('reader', password='secret')
+        self.loan = circulation.borrow_book(self.reader, self.book)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+
+    def test_api_partial_update_returns_copy(self):
+        self.client.force_login(self.reader)
+        returned_at = timezone.now() - timedelta(hours=1)
+        response = self.client.patch(f'/api/loans/{self.loan.pk}/', {'returned_date': returned_at.isoformat()},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'returned')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+
+        # Повторная отметка не возвращает второй экземпляр, снять отметку нельзя
+        self.client.patch(f'/api/loans/{self.loan.pk}/', {'returned_date': timezone.now().isoformat()},
+                          content_type='application/json')
+        response = self.client.patch(f'/api/loans/{self.loan.pk}/', {'returned_date': None},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+
+    def test_admin_change_returns_copy_to_next_hold(self):
+        waiting = User.objects.create_user('waiting', password='secret')
+        reservation = circulation.place_hold(waiting, self.book)
+        admin = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(admin)
+        now = timezone.localtime()
+        response = self.client.post(reverse('admin:loans_loan_change', args=[self.loan.pk]), {
+            'book': self.book.pk, 'user': self.reader.pk,
+            'due_date_0': self.loan.due_date.strftime('%Y-%m-%d'), 'due_date_1': '12:00:00',
+            'returned_date_0': now.strftime('%Y-%m-%d'), 'returned_date_1': now.strftime('%H:%M:%S'),
+            'status': 'active', 'renewals': 0, 'max_renewals': 2,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.status, 'returned')
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, 'available')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+
+
+class HoldQueueTests(TestCase):
+    """Очередь броней: экземпляр достаётся первому в очереди при возврате, отмене и истечении брони."""
+
+    def setUp(self):
+        self.book = make_book(copies=1)
+        self.borrower = User.objects.create_user('borrower', password='secret')
+        self.loan = circulation.borrow_book(self.borrower, self.book)
+        self.readers = [User.objects.create_user(f'waiting-{i}', password='secret') for i in range(3)]
+        self.holds = [circulation.place_hold(reader, self.book) for reader in self.readers]
+
+    def statuses(self):
+        return list(Reservation.objects.filter(book=self.book).order_by('priority').values_list('status', flat=True))
+
+    def available_copies(self):
+        return Book.objects.values_list('available_copies', flat=True).get(pk=self.book.pk)
+
+    def test_holds_queue_in_order(self):
+        self.assertEqual([hold.priority for hold in self.holds], [1, 2, 3])
+        self.assertEqual([circulation.queue_position(hold) for hold in self.holds], [1, 2, 3])
+        with self.assertRaises(circulation.CirculationError):
+            circulation.place_hold(self.readers[0], self.book)
+
+    def test_return_promotes_head_of_queue(self):
+        circulation.return_loan(self.loan)
+        self.assertEqual(self.statuses(), ['available', 'pending', 'pending'])
+        # Отложенный экземпляр на полку не возвращается
+        self.assertEqual(self.available_copies(), 0)
+        self.assertTrue(Notification.objects.filter(
+            user=self.readers[0], notification_type='reservation_available', related_object_id=self.holds[0].pk
+        ).exists())
+        self.holds[1].refresh_from_db()
+        self.assertEqual(circulation.queue_position(self.holds[1]), 1)
+
+    def test_cancel_passes_copy_to_next_in_queue(self):
+        circulation.cancel_hold(self.holds[1])
+        circulation.return_loan(self.loan)
+        self.assertEqual(self.statuses(), ['available', 'cancelled', 'pending'])
+
+        self.holds[0].refresh_from_db()
+        circulation.cancel_hold(self.holds[0])
+        self.assertEqual(self.statuses(), ['cancelled', 'cancelled', 'available'])
+        self.assertEqual(self.available_copies(), 0)
+
+        circulation.cancel_hold(self.holds[2])
+        self.assertEqual(self.available_copies(), 1)
+        with self.assertRaises(circulation.CirculationError):
+            circulation.cancel_hold(self.holds[2])
+
+    def test_expiry_passes_copy_to_next_in_queue(self):
+        circulation.return_loan(self.loan)
+        self.assertEqual(circulation.expire_holds(), 0)
+        later = timezone.now() + circulation.HOLD_PERIOD + timedelta(minutes=1)
+        self.assertEqual(circulation.expire_holds(later), 1)
+        self.assertEqual(self.statuses(), ['expired', 'available', 'pending'])
+        self.assertEqual(self.available_copies(), 0)
+
+    def test_held_copy_is_lent_to_its_reader(self):
+        circulation.return_loan(self.loan)
+        self.holds[0].refresh_from_db()
+        loan = circulation.fulfil_reservation(self.holds[0])
+        self.assertEqual(loan.user, self.readers[0])
+        self.assertEqual(self.statuses(), ['fulfilled', 'pending', 'pending'])
+        self.assertEqual(self.available_copies(), 0)
+
+    def test_hold_on_shelved_copy_is_available_at_once(self):
+        book = make_book(copies=1, isbn='9780000000002')
+        hold = circulation.place_hold(self.readers[0], book)
+        self.assertEqual(hold.status, 'available')
+        self.assertEqual(Book.objects.values_list('available_copies', flat=True).get(pk=book.pk), 0)
+
+    def test_admin_add_joins_end_of_queue(self):
+        admin = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(admin)
+        reader = User.objects.create_user('late', password='secret')
+        url = reverse('admin:loans_reservation_add')
+        response = self.client.post(url, {'user': reader.pk, 'book': self.book.pk})
+        self.assertEqual(response.status_code, 302)
+        hold = Reservation.objects.get(user=reader)
+        self.assertEqual((hold.priority, circulation.queue_position(hold)), (4, 4))
+
+        response = self.client.post(url, {'user': reader.pk, 'book': self.book.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Reservation.objects.filter(user=reader).count(), 1)
+
+
+class ArchiveRoundTripTests(TestCase):
+    """Архивные займы видны истории и подсчётам, а восстановление возвращает их без изменений."""
+
+    def setUp(self):
+        self.reader = User.objects.create_user('reader', password='secret')
+        self.book = make_book(copies=5)
+        now = timezone.now()
+        for days_ago in (700, 600, 500, 10):
+            loan = Loan.objects.create(user=self.reader, book=self.book, due_date=now - timedelta(days=days_ago - 14),
+                                       returned_date=now - timedelta(days=days_ago - 7) if days_ago > 10 else None)
+            Loan.objects.filter(pk=loan.pk).update(borrowed_date=now - timedelta(days=days_ago), renewals=days_ago % 3)
+
+    def snapshot(self, model):
+        fields = [field.attname for field in Loan._meta.concrete_fields]
+        return sorted(model.objects.values_list(*fields))
+
+    def history(self):
+        self.client.force_login(self.reader)
+        return [loan.pk for loan in self.client.get(reverse('loan_history')).context['loans']]
+
+    def test_archive_and_restore(self):
+        before = self.snapshot(Loan)
+        history = self.history()
+        self.assertEqual(len(history), 4)
+
+        self.assertEqual(archive.archive_loans(batch_size=2), 3)
+        self.assertEqual(Loan.objects.count(), 1)
+        self.assertEqual(self.snapshot(ArchivedLoan), before[:3])
+        self.assertEqual(self.history(), history)
+        self.assertEqual(archive.count_loans(), 4)
+        self.assertEqual(archive.count_loans(timezone.now() - timedelta(days=550)), 2)
+        self.assertEqual(archive.count_loans(user=self.reader, status='returned'), 3)
+
+        self.assertEqual(archive.restore_loans(user=self.reader, batch_size=2), 3)
+        self.assertFalse(ArchivedLoan.objects.exists())
+        self.assertEqual(self.snapshot(Loan), before)
+        self.assertEqual(self.history(), history)
+
+
+class LastPageNumberTests(TestCase):
+    """Без COUNT последняя страница и страницы перед ней не получают выдуманный номер."""
+
+    def setUp(self):
+        reader = User.objects.create_user('reader', password='secret')
+        books = [make_book(isbn=f'97800000{i:05d}') for i in range(45)]
+        now = timezone.now()
+        Reservation.objects.bulk_create([
+            Reservation(user=reader, book=book, expiry_date=now + timedelta(days=3), priority=1) for book in books
+        ])
+        self.client.force_login(reader)
+
+    def page(self, cursor=''):
+        response = self.client.get(reverse('my_reservations'), {'cursor': cursor})
+        return response, response.context['page_obj']
+
+    def test_last_page_without_count(self):
+        response, first = self.page()
+        self.assertEqual(first.number, 1)
+        self.assertContains(response, 'Page 1')
+
+        response, last = self.page(first.last_cursor)
+        self.assertEqual((last.number, last.has_previous(), len(last)), (None, True, 20))
+        self.assertContains(response, 'Last page')
+        self.assertNotContains(response, 'Page 1')
+
+        response, previous = self.page(last.previous_cursor)
+        self.assertEqual((previous.number, previous.has_next()), (None, True))
+        self.assertNotContains(response, 'Page 1')
+        _, back = self.page(previous.next_cursor)
+        self.assertEqual([item.pk for item in back], [item.pk for item in last])
+
+    def test_single_page_is_page_one(self):
+        Reservation.objects.filter(pk__in=list(Reservation.objects.values_list('pk', flat=True)[:30])).delete()
+        _, first = self.page()
+        _, last = self.page(first.last_cursor)
+        self.assertEqual((last.number, last.has_previous()), (1, False))
+
+
+class CirculationConcurrencyTests(TransactionTestCase):
+    """Параллельные выдачи, возвраты и продления одной книги не сбивают available_copies."""
+
+    THREADS = 8
+    ITERATIONS = 30
+    COPIES = 3
+
+    def test_available_copies_never_drift(self):
+        book = make_book(copies=self.COPIES)
+        users = [User.objects.create_user(f'reader-{i}', password=None) for i in range(self.THREADS)]
+        violations = []
+        errors = []
+
+        def step(user, action):
+            if action == 'borrow':
+                # borrow_book берёт экземпляр через take_copy
+                circulation.borrow_book(user, book)
+                return
+            loan = Loan.objects.filter(user=user, returned_date__isnull=True).first()
+            if loan is None:
+                return
+            if action == 'renew':
+                circulation.renew_loan(loan)
+                return
+            circulation.return_loan(loan)
+            try:
+                circulation.return_loan(loan)
+            except circulation.CirculationError:
+                pass
+            else:
+                violations.append('double return')
+
+        def worker(user, seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(self.ITERATIONS):
+                    action = rng.choice(['borrow', 'borrow', 'return', 'renew'])
+                    for _ in range(50):
+                        try:
+                            step(user, action)
+                            available = Book.objects.values_list('available_copies', flat=True).get(pk=book.pk)
+                        except circulation.CirculationError:
+                            break
+                        except OperationalError:
+                            # SQLite отвечает "database is locked" при конкурентной записи — повторяем
+                            time.sleep(rng.uniform(0, 0.01))
+                            continue
+                        if not 0 <= available <= self.COPIES:
+                            violations.append(f'available_copies={available}')
+                        break
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user, i)) for i, user in enumerate(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(violations, [])
+        book.refresh_from_db()
+        active = Loan.objects.filter(book=book, returned_date__isnull=True).count()
+        self.assertEqual(book.available_copies, self.COPIES - active)
@@ -10,6 +10,7 @@ urlpatterns = [
     path('borrow/<int:book_id>/', views.borrow_book, name='borrow_book'),
     path('return/<int:loan_id>/', views.return_book, name='return_book'),
     path('renew/<int:loan_id>/', views.renew_loan, name='renew_loan'),
+    path('circulation-desk/', views.circulation_desk, name='circulation_desk'),
     path('reserve/<int:book_id>/', views.reserve_book, name='reserve_book'),
     path('cancel-reservation/<int:reservation_id>/', views.cancel_reservation, name='cancel_reservation'),
     path('manage-reservation/<int:reservation_id>/<str:action>/', views.manage_reservation, name='manage_reservation'),
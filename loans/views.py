@@ -1,12 +1,15 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.utils import timezone
-from datetime import timedelta
-from django.db.models import Q
-from django.core.paginator import Paginator
-from .models import Loan, Reservation
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from library_management.pagination import CursorPaginator
+from .archive import LoanHistoryPaginator, archive_horizon
+from .models import ArchivedLoan, Loan, Reservation
+from . import circulation
+from .sweeper import ensure_loan_statuses_fresh
 from books.models import Book
+from reports.stats import get_circulation_stats
 
 
 def is_librarian(user):
@@ -17,56 +20,30 @@ def is_librarian(user):
 def borrow_book(request, book_id):
     book = get_object_or_404(Book, pk=book_id)
 
-    # Проверяем доступность книги
-    if book.available_copies > 0:
-        # Проверяем, нет ли у пользователя уже этой книги
-        existing_loan = Loan.objects.filter(
-            user=request.user,
-            book=book,
-            returned_date__isnull=True
-        ).exists()
-
-        if not existing_loan:
-            # Проверяем лимит займов (максимум 5)
-            active_loans_count = Loan.objects.filter(
-                user=request.user,
-                returned_date__isnull=True
-            ).count()
-
-            if active_loans_count >= 5:
-                messages.error(request, 'You have reached the maximum number of active loans (5).')
-                return redirect('book_detail', pk=book_id)
-
-            # Создаем займ
-            Loan.objects.create(user=request.user, book=book)
-            messages.success(request, f'You have successfully borrowed "{book.title}"')
-        else:
-            messages.error(request, 'You already have this book on loan.')
+    try:
+        circulation.borrow_book(request.user, book)
+    except circulation.CirculationError as e:
+        messages.error(request, str(e))
     else:
-        messages.error(request, 'This book is not available for borrowing.')
+        messages.success(request, f'You have successfully borrowed "{book.title}"')
 
     return redirect('book_detail', pk=book_id)
 
 
 @login_required
 def return_book(request, loan_id):
-    loan = get_object_or_404(Loan, pk=loan_id)
+    loan = get_object_or_404(Loan.objects.select_related('book'), pk=loan_id)
 
     # Проверяем права: пользователь может возвращать только свои книги, библиотекарь - любые
-    if loan.user != request.user and not is_librarian(request.user):
+    if loan.user_id != request.user.pk and not is_librarian(request.user):
         messages.error(request, 'You do not have permission to return this book.')
         return redirect('my_loans')
 
-    if not loan.returned_date:
-        loan.returned_date = timezone.now()
-        loan.save()
-
-        # Обновляем доступные копии книги
-        book = loan.book
-        if book.available_copies < book.total_copies:
-            book.available_copies += 1
-            book.save()
-
+    try:
+        circulation.return_loan(loan)
+    except circulation.CirculationError:
+        pass
+    else:
         messages.success(request, f'Book "{loan.book.title}" has been returned.')
 
     if is_librarian(request.user):
@@ -77,52 +54,95 @@ def return_book(request, loan_id):
 
 @login_required
 def renew_loan(request, loan_id):
-    loan = get_object_or_404(Loan, pk=loan_id, user=request.user)
+    loan = get_object_or_404(Loan.objects.select_related('book'), pk=loan_id, user=request.user)
 
-    if loan.can_renew():
-        loan.renewals += 1
-        loan.due_date = timezone.now() + timedelta(days=14)
-        loan.save()
+    try:
+        circulation.renew_loan(loan)
+    except circulation.CirculationError as e:
+        messages.error(request, str(e))
+    else:
         messages.success(request,
                          f'Loan for "{loan.book.title}" renewed successfully! New due date: {loan.due_date.strftime("%B %d, %Y")}')
-    else:
-        messages.error(request,
-                       'This loan cannot be renewed. You may have reached the maximum renewal limit or the book is overdue.')
 
     return redirect('my_loans')
 
 
+def _parse_batch_lines(text):
+    """Строка — id займа или пара "ISBN membership_id" через пробел или запятую."""
+    items = []
+    for line in text.splitlines():
+        parts = line.replace(',', ' ').split()
+        if len(parts) == 1 and parts[0].isdigit() and len(parts[0]) < 10:
+            items.append(int(parts[0]))
+        elif len(parts) == 2:
+            items.append((parts[0], parts[1]))
+        elif parts:
+            items.append(line.strip())
+    return items
+
+
+@login_required
+@user_passes_test(is_librarian)
+def circulation_desk(request):
+    results = None
+    action = request.POST.get('action', 'return')
+    text = request.POST.get('items', '')
+
+    if request.method == 'POST':
+        items = _parse_batch_lines(text)
+        valid = [item for item in items if not isinstance(item, str)]
+        if action == 'checkout':
+            valid = [item for item in valid if isinstance(item, tuple)]
+            results = circulation.batch_checkout(valid) if valid else []
+        else:
+            results = circulation.batch_return(valid) if valid else []
+        # Нераспознанные строки тоже показываем в результатах
+        results += [
+            {'item': item, 'ok': False, 'loan_id': None, 'error': 'Invalid item for this operation.'}
+            for item in items if item not in valid
+        ]
+        for result in results:
+            if isinstance(result['item'], tuple):
+                result['item'] = ' '.join(result['item'])
+
+        succeeded = sum(1 for result in results if result['ok'])
+        messages.success(request, f'Processed {len(results)} items: {succeeded} succeeded.')
+
+    return render(request, 'loans/circulation_desk.html', {
+        'results': results,
+        'action': action,
+        'items_text': text,
+    })
+
+
 @login_required
 def reserve_book(request, book_id):
     book = get_object_or_404(Book, pk=book_id)
 
-    existing_reservation = Reservation.objects.filter(
-        user=request.user,
-        book=book,
-        status__in=['pending', 'available']
-    ).exists()
-
-    existing_loan = Loan.objects.filter(
-        user=request.user,
-        book=book,
-        returned_date__isnull=True
-    ).exists()
-
-    if not existing_reservation and not existing_loan:
-        Reservation.objects.create(user=request.user, book=book)
-        messages.success(request, f'You have reserved "{book.title}". You will be notified when it becomes available.')
-    else:
+    try:
+        reservation = circulation.place_hold(request.user, book)
+    except circulation.CirculationError:
         messages.error(request, 'You already have an active reservation or loan for this book.')
+    else:
+        if reservation.status == 'available':
+            messages.success(request, f'A copy of "{book.title}" is being held for you at the circulation desk.')
+        else:
+            messages.success(request,
+                             f'You have reserved "{book.title}" (position {circulation.queue_position(reservation)} '
+                             f'in the queue). You will be notified when it becomes available.')
 
     return redirect('book_detail', pk=book_id)
 
 
 @login_required
 def cancel_reservation(request, reservation_id):
-    reservation = get_object_or_404(Reservation, pk=reservation_id, user=request.user)
-    reservation.status = 'cancelled'
-    reservation.save()
-    messages.success(request, f'Reservation for "{reservation.book.title}" has been cancelled.')
+    reservation = get_object_or_404(Reservation.objects.select_related('book'), pk=reservation_id, user=request.user)
+    try:
+        circulation.cancel_hold(reservation)
+    except circulation.CirculationError as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, f'Reservation for "{reservation.book.title}" has been cancelled.')
     return redirect('my_reservations')
 
 
@@ -135,33 +155,43 @@ def manage_reservation(request, reservation_id, action):
     reservation = get_object_or_404(Reservation, pk=reservation_id)
 
     if action == 'fulfill':
-        if reservation.book.available_copies > 0:
-            Loan.objects.create(user=reservation.user, book=reservation.book)
-            reservation.status = 'fulfilled'
-            reservation.save()
-            messages.success(request, f'Reservation fulfilled. Book loaned to {reservation.user.username}.')
+        try:
+            circulation.fulfil_reservation(reservation)
+        except circulation.CirculationError as e:
+            messages.error(request, str(e))
         else:
-            messages.error(request, 'Book is not available for loan.')
+            messages.success(request, f'Reservation fulfilled. Book loaned to {reservation.user.username}.')
 
     elif action == 'cancel':
-        reservation.status = 'cancelled'
-        reservation.save()
-        messages.success(request, 'Reservation cancelled.')
+        try:
+            circulation.cancel_hold(reservation)
+        except circulation.CirculationError as e:
+            messages.error(request, str(e))
+        else:
+            messages.success(request, 'Reservation cancelled.')
 
     return redirect('all_reservations')
 
 
 @login_required
 def my_loans(request):
-    loans = Loan.objects.filter(user=request.user).order_by('-borrowed_date')
+    ensure_loan_statuses_fresh()
+    user_loans = Loan.objects.filter(user=request.user)
 
-    active_loans = loans.filter(returned_date__isnull=True)
-    overdue_loans = active_loans.filter(due_date__lt=timezone.now())
+    counts = user_loans.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(status__in=['active', 'overdue'])),
+        overdue=Count('id', filter=Q(status='overdue')),
+    )
+
+    # На странице только текущие займы; закрытые — в истории
+    loans = user_loans.filter(returned_date__isnull=True).select_related('book__author').with_overdue().order_by('due_date', 'id')
 
     context = {
         'loans': loans,
-        'active_loans_count': active_loans.count(),
-        'overdue_loans_count': overdue_loans.count()
+        'active_loans_count': counts['active'],
+        'overdue_loans_count': counts['overdue'],
+        'total_loans_count': counts['total'] + ArchivedLoan.objects.filter(user=request.user).count()
     }
 
     return render(request, 'loans/my_loans.html', context)
@@ -169,40 +199,62 @@ def my_loans(request):
 
 @login_required
 def my_reservations(request):
-    reservations = Reservation.objects.filter(user=request.user).order_by('-reserved_date')
-    return render(request, 'loans/my_reservations.html', {'reservations': reservations})
+    # Позиция в очереди — число ожидающих броней той же книги с меньшим номером
+    ahead = Reservation.objects.filter(
+        book=OuterRef('book'),
+        status='pending',
+        priority__lt=OuterRef('priority')
+    ).order_by().values('book').annotate(count=Count('id')).values('count')
+    reservations = Reservation.objects.filter(user=request.user).select_related('book__author').annotate(
+        queue_ahead=Coalesce(Subquery(ahead, output_field=IntegerField()), 0)
+    )
+
+    paginator = CursorPaginator(reservations, 20, ('-reserved_date', '-id'), count=None)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    return render(request, 'loans/my_reservations.html', {'reservations': page_obj, 'page_obj': page_obj})
 
 
 @login_required
 def loan_history(request):
-    loans = Loan.objects.filter(user=request.user).order_by('-borrowed_date')
-    return render(request, 'loans/loan_history.html', {'loans': loans})
+    # Архив читается, только если история доходит до архивных займов читателя
+    paginator = LoanHistoryPaginator(
+        Loan.objects.filter(user=request.user).select_related('book__author').with_overdue(),
+        ArchivedLoan.objects.filter(user=request.user).select_related('book__author'),
+        20,
+        archive_horizon(user=request.user)
+    )
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+
+    if request.GET.get('partial'):
+        # Подгрузка следующей страницы при прокрутке: только строки таблицы
+        response = render(request, 'loans/includes/loan_history_rows.html', {'loans': page_obj})
+        response['X-Next-Cursor'] = page_obj.next_cursor or ''
+        return response
+
+    return render(request, 'loans/loan_history.html', {'loans': page_obj, 'page_obj': page_obj})
 
 
 @login_required
 @user_passes_test(is_librarian)
 def all_loans(request):
-    loans = Loan.objects.all().order_by('-borrowed_date')
+    ensure_loan_statuses_fresh()
+    stats = get_circulation_stats()
+    loans = Loan.objects.select_related('user', 'book__author')
 
     # Фильтрация по статусу
     status_filter = request.GET.get('status')
-    if status_filter == 'active':
-        loans = loans.filter(returned_date__isnull=True, due_date__gte=timezone.now())
-    elif status_filter == 'overdue':
-        loans = loans.filter(returned_date__isnull=True, due_date__lt=timezone.now())
+    # Список — только горячая таблица, поэтому и число строк без архива
+    if status_filter in ('active', 'overdue'):
+        loans = loans.filter(status=status_filter)
+        count = stats[f'{status_filter}_loans']
     elif status_filter == 'returned':
-        loans = loans.filter(returned_date__isnull=False)
+        loans = loans.filter(status=status_filter)
+        count = stats['hot_returned_loans']
+    else:
+        count = stats['hot_total_loans']
 
-    paginator = Paginator(loans, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-
-    stats = {
-        'total_loans': Loan.objects.count(),
-        'active_loans': Loan.objects.filter(returned_date__isnull=True, due_date__gte=timezone.now()).count(),
-        'overdue_loans': Loan.objects.filter(returned_date__isnull=True, due_date__lt=timezone.now()).count(),
-        'returned_loans': Loan.objects.filter(returned_date__isnull=False).count(),
-    }
+    paginator = CursorPaginator(loans, 20, ('-borrowed_date', '-id'), count=count)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
 
     return render(request, 'loans/all_loans.html', {
         'loans': page_obj,
@@ -214,11 +266,17 @@ def all_loans(request):
 @login_required
 @user_passes_test(is_librarian)
 def all_reservations(request):
-    reservations = Reservation.objects.all().order_by('-reserved_date')
+    reservations = Reservation.objects.select_related('user', 'book__author')
 
     status_filter = request.GET.get('status')
     if status_filter:
         reservations = reservations.filter(status=status_filter)
 
-    return render(request, 'loans/all_reservations.html', {'reservations': reservations})
+    paginator = CursorPaginator(reservations, 20, ('-reserved_date', '-id'))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+
+    return render(request, 'loans/all_reservations.html', {
+        'reservations': page_obj,
+        'page_obj': page_obj
+    })
 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Notification, NotificationPreference
+from .models import EmailOutbox, Notification, NotificationLedger, NotificationPreference
 
 
 @admin.register(Notification)
@@ -25,4 +25,19 @@ class NotificationPreferenceAdmin(admin.ModelAdmin):
     list_display = (
     'user', 'email_due_reminders', 'email_overdue_alerts', 'email_reservation_available', 'email_general')
     list_filter = ('email_due_reminders', 'email_overdue_alerts', 'email_reservation_available', 'email_general')
-    search_fields = ('user__username', 'user__email')
\ No newline at end of file
+    search_fields = ('user__username', 'user__email')
+
+@admin.register(NotificationLedger)
+class NotificationLedgerAdmin(admin.ModelAdmin):
+    list_display = ('user', 'notification_type', 'related_content_type', 'related_object_id', 'period', 'created_at')
+    list_filter = ('notification_type', 'created_at')
+    search_fields = ('user__username',)
+    readonly_fields = ('created_at',)
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('recipient', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('recipient', 'subject')
+    readonly_fields = ('created_at', 'sent_at', 'claimed_at', 'last_error')
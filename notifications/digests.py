@@ -0,0 +1,159 @@
+"""
+Сводки по займам: одно уведомление и одно письмо на читателя за запуск.
+
+Напоминания о сроке и уведомления о просрочке собираются одним запросом:
+условия due_reminder_filter() и escalation_filters() объединяются через OR,
+тип и период каждого займа вычисляются в SQL (Case/When), а займы, уже
+отмеченные в NotificationLedger, отсекаются NOT EXISTS — журнал общий с
+поштучной рассылкой (notifications.pipeline). Займы идут по user_id
+порциями, которые не разрывают читателя; на каждую порцию — одна вставка
+отметок, одна вставка уведомлений и одна вставка писем в EmailOutbox.
+Число записей и писем зависит от количества читателей, а не займов.
+"""
+import time
+import uuid
+from functools import reduce
+from itertools import groupby
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, CharField, Exists, OuterRef, Value, When
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from loans.models import Loan
+from loans.sweeper import sweep_overdue_loans
+from .live import schedule_unread_bump
+from .models import Notification, NotificationLedger, NotificationPreference
+from .outbox import enqueue_emails
+from .pipeline import CHUNK_SIZE, LOAN_FIELDS, PipelineStats, due_reminder_filter, escalation_filters
+
+# По умолчанию рассылки идут сводками; поштучно — NOTIFICATION_DIGESTS = False или --per-loan
+DIGESTS_ENABLED = getattr(settings, 'NOTIFICATION_DIGESTS', True)
+DIGEST_FIELDS = LOAN_FIELDS + ('kind', 'period')
+EMAIL_FLAGS = {'due_reminder': 'email_due_reminders', 'overdue_alert': 'email_overdue_alerts'}
+
+
+def _candidates(now, due, overdue):
+    rules = []
+    if due:
+        period, condition = due_reminder_filter(now)
+        rules.append((condition, 'due_reminder', period))
+    if overdue:
+        rules.extend((condition, 'overdue_alert', f'overdue:{days}') for days, condition in escalation_filters(now))
+
+    sent = NotificationLedger.objects.filter(
+        user=OuterRef('user'), notification_type=OuterRef('kind'), related_content_type='loan',
+        related_object_id=OuterRef('pk'), period=OuterRef('period')
+    )
+    return Loan.objects.filter(reduce(or_, [condition for condition, _, _ in rules])).annotate(
+        kind=Case(*[When(condition, then=Value(kind)) for condition, kind, _ in rules], output_field=CharField()),
+        period=Case(*[When(condition, then=Value(period)) for condition, _, period in rules], output_field=CharField()),
+    ).filter(~Exists(sent))
+
+
+def _user_chunks(rows, size):
+    """Порции примерно по size строк; строки одного читателя (user_id) не разделяются."""
+    chunk = []
+    for row in rows:
+        if len(chunk) >= size and row[1] != chunk[-1][1]:
+            yield chunk
+            chunk = []
+        chunk.append(row)
+    if chunk:
+        yield chunk
+
+
+def _claim(chunk):
+    token = uuid.uuid4().hex
+    NotificationLedger.objects.bulk_create([
+        NotificationLedger(
+            user_id=row[1], notification_type=row[6], related_content_type='loan',
+            related_object_id=row[0], period=row[7], claimed_by=token
+        )
+        for row in chunk
+    ], batch_size=CHUNK_SIZE, ignore_conflicts=True)
+    return set(NotificationLedger.objects.filter(claimed_by=token).values_list('related_object_id', flat=True))
+
+
+def _email_flags(user_ids):
+    """{user_id: множество типов, о которых читатель хочет письма}; нет настроек — писем нет."""
+    rows = NotificationPreference.objects.filter(user_id__in=user_ids).values_list(
+        'user_id', *EMAIL_FLAGS.values()
+    )
+    return {
+        user_id: {kind for kind, enabled in zip(EMAIL_FLAGS, flags) if enabled}
+        for user_id, *flags in rows
+    }
+
+
+def _digest(rows, now):
+    due, overdue = [], []
+    for _, _, _, _, title, due_date, kind, _ in rows:
+        if kind == 'due_reminder':
+            due.append({'title': title, 'due_date': due_date})
+        else:
+            overdue.append({'title': title, 'due_date': due_date, 'days_overdue': (now - due_date).days})
+    return due, overdue
+
+
+def _subject(due, overdue):
+    parts = []
+    if overdue:
+        parts.append(f'{len(overdue)} overdue')
+    if due:
+        parts.append(f'{len(due)} due tomorrow')
+    return 'Your library loans: ' + ', '.join(parts)
+
+
+def send_loan_digests(now=None, due=True, overdue=True):
+    """Сводные уведомления и письма по займам со сроком завтра и/или просроченным; возвращает PipelineStats."""
+    now = now or timezone.now()
+    if overdue:
+        sweep_overdue_loans(now)
+
+    stats = PipelineStats()
+    rows = _candidates(now, due, overdue).order_by('user_id', 'id').values_list(*DIGEST_FIELDS)
+    started = time.perf_counter()
+    for chunk in _user_chunks(rows.iterator(chunk_size=CHUNK_SIZE), CHUNK_SIZE):
+        email_flags = _email_flags({row[1] for row in chunk})
+        stats.timed('read', started)
+        stats.loans += len(chunk)
+
+        started = time.perf_counter()
+        notifications = []
+        emails = []
+        with transaction.atomic():
+            claimed = _claim(chunk)
+            for user_id, user_rows in groupby((row for row in chunk if row[0] in claimed), key=lambda row: row[1]):
+                user_rows = list(user_rows)
+                first_name, email = user_rows[0][2], user_rows[0][3]
+                due_items, overdue_items = _digest(user_rows, now)
+                notifications.append(Notification(
+                    user_id=user_id, title='Library Loan Summary', notification_type='loan_digest',
+                    message=render_to_string('notifications/loan_digest_message.txt', {
+                        'due': due_items, 'overdue': overdue_items,
+                    }).strip(),
+                ))
+
+                # В письмо попадают только разделы, о которых читатель хочет получать почту
+                wanted = email_flags.get(user_id, set())
+                email_due = due_items if 'due_reminder' in wanted else []
+                email_overdue = overdue_items if 'overdue_alert' in wanted else []
+                if email and (email_due or email_overdue):
+                    body = render_to_string('notifications/email/loan_digest.txt', {
+                        'first_name': first_name, 'due': email_due, 'overdue': email_overdue,
+                    })
+                    emails.append((_subject(email_due, email_overdue), body, settings.DEFAULT_FROM_EMAIL, [email]))
+            Notification.objects.bulk_create(notifications, batch_size=CHUNK_SIZE)
+            schedule_unread_bump(notification.user_id for notification in notifications)
+            stats.timed('notify', started)
+
+            started = time.perf_counter()
+            stats.emails += enqueue_emails(emails, now)
+        stats.notifications += len(notifications)
+        stats.timed('email', started)
+        started = time.perf_counter()
+    stats.timed('read', started)
+    return stats
@@ -0,0 +1,156 @@
+"""
+Счётчик непрочитанных уведомлений для значка в шапке.
+
+Состояние читателя берётся из базы: число непрочитанных и максимальный id
+его уведомлений, версия — '<max id>-<непрочитанных>'. Любое создание,
+прочтение или удаление уведомления меняет хотя бы одно из двух, поэтому
+версия не может совпасть со старой при другом значении счётчика.
+
+Состояние кэшируется на UNREAD_STATE_TTL секунд. После фиксации изменений
+(сигналы Notification, а для bulk_create и массовых UPDATE — явный
+schedule_unread_bump()) запись удаляется, и следующее чтение идёт в базу.
+С общим кэшем (REDIS_URL) это сразу видят все процессы; изменения из
+процесса, чей кэш не общий с веб-процессами (команды рассылки при
+LocMemCache), видны не позже чем через UNREAD_STATE_TTL.
+
+Клиенты получают счётчик двумя путями:
+- unread_count_stream (ASGI) — Server-Sent Events. В каждом процессе одна
+  задача UnreadBroadcaster раз в STREAM_POLL_SECONDS читает состояния всех
+  подключённых читателей одним get_many из кэша и только для отсутствующих
+  выполняет один сгруппированный запрос; открытые вкладки базу не опрашивают.
+- get_unread_count — запасной опрос с ETag = версия.
+"""
+import asyncio
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Q
+
+from .models import Notification
+
+UNREAD_STATE_TTL = getattr(settings, 'UNREAD_STATE_TTL', 5)  # секунд
+STREAM_POLL_SECONDS = getattr(settings, 'NOTIFICATION_STREAM_POLL_SECONDS', 1)
+STREAM_HEARTBEAT_SECONDS = getattr(settings, 'NOTIFICATION_STREAM_HEARTBEAT_SECONDS', 20)
+# Через столько секунд поток закрывается и браузер переподключается (retry) — соединения не копятся
+STREAM_MAX_SECONDS = getattr(settings, 'NOTIFICATION_STREAM_MAX_SECONDS', 600)
+STREAM_RETRY_MS = 5000
+STATE_KEY = 'notifications:unread:state:{user_id}'
+STATE_QUERY_CHUNK = 1000
+
+
+def _version(last_id, unread):
+    return f'{last_id or 0}-{unread}'
+
+
+def _state_query(user_ids):
+    return Notification.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+        unread=Count('id', filter=Q(is_read=False)), last_id=Max('id')
+    ).values_list('user_id', 'last_id', 'unread').order_by()
+
+
+def bump_unread(user_ids):
+    """Сбрасывает кэшированные состояния читателей."""
+    cache.delete_many([STATE_KEY.format(user_id=user_id) for user_id in set(user_ids)])
+
+
+def schedule_unread_bump(user_ids):
+    """Сбрасывает состояния после фиксации текущей транзакции."""
+    user_ids = set(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: bump_unread(user_ids))
+
+
+def unread_state(user_id):
+    """(версия, число непрочитанных)."""
+    key = STATE_KEY.format(user_id=user_id)
+    state = cache.get(key)
+    if state is None:
+        counts = Notification.objects.filter(user_id=user_id).aggregate(
+            unread=Count('id', filter=Q(is_read=False)), last_id=Max('id')
+        )
+        state = (_version(counts['last_id'], counts['unread']), counts['unread'])
+        cache.set(key, state, UNREAD_STATE_TTL)
+    return state
+
+
+async def _states(user_ids):
+    """{user_id: (версия, число непрочитанных)}: из кэша, недостающие — сгруппированным запросом."""
+    keys = {STATE_KEY.format(user_id=user_id): user_id for user_id in user_ids}
+    cached = await cache.aget_many(list(keys))
+    states = {keys[key]: state for key, state in cached.items()}
+    missing = [user_id for user_id in user_ids if user_id not in states]
+    fresh = {}
+    for start in range(0, len(missing), STATE_QUERY_CHUNK):
+        chunk = missing[start:start + STATE_QUERY_CHUNK]
+        for user_id in chunk:
+            fresh[user_id] = (_version(None, 0), 0)
+        async for user_id, last_id, unread in _state_query(chunk):
+            fresh[user_id] = (_version(last_id, unread), unread)
+    if fresh:
+        await cache.aset_many(
+            {STATE_KEY.format(user_id=user_id): state for user_id, state in fresh.items()}, UNREAD_STATE_TTL
+        )
+    states.update(fresh)
+    return states
+
+
+async def aunread_state(user_id):
+    return (await _states([user_id]))[user_id]
+
+
+class UnreadBroadcaster:
+    """Рассылает подключённым потокам этого процесса новые значения счётчиков."""
+
+    def __init__(self, interval=STREAM_POLL_SECONDS):
+        self.interval = interval
+        self._queues = {}  # user_id -> множество asyncio.Queue открытых потоков
+        self._versions = {}  # user_id -> последняя разосланная версия
+        self._task = None
+
+    @property
+    def connections(self):
+        return sum(len(queues) for queues in self._queues.values())
+
+    def subscribe(self, user_id, version):
+        queue = asyncio.Queue()
+        self._queues.setdefault(user_id, set()).add(queue)
+        self._versions.setdefault(user_id, version)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self._queues.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._queues[user_id]
+            self._versions.pop(user_id, None)
+
+    async def _run(self):
+        while self._queues:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception:
+                # Кэш или база недоступны — попробуем на следующем шаге, потоки не закрываем
+                continue
+
+    async def check(self):
+        """Один шаг: сравнивает версии и рассылает изменившиеся счётчики; возвращает их число."""
+        if not self._queues:
+            return 0
+        changed = 0
+        for user_id, (version, count) in (await _states(list(self._queues))).items():
+            if user_id not in self._queues or version == self._versions.get(user_id):
+                continue
+            self._versions[user_id] = version
+            for queue in self._queues[user_id]:
+                queue.put_nowait((version, count))
+            changed += 1
+        return changed
+
+
+broadcaster = UnreadBroadcaster()
@@ -0,0 +1,84 @@
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.utils import timezone
+
+from accounts.models import User
+from books.models import Author, Book
+from library_management.benchmark import BenchmarkCommand
+from loans.models import Loan
+from notifications.models import EmailOutbox, Notification, NotificationLedger, NotificationPreference
+from notifications.outbox import MailSender, process_batch
+from notifications.pipeline import send_overdue_alerts
+
+
+class Command(BenchmarkCommand):
+    help = 'Time the overdue notification pipeline and the mail worker on synthetic overdue loans (in-memory mail backend)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = f'notifybench-{uuid.uuid4().hex[:8]}'
+        author = Author.objects.create(first_name='Bench', last_name=prefix)
+        books = Book.objects.bulk_create([
+            Book(title=f'{prefix} {i}', author=author, isbn=f'{i:04d}{uuid.uuid4().hex[:9]}',
+                 publication_year=2000, publisher='bench', total_copies=1000000, available_copies=1000000)
+            for i in range(200)
+        ])
+        # bulk_create не обновляет счётчики автора, а удаление книг в конце их уменьшит
+        Author.objects.filter(pk=author.pk).update(book_count=len(books), available_book_count=len(books))
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com', first_name='Reader')
+            for i in range(options['users'])
+        ])
+        NotificationPreference.objects.bulk_create([NotificationPreference(user=user) for user in users])
+
+        try:
+            now = timezone.now()
+            for offset in range(0, options['loans'], 20000):
+                Loan.objects.bulk_create([
+                    # Сроки в пределах окон ступеней эскалации (до 20 дней просрочки)
+                    Loan(user=rng.choice(users), book=rng.choice(books), status='overdue',
+                         due_date=now - timedelta(seconds=rng.randint(60, 20 * 86400 - 60)))
+                    for _ in range(min(20000, options['loans'] - offset))
+                ])
+
+            started = time.perf_counter()
+            loans = Loan.objects.filter(user__in=users)
+            stats = send_overdue_alerts(now=now, loans=loans)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'Overdue alerts: {stats.summary()}')
+
+            # Повторный запуск ничего не отправляет: всё уже отмечено в журнале
+            started = time.perf_counter()
+            rerun = send_overdue_alerts(now=now, loans=loans)
+            self.stdout.write(f'Repeated run: {rerun.summary()} in {time.perf_counter() - started:.2f}s')
+
+            # Очередь писем разбирает run_mail_worker; здесь — в память вместо SMTP и только свои письма
+            started = time.perf_counter()
+            sender = MailSender(backend='django.core.mail.backends.locmem.EmailBackend')
+            emails = EmailOutbox.objects.filter(recipient__startswith=prefix)
+            sent = 0
+            try:
+                while (batch := process_batch(sender, emails=emails))[0]:
+                    sent += batch[1]
+            finally:
+                sender.close()
+            self.stdout.write(f'Mail worker: {sent} emails sent in {time.perf_counter() - started:.1f}s')
+            self.stdout.write(self.style.SUCCESS(
+                f'Successfully benchmarked the notification pipeline: {stats.loans} loans in {elapsed:.1f}s'
+            ))
+        finally:
+            Notification.objects.filter(user__in=users).delete()
+            EmailOutbox.objects.filter(recipient__startswith=prefix).delete()
+            NotificationLedger.objects.filter(user__in=users).delete()
+            Loan.objects.filter(user__in=users).delete()
+            User.objects.filter(username__startswith=prefix).delete()
+            Book.objects.filter(title__startswith=prefix).delete()
+            author.delete()
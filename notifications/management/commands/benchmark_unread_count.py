@@ -0,0 +1,269 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.asgi import get_asgi_application
+from django.db.models import Count
+from django.urls import reverse
+
+from accounts.models import User
+from library_management.benchmark import BenchmarkCommand
+from notifications.live import STREAM_MAX_SECONDS
+from notifications.models import Notification
+
+LEGACY_INTERVALS = (30, 60)  # base.html и static/js/main.js до перехода на поток
+POLL_INTERVAL = 30
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Scenario:
+    """Счётчики одного прогона: запросы, задержка ответа и задержка до появления нового значения."""
+
+    def __init__(self, name, changes):
+        self.name = name
+        self.changes = changes  # user_id -> [(время изменения, число непрочитанных после него)]
+        self.requests = 0
+        self.not_modified = 0
+        self.latencies = []
+        self.delays = []
+
+    def observed(self, user_id, seen, count, at):
+        """Вкладка увидела count: засчитывает задержку для изменений, которые она видит впервые."""
+        for changed_at, expected in self.changes.get(user_id, ()):
+            if expected <= seen:
+                continue
+            if expected > count:
+                break
+            self.delays.append(at - changed_at)
+        return max(seen, count)
+
+    def report(self, per_minute):
+        line = (
+            f'{self.name}: {self.requests} requests ({per_minute:.2f}/tab/min'
+            + (f', {self.not_modified} not modified' if self.not_modified else '')
+            + f'), response p50 {_percentile(self.latencies, 0.5) * 1000:.1f}ms'
+            f' p99 {_percentile(self.latencies, 0.99) * 1000:.1f}ms'
+        )
+        if self.delays:
+            line += (
+                f', update delay p50 {_percentile(self.delays, 0.5):.2f}s'
+                f' p99 {_percentile(self.delays, 0.99):.2f}s'
+            )
+        return line
+
+
+class Client:
+    """Запросы прямо в ASGI-приложение проекта, без сети."""
+
+    def __init__(self, application):
+        self.application = application
+
+    def _scope(self, path, session_key, headers):
+        return {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+            'headers': [
+                (b'host', b'testserver'),
+                (b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode()),
+                *headers,
+            ],
+        }
+
+    async def get(self, path, session_key, headers=(), on_body=None, disconnect=None):
+        """Возвращает (статус, заголовки, тело); on_body получает куски тела по мере прихода."""
+        disconnect = disconnect or asyncio.Event()
+        state = {'status': None, 'headers': {}, 'body': b'', 'requested': False}
+
+        async def receive():
+            if not state['requested']:
+                state['requested'] = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                state['status'] = message['status']
+                state['headers'] = {name.decode().lower(): value.decode() for name, value in message['headers']}
+            elif message['type'] == 'http.response.body':
+                if on_body is not None:
+                    on_body(message.get('body', b''))
+                else:
+                    state['body'] += message.get('body', b'')
+
+        await self.application(self._scope(path, session_key, headers), receive, send)
+        return state['status'], state['headers'], state['body']
+
+
+class Command(BenchmarkCommand):
+    help = 'Compare unread-count polling with the SSE stream for many concurrent tabs (in-process ASGI)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tabs', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--duration', type=int, default=60, help='Seconds per scenario')
+        parser.add_argument('--changes', type=int, default=300, help='New notifications per scenario')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = f'unreadbench-{uuid.uuid4().hex[:8]}'
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com')
+            for i in range(options['users'])
+        ])
+        backend = settings.AUTHENTICATION_BACKENDS[0]
+        sessions = {}
+        for user in users:
+            session = SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = backend
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.create()
+            sessions[user.pk] = session.session_key
+        tabs = [rng.choice(users).pk for _ in range(options['tabs'])]
+
+        try:
+            results = asyncio.run(self._run(tabs, sessions, prefix, rng, options))
+            legacy, etag, stream = results
+            minutes = options['duration'] / 60
+            self.stdout.write(legacy.report(sum(60 / interval for interval in LEGACY_INTERVALS)))
+            self.stdout.write(etag.report(60 / POLL_INTERVAL))
+            # Поток живёт STREAM_MAX_SECONDS, затем браузер переподключается — в среднем столько запросов
+            self.stdout.write(stream.report(60 / STREAM_MAX_SECONDS))
+            self.stdout.write(
+                f'Measured over {options["duration"]}s: {legacy.requests / minutes:.0f} vs '
+                f'{etag.requests / minutes:.0f} vs {stream.requests / minutes:.0f} requests/min'
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'Successfully benchmarked {options["tabs"]} tabs: {legacy.requests} polling requests vs '
+                f'{stream.requests} stream connections in {options["duration"]}s'
+            ))
+        finally:
+            Session.objects.filter(session_key__in=list(sessions.values())).delete()
+            Notification.objects.filter(user__in=users).delete()
+            User.objects.filter(username__startswith=prefix).delete()
+
+    async def _run(self, tabs, sessions, prefix, rng, options):
+        client = Client(get_asgi_application())
+        poll_path = reverse('get_unread_count')
+        stream_path = reverse('unread_count_stream')
+        duration = options['duration']
+        # Вкладки открываются равномерно в первые ramp секунд, уведомления создаются после этого
+        ramp = min(POLL_INTERVAL, duration / 2)
+        results = []
+        for name, runner in (
+            ('Polling every 30s + 60s (old)', self._legacy),
+            ('ETag polling every 30s', self._etag),
+            ('SSE stream', self._stream),
+        ):
+            changes = {}
+            scenario = Scenario(name, changes)
+            started = time.perf_counter()
+            writer = asyncio.create_task(self._write(
+                tabs, prefix, rng, changes, options['changes'], started + ramp, started + duration * 0.9
+            ))
+            await runner(client, poll_path, stream_path, tabs, sessions, scenario, rng, duration, started, ramp)
+            await writer
+            self.stdout.write(f'{name}: done in {time.perf_counter() - started:.1f}s')
+            results.append(scenario)
+        return results
+
+    async def _write(self, tabs, prefix, rng, changes, total, begin, end):
+        """Равномерно по ходу прогона создаёт уведомления читателям с открытыми вкладками."""
+        user_ids = sorted(set(tabs))
+        counts = dict.fromkeys(user_ids, 0)
+        unread = Notification.objects.filter(user_id__in=user_ids, is_read=False).values('user_id').annotate(
+            count=Count('id')
+        ).values_list('user_id', 'count').order_by()
+        async for user_id, count in unread:
+            counts[user_id] = count
+        step = (end - begin) / max(total, 1)
+        for index in range(total):
+            await asyncio.sleep(max(0.0, begin + step * index - time.perf_counter()))
+            user_id = rng.choice(user_ids)
+            await Notification.objects.acreate(user_id=user_id, title=prefix, message=prefix)
+            counts[user_id] += 1
+            changes.setdefault(user_id, []).append((time.perf_counter(), counts[user_id]))
+
+    async def _poll_tab(self, client, path, user_id, session_key, scenario, rng, duration, started,
+                        interval, use_etag):
+        etag = None
+        seen = 0
+        next_at = started + rng.uniform(0, interval)
+        while next_at < started + duration:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            next_at += interval
+            headers = [(b'if-none-match', etag.encode())] if use_etag and etag else []
+            request_started = time.perf_counter()
+            status, response_headers, body = await client.get(path, session_key, headers)
+            now = time.perf_counter()
+            scenario.requests += 1
+            scenario.latencies.append(now - request_started)
+            if status == 304:
+                scenario.not_modified += 1
+            else:
+                etag = response_headers.get('etag')
+                seen = scenario.observed(user_id, seen, json.loads(body)['unread_count'], now)
+
+    async def _legacy(self, client, poll_path, stream_path, tabs, sessions, scenario, rng, duration, started, ramp):
+        await asyncio.gather(*[
+            self._poll_tab(client, poll_path, user_id, sessions[user_id], scenario, rng, duration, started,
+                           interval, False)
+            for user_id in tabs
+            for interval in LEGACY_INTERVALS
+        ])
+
+    async def _etag(self, client, poll_path, stream_path, tabs, sessions, scenario, rng, duration, started, ramp):
+        await asyncio.gather(*[
+            self._poll_tab(client, poll_path, user_id, sessions[user_id], scenario, rng, duration, started,
+                           POLL_INTERVAL, True)
+            for user_id in tabs
+        ])
+
+    async def _stream(self, client, poll_path, stream_path, tabs, sessions, scenario, rng, duration, started, ramp):
+        disconnect = asyncio.Event()
+
+        async def tab(user_id):
+            await asyncio.sleep(rng.uniform(0, ramp))
+            if disconnect.is_set():
+                return
+            state = {'seen': 0, 'first': True, 'buffer': ''}
+            request_started = time.perf_counter()
+
+            def on_body(chunk):
+                now = time.perf_counter()
+                state['buffer'] += chunk.decode()
+                *events, state['buffer'] = state['buffer'].split('\n\n')
+                for event in events:
+                    for line in event.splitlines():
+                        if not line.startswith('data: '):
+                            continue
+                        count = json.loads(line[len('data: '):])['unread_count']
+                        if state['first']:
+                            # Время до первого события — аналог задержки ответа при опросе
+                            scenario.latencies.append(now - request_started)
+                            state['first'] = False
+                        state['seen'] = scenario.observed(user_id, state['seen'], count, now)
+
+            scenario.requests += 1
+            await client.get(stream_path, sessions[user_id], [(b'accept', b'text/event-stream')],
+                             on_body=on_body, disconnect=disconnect)
+
+        connections = [asyncio.create_task(tab(user_id)) for user_id in tabs]
+        await asyncio.sleep(max(0.0, duration - (time.perf_counter() - started)))
+        disconnect.set()
+        await asyncio.gather(*connections)
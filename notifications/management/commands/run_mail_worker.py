@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from notifications.outbox import BATCH_SIZE, THREADS, MailSender, process_batch, requeue_stale
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails from the outbox with a pool of reused mail server connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=THREADS)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--backend', help='Email backend to send with (default: EMAIL_BACKEND)')
+        parser.add_argument('--loop', type=int, metavar='SECONDS',
+                            help='Keep running and poll the outbox every SECONDS instead of exiting when it is empty')
+
+    def handle(self, *args, **options):
+        sender = MailSender(threads=options['threads'], backend=options['backend'])
+        try:
+            while True:
+                requeued = requeue_stale()
+                if requeued:
+                    self.stdout.write(f'Requeued {requeued} stalled emails')
+
+                totals = [0, 0, 0, 0]
+                started = time.perf_counter()
+                while True:
+                    batch = process_batch(sender, options['batch_size'])
+                    if not batch[0]:
+                        break
+                    totals = [total + value for total, value in zip(totals, batch)]
+                claimed, sent, retried, failed = totals
+                if retried or failed:
+                    self.stdout.write(self.style.WARNING(f'{retried} emails will be retried, {failed} failed permanently'))
+                self.stdout.write(self.style.SUCCESS(
+                    f'Successfully sent {sent} of {claimed} emails in {time.perf_counter() - started:.2f}s'
+                ))
+
+                if not options['loop']:
+                    break
+                time.sleep(options['loop'])
+        finally:
+            sender.close()
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_listing_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notification_type', models.CharField(choices=[('due_reminder', 'Due Date Reminder'), ('overdue_alert', 'Overdue Alert'), ('reservation_available', 'Reservation Available'), ('general', 'General')], max_length=50)),
+                ('related_content_type', models.CharField(max_length=100)),
+                ('related_object_id', models.PositiveBigIntegerField()),
+                ('period', models.CharField(max_length=50)),
+                ('claimed_by', models.CharField(db_index=True, max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_ledger', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'notification_type', 'related_content_type', 'related_object_id', 'period'), name='unique_notification_ledger_entry')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_email_outbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('due_reminder', 'Due Date Reminder'), ('overdue_alert', 'Overdue Alert'), ('reservation_available', 'Reservation Available'), ('loan_digest', 'Loan Summary'), ('general', 'General')], max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='notificationledger',
+            name='notification_type',
+            field=models.CharField(choices=[('due_reminder', 'Due Date Reminder'), ('overdue_alert', 'Overdue Alert'), ('reservation_available', 'Reservation Available'), ('loan_digest', 'Loan Summary'), ('general', 'General')], max_length=50),
+        ),
+    ]
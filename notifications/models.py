@@ -7,6 +7,7 @@ class Notification(models.Model):
         ('due_reminder', 'Due Date Reminder'),
         ('overdue_alert', 'Overdue Alert'),
         ('reservation_available', 'Reservation Available'),
+        ('loan_digest', 'Loan Summary'),
         ('general', 'General'),
     )
 
@@ -24,6 +25,9 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id']),
+        ]
 
 
 class NotificationPreference(models.Model):
@@ -34,4 +38,66 @@ class NotificationPreference(models.Model):
     email_general = models.BooleanField(default=True)
 
     def __str__(self):
-        return f"Notification preferences for {self.user.username}"
\ No newline at end of file
+        return f"Notification preferences for {self.user.username}"
+
+class NotificationLedger(models.Model):
+    """
+    Отметка об отправленном уведомлении (см. notifications.pipeline).
+    Уникальный индекс не даёт повторным запускам рассылки отправить то же
+    уведомление за тот же период дважды.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notification_ledger')
+    notification_type = models.CharField(max_length=50, choices=Notification.NOTIFICATION_TYPES)
+    related_content_type = models.CharField(max_length=100)
+    related_object_id = models.PositiveBigIntegerField()
+    # Например 'due:2026-10-19' или 'overdue:7' — ступень эскалации
+    period = models.CharField(max_length=50)
+    # Запуск рассылки, вставивший строку: по нему запуск узнаёт, какие уведомления его
+    claimed_by = models.CharField(max_length=32, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.user_id} {self.notification_type} {self.related_content_type}:{self.related_object_id} {self.period}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'notification_type', 'related_content_type', 'related_object_id', 'period'],
+                name='unique_notification_ledger_entry'
+            ),
+        ]
+
+
+class EmailOutbox(models.Model):
+    """
+    Письмо в очереди на отправку. Код, которому нужно отправить письмо,
+    только вставляет строку; отправляет команда run_mail_worker (см. notifications.outbox).
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipient = models.EmailField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    # Воркер, забравший письмо (на базах без SKIP LOCKED)
+    claimed_by = models.CharField(max_length=32, blank=True, db_index=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.recipient}: {self.subject} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
@@ -0,0 +1,178 @@
+"""
+Очередь исходящей почты.
+
+Код, которому нужно отправить письмо, вызывает enqueue_emails() — это
+одна вставка в EmailOutbox, обычно в той же транзакции, что и уведомление.
+Команда run_mail_worker забирает пачки писем (PostgreSQL — SELECT ... FOR
+UPDATE SKIP LOCKED, на базах без SKIP LOCKED — один UPDATE с меткой
+воркера) и отправляет их в пуле потоков; у каждого потока своё соединение
+с почтовым сервером, которое переиспользуется между пачками. Неудачная
+отправка повторяется с экспоненциальной задержкой, после MAX_ATTEMPTS
+письмо помечается failed. Письма, зависшие в sending (воркер упал),
+возвращаются в очередь через STALE_AFTER.
+"""
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import F, Subquery
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'MAIL_WORKER_BATCH_SIZE', 200)
+THREADS = getattr(settings, 'MAIL_WORKER_THREADS', 4)
+MAX_ATTEMPTS = getattr(settings, 'MAIL_MAX_ATTEMPTS', 6)
+RETRY_BASE = timedelta(seconds=getattr(settings, 'MAIL_RETRY_BASE_SECONDS', 60))
+RETRY_MAX = timedelta(hours=6)
+STALE_AFTER = timedelta(minutes=getattr(settings, 'MAIL_STALE_MINUTES', 10))
+
+
+def enqueue_emails(messages, now=None):
+    """Ставит в очередь письма (subject, body, from_email, [получатели]); возвращает число строк."""
+    now = now or timezone.now()
+    rows = [
+        EmailOutbox(subject=subject[:255], body=body, from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+                    recipient=recipient, next_attempt_at=now)
+        for subject, body, from_email, recipients in messages
+        for recipient in recipients
+        if recipient
+    ]
+    EmailOutbox.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    return len(rows)
+
+
+def retry_delay(attempts):
+    """Задержка перед попыткой номер attempts + 1: RETRY_BASE, 2x, 4x ... не больше RETRY_MAX."""
+    # Показатель ограничен: при большом MAIL_MAX_ATTEMPTS 2 ** n не помещается в timedelta
+    return min(RETRY_BASE * 2 ** min(max(attempts - 1, 0), 20), RETRY_MAX)
+
+
+def claim_batch(limit=BATCH_SIZE, now=None, emails=None):
+    """Переводит до limit готовых к отправке писем в sending; возвращает их. emails — ограничить выборку."""
+    now = now or timezone.now()
+    emails = EmailOutbox.objects.all() if emails is None else emails
+    due = emails.filter(status='pending', next_attempt_at__lte=now).order_by('next_attempt_at', 'id')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            EmailOutbox.objects.filter(pk__in=ids).update(status='sending', claimed_at=now)
+        return list(EmailOutbox.objects.filter(pk__in=ids).order_by('pk'))
+
+    # SQLite: один UPDATE атомарен, свои строки воркер находит по метке
+    token = uuid.uuid4().hex
+    EmailOutbox.objects.filter(pk__in=Subquery(due.values('pk')[:limit]), status='pending').update(
+        status='sending', claimed_at=now, claimed_by=token
+    )
+    return list(EmailOutbox.objects.filter(claimed_by=token, status='sending').order_by('pk'))
+
+
+def requeue_stale(now=None):
+    """Возвращает в очередь письма, которые дольше STALE_AFTER числятся в sending."""
+    now = now or timezone.now()
+    return EmailOutbox.objects.filter(status='sending', claimed_at__lt=now - STALE_AFTER).update(
+        status='pending', claimed_at=None, claimed_by=''
+    )
+
+
+class MailSender:
+    """Пул потоков, у каждого потока — своё переиспользуемое соединение с почтовым сервером."""
+
+    def __init__(self, threads=THREADS, backend=None):
+        self.threads = threads
+        self.backend = backend
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='mail')
+
+    def _connection(self):
+        mail_connection = getattr(self._local, 'connection', None)
+        if mail_connection is None:
+            mail_connection = get_connection(self.backend, fail_silently=False)
+            mail_connection.open()
+            self._local.connection = mail_connection
+            with self._lock:
+                self._connections.append(mail_connection)
+        return mail_connection
+
+    def _drop_connection(self):
+        mail_connection = self._local.__dict__.pop('connection', None)
+        if mail_connection is not None:
+            try:
+                mail_connection.close()
+            except Exception:
+                pass
+
+    def _send(self, emails):
+        # В потоке нет обращений к базе: только письма и результаты (id, ошибка или None)
+        results = []
+        for email in emails:
+            message = EmailMessage(email.subject, email.body, email.from_email, [email.recipient])
+            try:
+                self._connection().send_messages([message])
+                results.append((email.pk, None))
+            except Exception as error:
+                # После ошибки соединение может быть разорвано — следующее письмо откроет новое
+                self._drop_connection()
+                results.append((email.pk, f'{type(error).__name__}: {error}'))
+        return results
+
+    def send(self, emails):
+        """Отправляет письма параллельно; возвращает [(id, ошибка или None)]."""
+        slices = [emails[index::self.threads] for index in range(self.threads)]
+        results = []
+        for part in self._pool.map(self._send, [part for part in slices if part]):
+            results.extend(part)
+        return results
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        for mail_connection in self._connections:
+            try:
+                mail_connection.close()
+            except Exception:
+                pass
+
+
+def record_results(emails, results, now=None):
+    """Сохраняет итог отправки; возвращает (отправлено, отложено, отказ)."""
+    now = now or timezone.now()
+    attempts = {email.pk: email.attempts + 1 for email in emails}
+    sent_ids = [pk for pk, error in results if error is None]
+    EmailOutbox.objects.filter(pk__in=sent_ids).update(
+        status='sent', sent_at=now, attempts=F('attempts') + 1, last_error='', claimed_at=None, claimed_by=''
+    )
+
+    retried = failed = 0
+    for pk, error in results:
+        if error is None:
+            continue
+        logger.warning('Email %s failed (attempt %s): %s', pk, attempts[pk], error)
+        if attempts[pk] >= MAX_ATTEMPTS:
+            failed += 1
+            changes = {'status': 'failed'}
+        else:
+            retried += 1
+            changes = {'status': 'pending', 'next_attempt_at': now + retry_delay(attempts[pk])}
+        EmailOutbox.objects.filter(pk=pk).update(
+            attempts=attempts[pk], last_error=error, claimed_at=None, claimed_by='', **changes
+        )
+    return len(sent_ids), retried, failed
+
+
+def process_batch(sender, limit=BATCH_SIZE, emails=None):
+    """Забирает и отправляет одну пачку; возвращает (взято, отправлено, отложено, отказ)."""
+    emails = claim_batch(limit, emails=emails)
+    if not emails:
+        return 0, 0, 0, 0
+    results = sender.send(emails)
+    return (len(emails), *record_results(emails, results))
@@ -0,0 +1,224 @@
+"""
+Пакетная рассылка напоминаний о сроке и уведомлений о просрочке.
+
+Займы читаются одним запросом с JOIN на читателя и книгу, порциями по
+CHUNK_SIZE строк. Для каждой порции одним запросом загружаются настройки
+уведомлений её читателей, уведомления и письма (в очередь EmailOutbox,
+см. notifications.outbox) пишутся bulk_create в одной транзакции —
+SMTP-сервер рассылку не задерживает. Время каждого этапа (чтение,
+уведомления, почта) копится в PipelineStats.
+
+Повторные запуски идемпотентны: каждое уведомление сначала отмечается в
+NotificationLedger с периодом ('due:<срок>' или 'overdue:<ступень>').
+Займы с уже существующей отметкой отсекаются в запросе (NOT EXISTS), а
+параллельный запуск, проигравший вставку с ignore_conflicts по уникальному
+индексу, не отправляет ничего. Просрочка напоминается на ступенях
+ESCALATION_DAYS (1-й, 7-й, 14-й день); на каждую ступень читаются только
+займы, дошедшие до неё не раньше чем CATCH_UP назад, поэтому стоимость
+запуска зависит от новых событий, а не от всех накопленных просрочек.
+"""
+import time
+import uuid
+from datetime import datetime, timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from loans.models import Loan
+from loans.sweeper import sweep_overdue_loans
+from .live import schedule_unread_bump
+from .models import Notification, NotificationLedger, NotificationPreference
+from .outbox import enqueue_emails
+
+CHUNK_SIZE = 2000
+LOAN_FIELDS = ('id', 'user_id', 'user__first_name', 'user__email', 'book__title', 'due_date')
+ESCALATION_DAYS = tuple(getattr(settings, 'OVERDUE_ESCALATION_DAYS', (1, 7, 14)))
+# Насколько далеко назад последняя ступень ищет займы, пропущенные из-за простоя задачи
+CATCH_UP = timedelta(days=getattr(settings, 'NOTIFICATION_CATCH_UP_DAYS', 7))
+LEDGER_RETENTION = timedelta(days=getattr(settings, 'NOTIFICATION_LEDGER_RETENTION_DAYS', 90))
+
+
+class PipelineStats:
+    STAGES = ('read', 'notify', 'email')
+
+    def __init__(self):
+        self.loans = 0
+        self.notifications = 0
+        self.emails = 0
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+
+    def timed(self, stage, started):
+        self.seconds[stage] += time.perf_counter() - started
+
+    def add(self, other):
+        self.loans += other.loans
+        self.notifications += other.notifications
+        self.emails += other.emails
+        for stage in self.STAGES:
+            self.seconds[stage] += other.seconds[stage]
+        return self
+
+    def summary(self):
+        stages = ', '.join(f'{stage} {self.seconds[stage]:.2f}s' for stage in self.STAGES)
+        return f'{self.loans} loans, {self.notifications} notifications, {self.emails} emails queued ({stages})'
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def _email_preferences(user_ids, flag):
+    """Читатели порции, которым нужно письмо: настройка есть и флаг включён."""
+    return set(
+        NotificationPreference.objects.filter(user_id__in=user_ids, **{flag: True})
+        .values_list('user_id', flat=True)
+    )
+
+
+def _due_reminder(loan, now):
+    _, _, first_name, _, title, due_date = loan
+    return (
+        'Due Date Reminder',
+        f'Your book "{title}" is due tomorrow. Please return it on time.',
+        'Library Book Due Tomorrow',
+        f'Dear {first_name},\n\n'
+        f'This is a reminder that your book "{title}" '
+        f'is due tomorrow ({due_date.strftime("%B %d, %Y")}).\n\n'
+        f'Please return it to the library to avoid late fees.\n\n'
+        f'Best regards,\nLibrary Management System',
+    )
+
+
+def _overdue_alert(loan, now):
+    _, _, first_name, _, title, due_date = loan
+    days_overdue = (now - due_date).days
+    return (
+        'Overdue Book Alert',
+        f'Your book "{title}" is {days_overdue} days overdue.',
+        'Overdue Book Alert',
+        f'Dear {first_name},\n\nYour book "{title}" is {days_overdue} days overdue.\n\n'
+        f'Please return it as soon as possible to avoid additional fees.\n\n'
+        f'Best regards,\nLibrary Management System',
+    )
+
+
+def _not_yet_sent(loans, notification_type, period):
+    sent = NotificationLedger.objects.filter(
+        user=OuterRef('user'), notification_type=notification_type, related_content_type='loan',
+        related_object_id=OuterRef('pk'), period=period
+    )
+    return loans.filter(~Exists(sent))
+
+
+def _claim(chunk, notification_type, period):
+    """Отмечает займы порции в журнале; возвращает id займов, отметку которых вставил этот вызов."""
+    token = uuid.uuid4().hex
+    NotificationLedger.objects.bulk_create([
+        NotificationLedger(
+            user_id=loan[1], notification_type=notification_type, related_content_type='loan',
+            related_object_id=loan[0], period=period, claimed_by=token
+        )
+        for loan in chunk
+    ], batch_size=CHUNK_SIZE, ignore_conflicts=True)
+    return set(NotificationLedger.objects.filter(claimed_by=token).values_list('related_object_id', flat=True))
+
+
+def _run(loans, notification_type, period, preference_flag, build, now):
+    stats = PipelineStats()
+    loans = _not_yet_sent(loans, notification_type, period)
+    rows = loans.order_by('id').values_list(*LOAN_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+    started = time.perf_counter()
+    for chunk in _chunks(rows, CHUNK_SIZE):
+        wants_email = _email_preferences({loan[1] for loan in chunk}, preference_flag)
+        stats.timed('read', started)
+        stats.loans += len(chunk)
+
+        started = time.perf_counter()
+        notifications = []
+        emails = []
+        with transaction.atomic():
+            # Отметка, уведомление и письмо фиксируются вместе; параллельный запуск получит пустой claimed
+            claimed = _claim(chunk, notification_type, period)
+            for loan in chunk:
+                if loan[0] not in claimed:
+                    continue
+                title, message, subject, body = build(loan, now)
+                notifications.append(Notification(
+                    user_id=loan[1], title=title, message=message, notification_type=notification_type,
+                    related_object_id=loan[0], related_content_type='loan'
+                ))
+                if loan[1] in wants_email and loan[3]:
+                    emails.append((subject, body, settings.DEFAULT_FROM_EMAIL, [loan[3]]))
+            Notification.objects.bulk_create(notifications, batch_size=CHUNK_SIZE)
+            schedule_unread_bump(notification.user_id for notification in notifications)
+            stats.timed('notify', started)
+
+            started = time.perf_counter()
+            stats.emails += enqueue_emails(emails, now)
+        stats.notifications += len(notifications)
+        stats.timed('email', started)
+        started = time.perf_counter()
+    stats.timed('read', started)
+    return stats
+
+
+def _tomorrow_range(now):
+    tomorrow = timezone.localdate(now) + timedelta(days=1)
+    start = timezone.make_aware(datetime.combine(tomorrow, datetime.min.time()))
+    return start, start + timedelta(days=1)
+
+
+def due_reminder_filter(now):
+    """(период, Q) для займов со сроком завтра."""
+    start, end = _tomorrow_range(now)
+    return f'due:{start.date().isoformat()}', Q(due_date__gte=start, due_date__lt=end, returned_date__isnull=True)
+
+
+def send_due_reminders(now=None):
+    """Напоминания по займам со сроком завтра (одно на срок займа); возвращает PipelineStats."""
+    now = now or timezone.now()
+    period, condition = due_reminder_filter(now)
+    loans = Loan.objects.filter(condition)
+    return _run(loans, 'due_reminder', period, 'email_due_reminders', _due_reminder, now)
+
+
+def escalation_filters(now):
+    """[(ступень, Q)] — условия на просроченные займы, которые сейчас на этой ступени эскалации."""
+    filters = []
+    for position, days in enumerate(ESCALATION_DAYS):
+        # Ступень N — N-й день просрочки: прошло не меньше N - 1 полных суток после срока
+        latest_due = now - timedelta(days=days - 1)
+        if position + 1 < len(ESCALATION_DAYS):
+            earliest_due = now - timedelta(days=ESCALATION_DAYS[position + 1] - 1)
+        else:
+            earliest_due = latest_due - CATCH_UP
+        filters.append((days, Q(status='overdue', due_date__gt=earliest_due, due_date__lte=latest_due)))
+    return filters
+
+
+def escalation_stages(now, loans=None):
+    """(ступень, займы) — просроченные займы, которые сейчас на этой ступени эскалации."""
+    loans = Loan.objects.all() if loans is None else loans
+    return [(days, loans.filter(condition)) for days, condition in escalation_filters(now)]
+
+
+def send_overdue_alerts(now=None, loans=None):
+    """Уведомления о просрочке на ступенях ESCALATION_DAYS; loans — ограничить займами; возвращает PipelineStats."""
+    now = now or timezone.now()
+    sweep_overdue_loans(now, loans)
+    stats = PipelineStats()
+    for days, stage_loans in escalation_stages(now, loans):
+        stats.add(_run(stage_loans, 'overdue_alert', f'overdue:{days}', 'email_overdue_alerts', _overdue_alert, now))
+    return stats
+
+
+def prune_ledger(now=None):
+    """Удаляет отметки старше LEDGER_RETENTION: такие займы уже вышли из всех окон ступеней."""
+    now = now or timezone.now()
+    deleted, _ = NotificationLedger.objects.filter(created_at__lt=now - LEDGER_RETENTION).delete()
+    return deleted
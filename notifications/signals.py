@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+
+from .live import schedule_unread_bump
+from .models import Notification
+
+
+def notification_changed(sender, instance, **kwargs):
+    schedule_unread_bump([instance.user_id])
+
+
+post_save.connect(notification_changed, sender=Notification, dispatch_uid='unread_count_Notification_save')
+post_delete.connect(notification_changed, sender=Notification, dispatch_uid='unread_count_Notification_delete')
@@ -1,3 +1,524 @@
-from django.test import TestCase
+import asyncio
+import os
+import socketserver
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from books.models import Author, Book
+from loans.models import Loan
+from . import digests, pipeline
+from .digests import send_loan_digests
+from .live import STATE_KEY, UnreadBroadcaster, unread_state
+from .models import EmailOutbox, Notification, NotificationLedger, NotificationPreference
+from .outbox import (
+    MAX_ATTEMPTS, RETRY_BASE, RETRY_MAX, MailSender, claim_batch, enqueue_emails, process_batch, record_results,
+    retry_delay,
+)
+
+
+class UnreadCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('reader', password='secret')
+        self.client.force_login(self.user)
+
+    def notify(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(user=self.user, title='t', message='m', **fields)
+
+    def test_not_modified_until_notification_created(self):
+        response = self.client.get(reverse('get_unread_count'))
+        self.assertEqual(response.json(), {'unread_count': 0})
+        etag = response['ETag']
+        self.assertEqual(self.client.get(reverse('get_unread_count'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.notify()
+        response = self.client.get(reverse('get_unread_count'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'unread_count': 1})
+
+    def test_mark_all_read_changes_etag(self):
+        self.notify()
+        etag = self.client.get(reverse('get_unread_count'))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('mark_all_read'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        response = self.client.get(reverse('get_unread_count'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json(), {'unread_count': 0})
+
+    def test_write_from_another_process_is_seen_after_ttl(self):
+        etag = self.client.get(reverse('get_unread_count'))['ETag']
+        # Другой процесс: сигнал сбросил бы чужой кэш, а этот остался нетронутым
+        Notification.objects.bulk_create([Notification(user=self.user, title='t', message='m')])
+        self.assertEqual(self.client.get(reverse('get_unread_count'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        cache.delete(STATE_KEY.format(user_id=self.user.pk))  # истёк UNREAD_STATE_TTL
+        response = self.client.get(reverse('get_unread_count'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json(), {'unread_count': 1})
+
+    def test_version_changes_when_read_and_new_arrive_together(self):
+        first = self.notify()
+        version, count = unread_state(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.is_read = True
+            first.save()
+            Notification.objects.create(user=self.user, title='t', message='m')
+        new_version, new_count = unread_state(self.user.pk)
+        self.assertEqual((count, new_count), (1, 1))
+        self.assertNotEqual(version, new_version)
+
+    def test_stream_is_not_served_over_wsgi(self):
+        self.assertEqual(self.client.get(reverse('unread_count_stream')).status_code, 204)
+
+    async def test_broadcaster_pushes_changed_counts(self):
+        broadcaster = UnreadBroadcaster(interval=3600)
+        version, _ = await asyncio.to_thread(unread_state, self.user.pk)
+        queue = broadcaster.subscribe(self.user.pk, version)
+        try:
+            self.assertEqual(await broadcaster.check(), 0)
+            await Notification.objects.acreate(user=self.user, title='t', message='m')
+            await cache.adelete(STATE_KEY.format(user_id=self.user.pk))
+            self.assertEqual(await broadcaster.check(), 1)
+            self.assertEqual(queue.get_nowait()[1], 1)
+        finally:
+            broadcaster.unsubscribe(self.user.pk, queue)
+            broadcaster._task.cancel()
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Минимальный SMTP-сервер: считает соединения и принятые письма, получателю с 'fail' отвечает 451."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPStandInHandler)
+        self.connections = 0
+        self.recipients = []
+        self.lock = threading.Lock()
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        self.reply('220 stand-in ready')
+        recipients = []
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command.upper()
+            if verb.startswith(('EHLO', 'HELO')):
+                self.reply('250 stand-in')
+            elif verb.startswith('MAIL FROM'):
+                recipients = []
+                self.reply('250 OK')
+            elif verb.startswith('RCPT TO'):
+                if 'fail' in command:
+                    self.reply('451 temporary failure')
+                else:
+                    recipients.append(command[len('RCPT TO:'):].strip('<> '))
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with self.server.lock:
+                    self.server.recipients.extend(recipients)
+                self.reply('250 queued')
+            elif verb in ('RSET', 'NOOP'):
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 not implemented')
+
+
+def start_smtp_stand_in(test):
+    """Запускает SMTPStandIn на время теста и направляет на него EMAIL_HOST/EMAIL_PORT."""
+    server = SMTPStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    settings = override_settings(EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.server_address[1], EMAIL_USE_TLS=False,
+                                 EMAIL_USE_SSL=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='')
+    settings.enable()
+    test.addCleanup(settings.disable)
+    return server
+
+
+def queue_emails(count, prefix='reader', next_attempt_at=None, **fields):
+    now = timezone.now()
+    return EmailOutbox.objects.bulk_create([
+        EmailOutbox(subject='s', body='b', from_email='library@example.com', recipient=f'{prefix}{i}@example.com',
+                    next_attempt_at=next_attempt_at or now - timedelta(seconds=count - i), **fields)
+        for i in range(count)
+    ])
+
+
+class ClaimBatchTests(TestCase):
+    def assert_claims_in_order(self):
+        emails = queue_emails(5)
+        queue_emails(1, prefix='later', next_attempt_at=timezone.now() + timedelta(hours=1))
+        queue_emails(1, prefix='done', status='sent')
+
+        first = claim_batch(3)
+        self.assertEqual([email.pk for email in first], [email.pk for email in emails[:3]])
+        self.assertTrue(all(email.status == 'sending' for email in first))
+        second = claim_batch(3)
+        self.assertEqual([email.pk for email in second], [email.pk for email in emails[3:]])
+        self.assertEqual(claim_batch(3), [])
+
+    def test_claim_with_skip_locked(self):
+        with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', True):
+            self.assert_claims_in_order()
+
+    def test_claim_with_update_fallback(self):
+        with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', False):
+            self.assert_claims_in_order()
+        self.assertEqual(EmailOutbox.objects.filter(status='sending').exclude(claimed_by='').count(), 5)
+
+    def test_claim_is_limited_to_given_emails(self):
+        queue_emails(2, prefix='real')
+        mine = queue_emails(2, prefix='bench')
+        claimed = claim_batch(10, emails=EmailOutbox.objects.filter(recipient__startswith='bench'))
+        self.assertEqual({email.pk for email in claimed}, {email.pk for email in mine})
+        self.assertEqual(EmailOutbox.objects.filter(status='pending').count(), 2)
+
+
+class SkipLockedClaimTests(TransactionTestCase):
+    @skipUnlessDBFeature('has_select_for_update_skip_locked')
+    def test_locked_rows_are_skipped(self):
+        emails = queue_emails(4)
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_first_two():
+            with transaction.atomic():
+                list(EmailOutbox.objects.select_for_update().filter(pk__in=[emails[0].pk, emails[1].pk]))
+                locked.set()
+                release.wait(10)
+            connection.close()
+
+        holder = threading.Thread(target=hold_first_two)
+        holder.start()
+        try:
+            locked.wait(10)
+            claimed = claim_batch(10)
+        finally:
+            release.set()
+            holder.join()
+        self.assertEqual([email.pk for email in claimed], [email.pk for email in emails[2:]])
+
+
+class RetryTests(TestCase):
+    def test_backoff_doubles_up_to_limit(self):
+        self.assertEqual(retry_delay(1), RETRY_BASE)
+        self.assertEqual(retry_delay(2), RETRY_BASE * 2)
+        self.assertEqual(retry_delay(3), RETRY_BASE * 4)
+        self.assertEqual(retry_delay(100), RETRY_MAX)
+
+    def test_failure_is_retried_then_marked_failed(self):
+        queue_emails(1, attempts=MAX_ATTEMPTS - 2)
+        now = timezone.now()
+        emails = claim_batch(1, now=now)
+        with self.assertLogs('notifications.outbox', 'WARNING'):
+            results = record_results(emails, [(emails[0].pk, 'SMTPServerDisconnected: gone')], now)
+        self.assertEqual(results, (0, 1, 0))
+        email = EmailOutbox.objects.get()
+        self.assertEqual((email.status, email.attempts), ('pending', MAX_ATTEMPTS - 1))
+        self.assertEqual(email.next_attempt_at, now + retry_delay(MAX_ATTEMPTS - 1))
+        self.assertEqual(email.last_error, 'SMTPServerDisconnected: gone')
+
+        emails = claim_batch(1, now=email.next_attempt_at)
+        with self.assertLogs('notifications.outbox', 'WARNING'):
+            results = record_results(emails, [(emails[0].pk, 'still down')])
+        self.assertEqual(results, (0, 0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', MAX_ATTEMPTS))
+
+
+def send_all(sender, batch_size=10):
+    """Отправляет всю очередь; возвращает суммы по process_batch."""
+    totals = [0, 0, 0, 0]
+    try:
+        while (batch := process_batch(sender, batch_size))[0]:
+            totals = [total + value for total, value in zip(totals, batch)]
+    finally:
+        sender.close()
+    return totals
+
+
+class MailSenderTests(TestCase):
+    def test_locmem_backend(self):
+        queue_emails(25)
+        self.assertEqual(send_all(MailSender(threads=3)), [25, 25, 0, 0])
+        self.assertEqual(len(mail.outbox), 25)
+        self.assertFalse(EmailOutbox.objects.exclude(status='sent').exists())
+
+    def test_file_backend(self):
+        queue_emails(5)
+        with tempfile.TemporaryDirectory() as directory, override_settings(EMAIL_FILE_PATH=directory):
+            sender = MailSender(threads=1, backend='django.core.mail.backends.filebased.EmailBackend')
+            self.assertEqual(send_all(sender), [5, 5, 0, 0])
+            with open(os.path.join(directory, os.listdir(directory)[0])) as sent:
+                self.assertEqual(sent.read().count('Subject: s'), 5)
+
+    def test_smtp_connections_are_reused_across_batches(self):
+        server = start_smtp_stand_in(self)
+        queue_emails(30)
+        sender = MailSender(threads=2, backend='django.core.mail.backends.smtp.EmailBackend')
+        self.assertEqual(send_all(sender, batch_size=10), [30, 30, 0, 0])
+        self.assertEqual(len(server.recipients), 30)
+        self.assertLessEqual(server.connections, 2)
+
+    def test_smtp_temporary_failure_is_retried(self):
+        server = start_smtp_stand_in(self)
+        queue_emails(2)
+        queue_emails(1, prefix='fail')
+        sender = MailSender(threads=1, backend='django.core.mail.backends.smtp.EmailBackend')
+        with self.assertLogs('notifications.outbox', 'WARNING'):
+            totals = send_all(sender)
+        self.assertEqual(totals, [3, 2, 1, 0])
+        failed = EmailOutbox.objects.get(recipient__startswith='fail')
+        self.assertEqual((failed.status, failed.attempts), ('pending', 1))
+        self.assertIn('SMTPRecipientsRefused', failed.last_error)
+        self.assertEqual(len(server.recipients), 2)
+
+
+class PipelineTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        self.book = Book.objects.create(title='War and Peace', author=author, isbn='9780000000001',
+                                        publication_year=1869, publisher='Russky Vestnik')
+
+    def due_tomorrow(self, count, prefix='reader', email=True, wants_email=True):
+        """Читатели со сроком займа завтра; wants_email=None — без строки настроек."""
+        loans = []
+        for i in range(count):
+            user = User.objects.create_user(f'{prefix}-{i}', email=f'{prefix}-{i}@example.com' if email else '')
+            if wants_email is not None:
+                NotificationPreference.objects.create(user=user, email_due_reminders=wants_email)
+            loans.append(Loan.objects.create(user=user, book=self.book, due_date=self.now + timedelta(days=1)))
+        return loans
+
+    def send(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return pipeline.send_due_reminders(self.now)
+
+    def test_emails_follow_preferences(self):
+        self.due_tomorrow(2, 'wants')
+        self.due_tomorrow(1, 'declined', wants_email=False)
+        self.due_tomorrow(1, 'default', wants_email=None)
+        self.due_tomorrow(1, 'no-address', email=False)
+
+        stats = self.send()
+        self.assertEqual((stats.loans, stats.notifications, stats.emails), (5, 5, 2))
+        self.assertEqual(
+            sorted(EmailOutbox.objects.values_list('recipient', flat=True)),
+            ['wants-0@example.com', 'wants-1@example.com'],
+        )
+
+    def test_chunks_cover_every_loan_once(self):
+        loans = self.due_tomorrow(5)
+        with mock.patch.object(pipeline, 'CHUNK_SIZE', 2), \
+                mock.patch.object(Notification.objects, 'bulk_create', wraps=Notification.objects.bulk_create) as bulk:
+            stats = self.send()
+            # Повторный запуск отсекается журналом
+            self.assertEqual(self.send().loans, 0)
+        self.assertEqual(bulk.call_count, 3)
+        self.assertEqual(stats.notifications, 5)
+        self.assertEqual(
+            sorted(Notification.objects.values_list('related_object_id', flat=True)), sorted(loan.pk for loan in loans)
+        )
+
+    def test_queries_do_not_grow_with_loans(self):
+        self.due_tomorrow(2, 'few')
+        with CaptureQueriesContext(connection) as few:
+            self.send()
+        # Займы первого запуска уже в журнале — второй обрабатывает только новые 40
+        self.due_tomorrow(40, 'many')
+        with self.assertNumQueries(len(few)):
+            self.assertEqual(self.send().notifications, 40)
+
+    def test_queued_emails_share_one_smtp_connection(self):
+        server = start_smtp_stand_in(self)
+        self.due_tomorrow(6)
+        self.send()
+        sender = MailSender(threads=1, backend='django.core.mail.backends.smtp.EmailBackend')
+        self.assertEqual(send_all(sender, batch_size=2), [6, 6, 0, 0])
+        self.assertEqual(len(server.recipients), 6)
+        self.assertEqual(server.connections, 1)
+
+
+class BenchmarkGuardTests(TestCase):
+    def test_benchmarks_refuse_without_debug(self):
+        with self.assertRaisesMessage(CommandError, 'DEBUG=True'):
+            call_command('benchmark_notifications', loans=1)
+        self.assertFalse(User.objects.exists())
+
+
+class IdempotencyTests(TestCase):
+    """Повторный и прерванный запуски: на (читатель, заём, вид) ровно одно уведомление и одно письмо."""
+
+    def setUp(self):
+        self.now = timezone.now()
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        self.book = Book.objects.create(title='War and Peace', author=author, isbn='9780000000001',
+                                        publication_year=1869, publisher='Russky Vestnik', total_copies=20,
+                                        available_copies=20)
+        self.loans = []
+        for i in range(3):
+            self.loans.append(self.loan(f'due-{i}', self.now + timedelta(days=1)))
+            self.loans.append(self.loan(f'late-{i}', self.now - timedelta(days=2)))
+
+    def loan(self, username, due_date):
+        user = User.objects.create_user(username, email=f'{username}@example.com')
+        NotificationPreference.objects.create(user=user)
+        return Loan.objects.create(user=user, book=self.book, due_date=due_date)
+
+    def send(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            pipeline.send_due_reminders(self.now)
+            pipeline.send_overdue_alerts(self.now)
+
+    def assert_sent_once(self):
+        subjects = {'due_reminder': 'Library Book Due Tomorrow', 'overdue_alert': 'Overdue Book Alert'}
+        expected = [
+            (loan, 'due_reminder' if loan.user.username.startswith('due') else 'overdue_alert') for loan in self.loans
+        ]
+        self.assertEqual(
+            sorted(Notification.objects.values_list('user_id', 'related_object_id', 'notification_type')),
+            sorted((loan.user_id, loan.pk, kind) for loan, kind in expected),
+        )
+        self.assertEqual(
+            sorted(EmailOutbox.objects.values_list('recipient', 'subject')),
+            sorted((loan.user.email, subjects[kind]) for loan, kind in expected),
+        )
+
+    def test_second_run_sends_nothing(self):
+        self.send()
+        self.send()
+        self.assert_sent_once()
+
+    def test_rerun_after_failed_chunk_sends_the_rest_once(self):
+        calls = []
+
+        def fail_second_chunk(messages, now=None):
+            calls.append(messages)
+            if len(calls) == 2:
+                raise RuntimeError('mail queue unavailable')
+            return enqueue_emails(messages, now)
+
+        with mock.patch.object(pipeline, 'CHUNK_SIZE', 2), \
+                mock.patch.object(pipeline, 'enqueue_emails', side_effect=fail_second_chunk):
+            with self.assertRaises(RuntimeError):
+                self.send()
+            # Упавшая порция откатилась целиком вместе с отметками в журнале
+            self.assertEqual(Notification.objects.count(), 2)
+            self.assertEqual(NotificationLedger.objects.count(), 2)
+            self.send()
+        self.assert_sent_once()
+
+    def test_run_that_lost_the_claim_sends_nothing(self):
+        self.send()
+        # Параллельный запуск прочитал займы до того, как первый записал отметки
+        with mock.patch.object(pipeline, '_not_yet_sent', side_effect=lambda loans, *args: loans):
+            self.send()
+        self.assert_sent_once()
+
+
+class DigestTests(TestCase):
+    """Сводки: одно уведомление и одно письмо на читателя, повторный запуск не шлёт отмеченное в журнале."""
+
+    def setUp(self):
+        self.now = timezone.now()
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        self.books = [
+            Book.objects.create(title=title, author=author, isbn=f'978000000000{i}', publication_year=1869,
+                                publisher='Russky Vestnik', total_copies=5, available_copies=5)
+            for i, title in enumerate(('War and Peace', 'Anna Karenina', 'Resurrection'))
+        ]
+        self.anna = self.reader('anna')
+        self.boris = self.reader('boris', email_due_reminders=False)
+        self.loan(self.anna, 0, days=1)
+        self.loan(self.anna, 1, days=1)
+        self.loan(self.anna, 2, days=-2)
+        self.loan(self.boris, 0, days=1)
+        self.loan(self.boris, 1, days=-2)
+        # Срок не подошёл — в сводку не попадает
+        self.loan(self.boris, 2, days=5)
+
+    def reader(self, username, **preferences):
+        user = User.objects.create_user(username, email=f'{username}@example.com', first_name=username.title())
+        NotificationPreference.objects.create(user=user, **preferences)
+        return user
+
+    def loan(self, user, book, days):
+        return Loan.objects.create(user=user, book=self.books[book], due_date=self.now + timedelta(days=days))
+
+    def send(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return send_loan_digests(self.now)
+
+    def test_one_summary_per_reader(self):
+        # Порция меньше числа займов читателя не разрывает его сводку
+        with mock.patch.object(digests, 'CHUNK_SIZE', 1):
+            stats = self.send()
+        self.assertEqual((stats.loans, stats.notifications, stats.emails), (5, 2, 2))
+        anna = Notification.objects.get(user=self.anna)
+        self.assertEqual(anna.notification_type, 'loan_digest')
+        self.assertEqual(anna.message, 'Overdue (1): "Resurrection" (2 days).\n'
+                                       'Due tomorrow (2): "War and Peace", "Anna Karenina".')
+
+        emails = dict(EmailOutbox.objects.values_list('recipient', 'subject'))
+        self.assertEqual(emails, {
+            'anna@example.com': 'Your library loans: 1 overdue, 2 due tomorrow',
+            # Boris отказался от писем о сроке — в письме только просрочка
+            'boris@example.com': 'Your library loans: 1 overdue',
+        })
+        due_period, _ = pipeline.due_reminder_filter(self.now)
+        self.assertCountEqual(
+            NotificationLedger.objects.values_list('user__username', 'notification_type', 'period'), [
+                ('anna', 'due_reminder', due_period), ('anna', 'due_reminder', due_period),
+                ('anna', 'overdue_alert', 'overdue:1'),
+                ('boris', 'due_reminder', due_period), ('boris', 'overdue_alert', 'overdue:1'),
+            ]
+        )
+
+    def test_second_run_sends_only_new_loans(self):
+        self.send()
+        stats = self.send()
+        self.assertEqual((stats.loans, stats.notifications, stats.emails), (0, 0, 0))
+        self.assertEqual((Notification.objects.count(), EmailOutbox.objects.count()), (2, 2))
+
+        # Новый заём со сроком завтра — новая сводка только о нём
+        book = Book.objects.create(title='Childhood', author=self.books[0].author, isbn='9780000000009',
+                                   publication_year=1852, publisher='Sovremennik')
+        Loan.objects.create(user=self.anna, book=book, due_date=self.now + timedelta(days=1))
+        stats = self.send()
+        self.assertEqual((stats.loans, stats.notifications), (1, 1))
+        latest = Notification.objects.filter(user=self.anna).latest('id')
+        self.assertEqual(latest.message, 'Due tomorrow (1): "Childhood".')
+
+    def test_loans_sent_by_per_loan_pipeline_are_skipped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            pipeline.send_due_reminders(self.now)
+        stats = self.send()
+        self.assertEqual((stats.loans, stats.notifications), (2, 2))
+        self.assertFalse(Notification.objects.filter(notification_type='loan_digest', message__contains='tomorrow'))
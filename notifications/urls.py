@@ -7,4 +7,5 @@ urlpatterns = [
     path('<int:notification_id>/mark-read/', views.mark_notification_read, name='mark_notification_read'),
     path('mark-all-read/', views.mark_all_read, name='mark_all_read'),
     path('api/unread-count/', views.get_unread_count, name='get_unread_count'),
+    path('api/unread-count/stream/', views.unread_count_stream, name='unread_count_stream'),
 ]
\ No newline at end of file
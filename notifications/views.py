@@ -1,7 +1,19 @@
+import asyncio
+import json
+
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db.models import Count, Q
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from library_management.pagination import CursorPaginator
+from .live import (
+    STREAM_HEARTBEAT_SECONDS, STREAM_MAX_SECONDS, STREAM_RETRY_MS, aunread_state, broadcaster,
+    schedule_unread_bump, unread_state,
+)
 from .models import Notification, NotificationPreference
 
 
@@ -65,18 +77,28 @@ def get_unread_count(request):
 
 @login_required
 def notification_list(request):
-    notifications = Notification.objects.filter(user=request.user).order_by('-created_at')
-    unread_count = notifications.filter(is_read=False).count()
+    notifications = Notification.objects.filter(user=request.user)
 
     # Support for partial rendering in dropdown
     if request.GET.get('partial'):
         return render(request, 'notifications/notification_dropdown.html', {
-            'notifications': notifications[:5]  # Only show 5 in dropdown
+            'notifications': notifications.order_by('-created_at', '-id')[:5]  # Only show 5 in dropdown
         })
 
+    counts = notifications.aggregate(
+        total=Count('id'),
+        unread=Count('id', filter=Q(is_read=False)),
+    )
+
+    paginator = CursorPaginator(notifications, 20, ('-created_at', '-id'), count=counts['total'])
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+
     return render(request, 'notifications/notification_list.html', {
-        'notifications': notifications,
-        'unread_count': unread_count
+        'notifications': page_obj,
+        'page_obj': page_obj,
+        'total_count': counts['total'],
+        'unread_count': counts['unread'],
+        'read_count': counts['total'] - counts['unread']
     })
 @login_required
 def mark_notification_read(request, notification_id):
@@ -94,6 +116,7 @@ def mark_notification_read(request, notification_id):
 @login_required
 def mark_all_read(request):
     Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
+    schedule_unread_bump([request.user.pk])
 
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return JsonResponse({'success': True})
@@ -118,11 +141,60 @@ def notification_preferences(request):
     return render(request, 'notifications/preferences.html', {'preference': preference})
 
 
+def _unread_etag(request):
+    if request.user.is_authenticated:
+        return unread_state(request.user.pk)[0]
+    return None
+
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_unread_etag)
 def get_unread_count(request):
-    if request.user.is_authenticated:
-        count = Notification.objects.filter(user=request.user, is_read=False).count()
-        return JsonResponse({'unread_count': count})
-    return JsonResponse({'unread_count': 0})
+    # Запасной опрос: браузер присылает If-None-Match, при неизменной версии ответ 304
+    _, count = unread_state(request.user.pk)
+    return JsonResponse({'unread_count': count})
+
+
+def _unread_event(version, count):
+    return f'id: {version}\nevent: unread\ndata: {json.dumps({"unread_count": count})}\n\n'
+
+
+async def _unread_events(user_id, last_event_id):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_MAX_SECONDS
+    version, count = await aunread_state(user_id)
+    queue = broadcaster.subscribe(user_id, version)
+    try:
+        yield f'retry: {STREAM_RETRY_MS}\n\n'
+        if version != last_event_id:
+            yield _unread_event(version, count)
+        while loop.time() < deadline:
+            try:
+                version, count = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Комментарий не даёт прокси закрыть простаивающее соединение
+                yield ': ping\n\n'
+                continue
+            yield _unread_event(version, count)
+    finally:
+        broadcaster.unsubscribe(user_id, queue)
+
+
+async def unread_count_stream(request):
+    """Server-Sent Events со счётчиком непрочитанных; только под ASGI (library_management.asgi)."""
+    if not isinstance(request, ASGIRequest):
+        # Под WSGI поток занял бы рабочий процесс целиком; 204 — EventSource больше не переподключается
+        return HttpResponse(status=204)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+
+    response = StreamingHttpResponse(
+        _unread_events(user.pk, request.headers.get('Last-Event-ID')), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
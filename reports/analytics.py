@@ -0,0 +1,159 @@
+"""
+Аналитика активности читателей для user_activity_report.
+
+Из займов за период берётся только узкая проекция (user_id, borrowed_date,
+due_date, returned_date) — из последнего опубликованного колоночного снимка
+займов (reports.snapshot). Запрос снимок не строит и не обновляет: это дело
+команды refresh_loan_snapshot, поэтому отчёт отстаёт от базы на интервал её
+запуска, а время сборки снимка показывается на странице. Пока снимка нет,
+проекция за период читается из базы. Дальше всё считается векторно: признаки займа (активен,
+просрочен, возвращён вовремя, длительность) и groupby по читателю в pandas,
+затем когорты по типу читателя и месяцу регистрации. Результат — обычные
+словари и списки, он кладётся в кэш на CACHE_TIMEOUT секунд.
+"""
+from datetime import timezone as dt_timezone
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from accounts.models import User
+from .snapshot import LoanSnapshot, loan_snapshot
+
+TOP_USERS = 50
+CACHE_TIMEOUT = getattr(settings, 'USER_ACTIVITY_CACHE_SECONDS', 600)
+CACHE_KEY = 'reports:user_activity:{}'
+DAY = np.timedelta64(86400, 's')
+
+
+def load_loans(start):
+    """(проекция займов с borrowed_date >= start, время сборки её источника)."""
+    snapshot = loan_snapshot.get(refresh=False)
+    if snapshot is None:
+        snapshot = LoanSnapshot.build(since=start)
+    return snapshot.loans_since(start), snapshot.built_on
+
+
+def summarize_loans(loans, now):
+    """Итоги по читателям: DataFrame с индексом user_id."""
+    now = np.datetime64(timezone.make_naive(now, dt_timezone.utc), 'us')
+    borrowed, due, returned = loans['borrowed_date'], loans['due_date'], loans['returned_date']
+    is_open = np.isnat(returned)
+    is_returned = ~is_open
+    duration = np.where(is_returned, (returned - borrowed) / DAY, 0.0)
+
+    frame = pd.DataFrame({
+        'user_id': loans['user_id'],
+        'active_loans': is_open,
+        'overdue_loans': is_open & (due < now),
+        'returned_loans': is_returned,
+        'on_time': is_returned & (returned <= due),
+        'duration_days': duration,
+    })
+    per_user = frame.groupby('user_id', sort=False).agg(
+        loan_count=('active_loans', 'size'),
+        active_loans=('active_loans', 'sum'),
+        overdue_loans=('overdue_loans', 'sum'),
+        returned_loans=('returned_loans', 'sum'),
+        on_time=('on_time', 'sum'),
+        duration_days=('duration_days', 'sum'),
+    )
+    return per_user
+
+
+def _with_rates(frame):
+    returned = frame['returned_loans'].where(frame['returned_loans'] > 0)
+    frame['avg_duration_days'] = (frame['duration_days'] / returned).round(1)
+    frame['on_time_rate'] = (frame['on_time'] * 100 / returned).round(1)
+    return frame
+
+
+def _records(frame):
+    # NaN (нет возвратов) -> None, numpy-типы -> обычные числа Python
+    frame = frame.astype(object).where(frame.notna(), None)
+    return [
+        {key: value.item() if isinstance(value, np.generic) else value for key, value in row.items()}
+        for row in frame.to_dict('records')
+    ]
+
+
+def cohort_breakdown(per_user, users, column):
+    """Итоги по когортам читателей; column — 'user_type' или 'signup_month'."""
+    joined = per_user.join(users[[column]], how='inner')
+    cohorts = joined.groupby(column).agg(
+        readers=('loan_count', 'size'),
+        loan_count=('loan_count', 'sum'),
+        active_loans=('active_loans', 'sum'),
+        overdue_loans=('overdue_loans', 'sum'),
+        returned_loans=('returned_loans', 'sum'),
+        on_time=('on_time', 'sum'),
+        duration_days=('duration_days', 'sum'),
+    )
+    cohorts = _with_rates(cohorts)
+    cohorts['loans_per_reader'] = (cohorts['loan_count'] / cohorts['readers']).round(1)
+    cohorts = cohorts.reset_index().rename(columns={column: 'cohort'})
+    return _records(cohorts.drop(columns=['on_time', 'duration_days']))
+
+
+def _load_users():
+    # Читателей на порядки меньше, чем займов: узкая проекция всех сразу
+    rows = User.objects.values_list('id', 'user_type', 'date_joined')
+    users = pd.DataFrame.from_records(list(rows), columns=['id', 'user_type', 'date_joined'], index='id')
+    joined = pd.to_datetime(users['date_joined'], utc=True)
+    users['signup_month'] = joined.dt.strftime('%Y-%m')
+    return users
+
+
+def _top_users(per_user):
+    top = per_user.sort_values(['loan_count', 'user_id'], ascending=[False, True]).head(TOP_USERS)
+    details = User.objects.in_bulk(top.index.tolist())
+    rows = []
+    for row in _records(top.drop(columns=['on_time', 'duration_days']).reset_index()):
+        user = details.get(row['user_id'])
+        if user is None:
+            continue
+        row.update(
+            username=user.username, first_name=user.first_name, last_name=user.last_name,
+            user_type=user.user_type, user_type_display=user.get_user_type_display()
+        )
+        rows.append(row)
+    return rows
+
+
+def compute_user_activity(start, now=None):
+    """Считает отчёт по займам с borrowed_date >= start."""
+    now = now or timezone.now()
+    loans, data_as_of = load_loans(start)
+    per_user = _with_rates(summarize_loans(loans, now))
+    report = {
+        'generated_at': now,
+        'data_as_of': data_as_of,
+        'loans': len(loans['user_id']),
+        'readers': len(per_user),
+        'top_users': [],
+        'by_user_type': [],
+        'by_signup_month': [],
+    }
+    if not len(per_user):
+        return report
+
+    users = _load_users()
+    labels = dict(User.USER_TYPES)
+    report['top_users'] = _top_users(per_user)
+    report['by_user_type'] = cohort_breakdown(per_user, users, 'user_type')
+    for row in report['by_user_type']:
+        row['label'] = labels.get(row['cohort'], row['cohort'])
+    report['by_signup_month'] = cohort_breakdown(per_user, users, 'signup_month')
+    return report
+
+
+def get_user_activity(period, start):
+    """Отчёт за период из кэша; пересчитывается раз в CACHE_TIMEOUT секунд."""
+    key = CACHE_KEY.format(period)
+    report = cache.get(key)
+    if report is None:
+        report = compute_user_activity(start)
+        cache.set(key, report, CACHE_TIMEOUT)
+    return report
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 class ReportsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reports'
-    verbose_name = 'Reporting & Analytics'
\ No newline at end of file
+    verbose_name = 'Reporting & Analytics'
+
+    def ready(self):
+        from . import signals  # noqa: F401
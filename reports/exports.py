@@ -0,0 +1,338 @@
+"""
+Выгрузки отчётов с постоянным расходом памяти.
+
+Строки читаются из базы через values_list().iterator() и сразу пишутся
+в книгу openpyxl в режиме write-only, которая держит лист во временном файле,
+а не в памяти. Ширина колонок считается по первым WIDTH_SAMPLE_ROWS строкам —
+в write-only режиме её нужно задать до записи строк. Готовый файл собирается
+в SpooledTemporaryFile и отдаётся FileResponse частями.
+
+CSV и JSON Lines не требуют сборки файла: строки идут из серверного курсора
+прямо в StreamingHttpResponse, при необходимости через потоковый gzip.
+"""
+import csv
+import datetime
+import io
+import json
+import tempfile
+import zlib
+from decimal import Decimal
+from itertools import chain, islice
+
+from django.db.models import Q
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+from accounts.models import User
+from books.models import Book
+from loans.archive import needs_archive
+from loans.models import ArchivedLoan, Loan, Reservation
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CHUNK_SIZE = 2000
+WIDTH_SAMPLE_ROWS = 1000
+MAX_COLUMN_WIDTH = 50
+SPOOL_MAX_SIZE = 8 * 1024 * 1024  # больше — на диск
+
+
+def _format_date(value):
+    return value.strftime('%Y-%m-%d %H:%M') if value else ''
+
+
+def _yes_no(value):
+    return 'Yes' if value else 'No'
+
+
+def column_widths(headers, rows):
+    widths = [len(str(header)) for header in headers]
+    for row in rows:
+        for index, value in enumerate(row):
+            if value is not None:
+                widths[index] = max(widths[index], len(str(value)))
+    return [min(width + 2, MAX_COLUMN_WIDTH) for width in widths]
+
+
+def write_xlsx(stream, sheet_title, headers, rows, sample_size=WIDTH_SAMPLE_ROWS):
+    """Пишет заголовок и строки (любой итератор списков) в stream; возвращает количество строк."""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_title)
+
+    rows = iter(rows)
+    sample = list(islice(rows, sample_size))
+    for index, width in enumerate(column_widths(headers, sample), start=1):
+        sheet.column_dimensions[get_column_letter(index)].width = width
+
+    sheet.append(list(headers))
+    count = 0
+    for row in chain(sample, rows):
+        sheet.append(row)
+        count += 1
+    workbook.save(stream)
+    return count
+
+
+def xlsx_response(filename, sheet_title, headers, rows):
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    write_xlsx(spool, sheet_title, headers, rows)
+    spool.seek(0)
+    return FileResponse(spool, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
+
+
+BOOK_HEADERS = (
+    'title', 'Author First Name', 'Author Last Name', 'isbn', 'Genre',
+    'Publication Year', 'publisher', 'Total Copies', 'Available Copies',
+)
+
+
+def book_rows():
+    return Book.objects.order_by('pk').values_list(
+        'title', 'author__first_name', 'author__last_name', 'isbn',
+        'genre__name', 'publication_year', 'publisher',
+        'total_copies', 'available_copies'
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+LOAN_HEADERS = (
+    'Username', 'User First Name', 'User Last Name', 'Book Title', 'ISBN', 'Borrowed Date',
+    'Due Date', 'Returned Date', 'Status', 'Renewals', 'Is Overdue',
+)
+
+
+def loan_rows(now=None):
+    now = now or timezone.now()
+    statuses = dict(Loan.STATUS_CHOICES)
+    querysets = [Loan.objects.all()]
+    if needs_archive():
+        querysets.append(ArchivedLoan.objects.all())
+
+    for queryset in querysets:
+        rows = queryset.order_by('pk').values_list(
+            'user__username', 'user__first_name', 'user__last_name', 'book__title', 'book__isbn',
+            'borrowed_date', 'due_date', 'returned_date', 'status', 'renewals'
+        ).iterator(chunk_size=CHUNK_SIZE)
+        for username, first_name, last_name, title, isbn, borrowed, due, returned, status, renewals in rows:
+            yield [
+                username, first_name or '', last_name or '', title, isbn,
+                _format_date(borrowed), _format_date(due), _format_date(returned),
+                statuses.get(status, status), renewals,
+                _yes_no(returned is None and due is not None and due < now),
+            ]
+
+
+USER_HEADERS = (
+    'Username', 'First Name', 'Last Name', 'Email', 'User Type', 'Membership ID', 'Is Active', 'Date Joined',
+)
+
+
+def user_rows():
+    user_types = dict(User.USER_TYPES)
+    rows = User.objects.order_by('pk').values_list(
+        'username', 'first_name', 'last_name', 'email', 'user_type', 'membership_id', 'is_active', 'date_joined'
+    ).iterator(chunk_size=CHUNK_SIZE)
+    for username, first_name, last_name, email, user_type, membership_id, is_active, date_joined in rows:
+        yield [
+            username, first_name or '', last_name or '', email or '',
+            user_types.get(user_type, user_type), membership_id or '',
+            _yes_no(is_active), _format_date(date_joined),
+        ]
+
+
+RESERVATION_HEADERS = (
+    'Username', 'Book Title', 'ISBN', 'Reserved Date', 'Expiry Date', 'Status', 'Priority', 'Notified',
+)
+
+
+def reservation_rows():
+    statuses = dict(Reservation.STATUS_CHOICES)
+    rows = Reservation.objects.order_by('pk').values_list(
+        'user__username', 'book__title', 'book__isbn', 'reserved_date', 'expiry_date',
+        'status', 'priority', 'notified'
+    ).iterator(chunk_size=CHUNK_SIZE)
+    for username, title, isbn, reserved, expiry, status, priority, notified in rows:
+        yield [
+            username, title, isbn, _format_date(reserved), _format_date(expiry),
+            statuses.get(status, status), priority, _yes_no(notified),
+        ]
+
+
+# Excel-выгрузка датасета: (заголовки, функция строк, название листа)
+XLSX_DATASETS = {
+    'books': (BOOK_HEADERS, book_rows, 'Books'),
+    'loans': (LOAN_HEADERS, loan_rows, 'Loans'),
+    'users': (USER_HEADERS, user_rows, 'Users'),
+    'reservations': (RESERVATION_HEADERS, reservation_rows, 'Reservations'),
+}
+
+
+# Машиночитаемые выгрузки (CSV и JSON Lines) для загрузки в хранилище данных:
+# исходные значения полей вместо отформатированных для Excel.
+
+DATASET_FIELDS = {
+    'books': (
+        'id', 'title', 'isbn', 'author_id', 'author__first_name', 'author__last_name', 'genre_id',
+        'genre__name', 'publication_year', 'publisher', 'total_copies', 'available_copies',
+        'created_at', 'updated_at',
+    ),
+    'loans': (
+        'id', 'user_id', 'user__username', 'book_id', 'book__isbn', 'borrowed_date', 'due_date',
+        'returned_date', 'status', 'renewals', 'max_renewals',
+    ),
+    'users': (
+        'id', 'username', 'first_name', 'last_name', 'email', 'user_type', 'membership_id',
+        'is_active', 'date_joined', 'updated_at',
+    ),
+    'reservations': (
+        'id', 'user_id', 'user__username', 'book_id', 'book__isbn', 'reserved_date', 'expiry_date',
+        'status', 'priority', 'notified',
+    ),
+}
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+FLUSH_ROWS = 500
+
+
+def dataset_columns(name):
+    return [field.replace('__', '_') for field in DATASET_FIELDS[name]]
+
+
+def _dataset_querysets(name, updated_since):
+    """
+    Наборы строк датасета с фильтром по изменениям. updated_at есть только
+    у книг и пользователей и не меняется при массовых UPDATE (например, числа
+    свободных экземпляров); займы отбираются по дате выдачи или возврата,
+    брони — по дате создания.
+    """
+    if name == 'books':
+        queryset = Book.objects.all()
+        return [queryset.filter(updated_at__gte=updated_since) if updated_since else queryset]
+    if name == 'users':
+        queryset = User.objects.all()
+        return [queryset.filter(updated_at__gte=updated_since) if updated_since else queryset]
+    if name == 'reservations':
+        queryset = Reservation.objects.all()
+        return [queryset.filter(reserved_date__gte=updated_since) if updated_since else queryset]
+
+    querysets = [Loan.objects.all()]
+    if needs_archive(updated_since, date_field='returned_date'):
+        querysets.append(ArchivedLoan.objects.all())
+    if updated_since:
+        changed = Q(borrowed_date__gte=updated_since) | Q(returned_date__gte=updated_since)
+        querysets = [queryset.filter(changed) for queryset in querysets]
+    return querysets
+
+
+def dataset_querysets(name, updated_since=None, min_id=None, max_id=None):
+    querysets = []
+    for queryset in _dataset_querysets(name, updated_since):
+        if min_id is not None:
+            queryset = queryset.filter(pk__gte=min_id)
+        if max_id is not None:
+            queryset = queryset.filter(pk__lte=max_id)
+        querysets.append(queryset)
+    return querysets
+
+
+def dataset_rows(name, **filters):
+    """Кортежи значений DATASET_FIELDS[name] в порядке id, читаемые курсором на сервере."""
+    for queryset in dataset_querysets(name, **filters):
+        yield from queryset.order_by('pk').values_list(*DATASET_FIELDS[name]).iterator(chunk_size=CHUNK_SIZE)
+
+
+def _plain_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def csv_chunks(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(['' if value is None else _plain_value(value) for value in row])
+        if count % FLUSH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def jsonl_chunks(columns, rows):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, map(_plain_value, row))), ensure_ascii=False))
+        if len(lines) == FLUSH_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def encode_chunks(chunks, compress=False):
+    """Кодирует строки в UTF-8 и, если нужно, сжимает их на лету в формат gzip."""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    for chunk in chunks:
+        data = chunk.encode()
+        if compressor is None:
+            yield data
+        else:
+            data = compressor.compress(data)
+            if data:
+                yield data
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def stream_dataset(name, export_format, compress=False, rows=None, **filters):
+    """Байты выгрузки датасета name в формате csv или jsonl; rows подменяет чтение из базы."""
+    columns = dataset_columns(name)
+    if rows is None:
+        rows = dataset_rows(name, **filters)
+    chunks = csv_chunks(columns, rows) if export_format == 'csv' else jsonl_chunks(columns, rows)
+    return encode_chunks(chunks, compress)
+
+
+def dataset_response(name, export_format, compress=False, **filters):
+    content_type, extension = EXPORT_FORMATS[export_format]
+    filename = f'{name}.{extension}'
+    if compress:
+        content_type = 'application/gzip'
+        filename += '.gz'
+    response = StreamingHttpResponse(stream_dataset(name, export_format, compress, **filters), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def parse_export_filters(params):
+    """
+    Фильтры инкрементальной выгрузки из словаря параметров: updated_since
+    (дата или дата-время ISO 8601), min_id и max_id включительно.
+    Бросает ValueError при неверном значении.
+    """
+    filters = {}
+    value = params.get('updated_since')
+    if value:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(f'Invalid updated_since "{value}", expected an ISO 8601 date or datetime')
+            moment = datetime.datetime.combine(day, datetime.time.min)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        filters['updated_since'] = moment
+    for name in ('min_id', 'max_id'):
+        value = params.get(name)
+        if value:
+            if not str(value).isdigit():
+                raise ValueError(f'Invalid {name} "{value}", expected a positive integer')
+            filters[name] = int(value)
+    return filters
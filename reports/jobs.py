@@ -0,0 +1,154 @@
+"""
+Фоновые выгрузки.
+
+Представление ставит ExportJob в очередь, команда run_export_jobs забирает
+задачи условным UPDATE (pending -> running), пишет файл во временный файл и
+сохраняет его в MEDIA_ROOT/exports/, обновляя rows_written каждые
+PROGRESS_EVERY строк. Одинаковые запросы, пока задача в очереди или
+выполняется, а также в течение REUSE_FINISHED после её завершения, получают
+ту же задачу. Готовые файлы удаляются через RETENTION, зависшие задачи
+(воркер упал) возвращаются в очередь через STALE_AFTER без heartbeat.
+"""
+import hashlib
+import json
+import logging
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from library_management.pagination import estimate_count
+from . import exports
+from .models import ExportJob
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_EVERY = 5000
+REUSE_FINISHED = timedelta(seconds=getattr(settings, 'EXPORT_JOB_REUSE_SECONDS', 300))
+RETENTION = timedelta(hours=getattr(settings, 'EXPORT_JOB_RETENTION_HOURS', 24))
+STALE_AFTER = timedelta(minutes=getattr(settings, 'EXPORT_JOB_STALE_MINUTES', 10))
+ENQUEUE_ATTEMPTS = 3
+
+
+def job_dedup_key(dataset, export_format, compress, filters):
+    if export_format == 'xlsx':
+        # Excel-выгрузка всегда полная и не сжимается
+        compress, filters = False, {}
+    raw = json.dumps([dataset, export_format, bool(compress), filters], sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _reusable_job(key):
+    return ExportJob.objects.filter(dedup_key=key).filter(
+        status__in=['pending', 'running']
+    ).first() or ExportJob.objects.filter(
+        dedup_key=key, status='done', finished_at__gte=timezone.now() - REUSE_FINISHED
+    ).order_by('-finished_at').first()
+
+
+def enqueue_export(dataset, export_format='xlsx', compress=False, filters=None, user=None):
+    """Возвращает активную или недавно готовую задачу с теми же параметрами либо создаёт новую."""
+    filters = {name: str(value) for name, value in (filters or {}).items() if value not in (None, '')}
+    exports.parse_export_filters(filters)  # ValueError до постановки в очередь
+    key = job_dedup_key(dataset, export_format, compress, filters)
+
+    for attempt in range(ENQUEUE_ATTEMPTS):
+        existing = _reusable_job(key)
+        if existing:
+            return existing
+        try:
+            with transaction.atomic():
+                return ExportJob.objects.create(
+                    dataset=dataset, export_format=export_format, compress=compress and export_format != 'xlsx',
+                    filters=filters if export_format != 'xlsx' else {}, dedup_key=key, requested_by=user
+                )
+        except IntegrityError:
+            # Такую же задачу только что поставил другой запрос; к повторной проверке
+            # она может уже завершиться — тогда вернём готовую или поставим новую
+            if attempt == ENQUEUE_ATTEMPTS - 1:
+                raise
+
+
+def claim_next_job():
+    """Переводит самую старую задачу из очереди в running; None — очередь пуста."""
+    for job_id in ExportJob.objects.filter(status='pending').order_by('created_at').values_list('pk', flat=True)[:10]:
+        now = timezone.now()
+        claimed = ExportJob.objects.filter(pk=job_id, status='pending').update(
+            status='running', started_at=now, heartbeat_at=now, rows_written=0
+        )
+        if claimed:
+            return ExportJob.objects.get(pk=job_id)
+    return None
+
+
+def _estimate_total(job, filters):
+    if job.export_format == 'xlsx':
+        filters = {}
+    return sum(estimate_count(queryset) for queryset in exports.dataset_querysets(job.dataset, **filters))
+
+
+def _report_progress(job, rows):
+    for count, row in enumerate(rows, start=1):
+        if count % PROGRESS_EVERY == 0:
+            ExportJob.objects.filter(pk=job.pk).update(rows_written=count, heartbeat_at=timezone.now())
+        job.rows_written = count
+        yield row
+
+
+def job_filename(job):
+    name = f'{job.dataset}-{job.pk}.{job.export_format}'
+    return name + '.gz' if job.compress else name
+
+
+def run_export_job(job):
+    filters = exports.parse_export_filters(job.filters)
+    ExportJob.objects.filter(pk=job.pk).update(total_rows=_estimate_total(job, filters))
+
+    with tempfile.TemporaryFile() as output:
+        if job.export_format == 'xlsx':
+            headers, rows, sheet_title = exports.XLSX_DATASETS[job.dataset]
+            exports.write_xlsx(output, sheet_title, headers, _report_progress(job, rows()))
+        else:
+            rows = _report_progress(job, exports.dataset_rows(job.dataset, **filters))
+            for chunk in exports.stream_dataset(job.dataset, job.export_format, job.compress, rows=rows):
+                output.write(chunk)
+        output.seek(0)
+        job.file.save(job_filename(job), File(output), save=False)
+
+    ExportJob.objects.filter(pk=job.pk).update(
+        status='done', file=job.file.name, rows_written=job.rows_written,
+        total_rows=job.rows_written, finished_at=timezone.now()
+    )
+
+
+def process_next_job():
+    """Выполняет одну задачу из очереди; возвращает её или None."""
+    job = claim_next_job()
+    if job is None:
+        return None
+    try:
+        run_export_job(job)
+    except Exception as error:
+        logger.exception('Export job %s failed', job.pk)
+        ExportJob.objects.filter(pk=job.pk).update(status='failed', error=str(error), finished_at=timezone.now())
+    job.refresh_from_db()
+    return job
+
+
+def cleanup_export_jobs(now=None):
+    """Удаляет старые задачи с файлами и возвращает в очередь зависшие; возвращает (удалено, возвращено)."""
+    now = now or timezone.now()
+    requeued = ExportJob.objects.filter(status='running', heartbeat_at__lt=now - STALE_AFTER).update(
+        status='pending', started_at=None, heartbeat_at=None
+    )
+    expired = ExportJob.objects.filter(status__in=['done', 'failed'], finished_at__lt=now - RETENTION)
+    deleted = 0
+    for job in expired.iterator():
+        if job.file:
+            job.file.delete(save=False)
+        job.delete()
+        deleted += 1
+    return deleted, requeued
@@ -0,0 +1,128 @@
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import timedelta
+
+import pandas as pd
+from django.utils import timezone
+
+from accounts.models import User
+from books.models import Author, Book
+from library_management.benchmark import BenchmarkCommand
+from loans.models import Loan
+from reports.exports import LOAN_HEADERS, loan_rows, write_xlsx
+
+
+def _legacy_export(stream):
+    # Прежняя реализация: объекты моделей -> список словарей -> DataFrame -> ExcelWriter
+    data = []
+    for loan in Loan.objects.select_related('user', 'book').all():
+        data.append({
+            'Username': loan.user.username,
+            'User First Name': loan.user.first_name or '',
+            'User Last Name': loan.user.last_name or '',
+            'Book Title': loan.book.title,
+            'ISBN': loan.book.isbn,
+            'Borrowed Date': loan.borrowed_date.strftime('%Y-%m-%d %H:%M') if loan.borrowed_date else '',
+            'Due Date': loan.due_date.strftime('%Y-%m-%d %H:%M') if loan.due_date else '',
+            'Returned Date': loan.returned_date.strftime('%Y-%m-%d %H:%M') if loan.returned_date else '',
+            'Status': loan.get_status_display(),
+            'Renewals': loan.renewals,
+            'Is Overdue': 'Yes' if loan.is_overdue() else 'No',
+        })
+    df = pd.DataFrame(data)
+    with pd.ExcelWriter(stream, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name='Loans', index=False)
+        worksheet = writer.sheets['Loans']
+        for column in worksheet.columns:
+            max_length = max(len(str(cell.value)) for cell in column)
+            worksheet.column_dimensions[column[0].column_letter].width = min(max_length + 2, 50)
+
+
+def _streaming_export(stream):
+    write_xlsx(stream, 'Loans', LOAN_HEADERS, loan_rows())
+
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BenchmarkCommand):
+    help = 'Compare memory and time of the streaming loans export with the previous pandas export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=1000000)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--trace-heap', action='store_true', help='Also report the Python heap peak (slow)')
+        parser.add_argument('--skip-legacy', action='store_true',
+                            help='Measure only the streaming export (the old one needs several GB at 1M loans)')
+
+    def _measure(self, label, export, trace_heap):
+        rss_before = _max_rss_mb()
+        if trace_heap:
+            # tracemalloc замедляет выгрузку в разы, поэтому включается отдельно
+            tracemalloc.start()
+        started = time.perf_counter()
+        with tempfile.TemporaryFile() as stream:
+            export(stream)
+            size = stream.tell()
+        elapsed = time.perf_counter() - started
+        rss_growth = _max_rss_mb() - rss_before
+        line = f'{label}: {elapsed:.1f} s, max RSS growth {rss_growth:.0f} MB'
+        if trace_heap:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            line += f', Python heap peak {peak / 2 ** 20:.0f} MB'
+        self.stdout.write(f'{line}, file {size / 2 ** 20:.1f} MB')
+        return elapsed, rss_growth
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        prefix = f'xlsxbench-{uuid.uuid4().hex[:8]}'
+        author = Author.objects.create(first_name='Bench', last_name=prefix)
+        books = Book.objects.bulk_create([
+            Book(title=f'{prefix} {i}', author=author, isbn=f'{i:04d}{uuid.uuid4().hex[:9]}',
+                 publication_year=2000, publisher='bench', total_copies=1000000, available_copies=1000000)
+            for i in range(200)
+        ])
+        # bulk_create не обновляет счётчики автора, а удаление книг в конце их уменьшит
+        Author.objects.filter(pk=author.pk).update(book_count=len(books), available_book_count=len(books))
+        users = User.objects.bulk_create([User(username=f'{prefix}-{i}') for i in range(options['users'])])
+
+        try:
+            self._populate(rng, books, users, options['loans'])
+            self.stdout.write(f'Exporting {Loan.objects.count()} loans')
+            # Потоковую выгрузку меряем первой: ru_maxrss только растёт
+            streaming_time, streaming_rss = self._measure('Streaming export', _streaming_export, options['trace_heap'])
+            if options['skip_legacy']:
+                self.stdout.write(self.style.SUCCESS('Successfully benchmarked the streaming export'))
+                return
+            legacy_time, legacy_rss = self._measure('Legacy export', _legacy_export, options['trace_heap'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Successfully benchmarked exports: {legacy_time:.1f} s / +{legacy_rss:.0f} MB RSS -> '
+                f'{streaming_time:.1f} s / +{streaming_rss:.0f} MB RSS'
+            ))
+        finally:
+            Loan.objects.filter(user__in=users).delete()
+            User.objects.filter(username__startswith=prefix).delete()
+            Book.objects.filter(title__startswith=prefix).delete()
+            author.delete()
+
+    def _populate(self, rng, books, users, count):
+        now = timezone.now()
+        remaining = count
+        while remaining:
+            batch = []
+            for _ in range(min(remaining, 20000)):
+                due = now + timedelta(days=rng.randint(-30, 14))
+                returned = now - timedelta(days=rng.randint(0, 30)) if rng.random() < 0.7 else None
+                batch.append(Loan(
+                    user=rng.choice(users), book=rng.choice(books), due_date=due, returned_date=returned,
+                    status='returned' if returned else ('overdue' if due < now else 'active')
+                ))
+            Loan.objects.bulk_create(batch)
+            remaining -= len(batch)
@@ -0,0 +1,79 @@
+import tempfile
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from library_management.benchmark import BenchmarkCommand
+from reports.snapshot import NOT_RETURNED, STATUS_CODES, LoanSnapshot
+
+
+def _synthetic_columns(count, books, users, now, seed):
+    # Займы за 5 лет со сроком 14 дней; ~95% возвращены через 1-30 дней
+    rng = np.random.default_rng(seed)
+    now = int(now.timestamp())
+    borrowed = np.sort(now - rng.integers(0, 5 * 365 * 86400, count))
+    returned = borrowed + rng.integers(86400, 30 * 86400, count)
+    returned[(rng.random(count) < 0.05) | (returned > now)] = NOT_RETURNED
+    due = borrowed + 14 * 86400
+    status = np.full(count, STATUS_CODES['returned'], np.uint8)
+    status[(returned == NOT_RETURNED) & (due >= now)] = STATUS_CODES['active']
+    status[(returned == NOT_RETURNED) & (due < now)] = STATUS_CODES['overdue']
+    return {
+        'id': np.arange(1, count + 1, dtype=np.int64),
+        # Популярность книг неравномерна: распределение Ципфа
+        'book_id': np.minimum(rng.zipf(1.3, count), books).astype(np.int32),
+        'user_id': rng.integers(1, users + 1, count, dtype=np.int32),
+        'borrowed': borrowed,
+        'due': due,
+        'returned': returned,
+        'status': status,
+        'renewals': rng.integers(0, 3, count, dtype=np.uint8),
+    }
+
+
+class Command(BenchmarkCommand):
+    help = 'Time dashboard, period, popularity and activity queries on a memory-mapped synthetic loan snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=5000000)
+        parser.add_argument('--books', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=200000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def _time(self, label, query, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query()
+            timings.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(f'  {label:<28} best {min(timings):8.1f}ms  median {sorted(timings)[len(timings) // 2]:8.1f}ms')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        columns = _synthetic_columns(options['loans'], options['books'], options['users'], now, options['seed'])
+
+        with tempfile.TemporaryDirectory() as root:
+            started = time.perf_counter()
+            path = LoanSnapshot(columns, now.timestamp()).save(root)
+            saved = time.perf_counter()
+            snapshot = LoanSnapshot.open(path)
+            self.stdout.write(
+                f'{len(snapshot)} loans: saved in {saved - started:.2f}s, '
+                f'opened (mmap) in {(time.perf_counter() - saved) * 1000:.1f}ms'
+            )
+
+            month = now - timedelta(days=30)
+            year = now - timedelta(days=365)
+            repeat = options['repeat']
+            self._time('dashboard counts', lambda: snapshot.counts(now), repeat)
+            self._time('period stats (month)', lambda: snapshot.period_stats(month, now), repeat)
+            self._time('period stats (all time)', lambda: snapshot.period_stats(None, now), repeat)
+            self._time('top 20 books (month)', lambda: snapshot.top_books(month, 20), repeat)
+            self._time('top 20 books (all time)', lambda: snapshot.top_books(None, 20), repeat)
+            self._time('top 50 readers (year)', lambda: snapshot.top_readers(year, 50), repeat)
+            self._time('activity projection (year)', lambda: snapshot.loans_since(year), repeat)
+
+        self.stdout.write(self.style.SUCCESS('Successfully benchmarked the loan snapshot'))
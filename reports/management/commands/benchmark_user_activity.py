@@ -0,0 +1,67 @@
+import time
+
+import numpy as np
+import pandas as pd
+from django.utils import timezone
+
+from library_management.benchmark import BenchmarkCommand
+from reports.analytics import _with_rates, cohort_breakdown, load_loans, summarize_loans
+
+
+def _synthetic_loans(count, users, now, seed):
+    # Займы за последний год: срок 14 дней, ~80% возвращены через 1-30 дней
+    rng = np.random.default_rng(seed)
+    now = np.datetime64(now.replace(tzinfo=None), 'us')
+    borrowed = now - rng.integers(0, 365 * 86400, count).astype('timedelta64[s]')
+    returned = borrowed + rng.integers(86400, 30 * 86400, count).astype('timedelta64[s]')
+    returned[(rng.random(count) < 0.2) | (returned > now)] = np.datetime64('NaT')
+    return {
+        'user_id': rng.integers(1, users + 1, count),
+        'borrowed_date': borrowed,
+        'due_date': borrowed + np.timedelta64(14, 'D'),
+        'returned_date': returned,
+    }
+
+
+def _synthetic_users(users, seed):
+    rng = np.random.default_rng(seed)
+    months = pd.period_range('2020-01', periods=72, freq='M').strftime('%Y-%m')
+    return pd.DataFrame({
+        'user_type': rng.choice(['reader', 'librarian', 'it_staff', 'management'], users, p=[0.97, 0.01, 0.01, 0.01]),
+        'signup_month': rng.choice(months, users),
+    }, index=pd.RangeIndex(1, users + 1, name='id'))
+
+
+class Command(BenchmarkCommand):
+    help = 'Time the vectorized user activity computation on synthetic loans and on the current database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=10000000)
+        parser.add_argument('--users', type=int, default=200000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skip-db', action='store_true', help='Do not time loading loans from the loan snapshot')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        loans = _synthetic_loans(options['loans'], options['users'], now, options['seed'])
+        users = _synthetic_users(options['users'], options['seed'])
+
+        started = time.perf_counter()
+        per_user = _with_rates(summarize_loans(loans, now))
+        summarized = time.perf_counter()
+        cohort_breakdown(per_user, users, 'user_type')
+        cohort_breakdown(per_user, users, 'signup_month')
+        finished = time.perf_counter()
+        self.stdout.write(
+            f'{options["loans"]} loans, {len(per_user)} readers: per-user {summarized - started:.2f}s, '
+            f'cohorts {finished - summarized:.2f}s'
+        )
+
+        if not options['skip_db']:
+            # Проекция из опубликованного снимка займов (reports.snapshot), без снимка — из базы
+            started = time.perf_counter()
+            loans, _ = load_loans(now - pd.Timedelta(days=365))
+            rows = len(loans['user_id'])
+            self.stdout.write(f'Loaded {rows} loans of the last year in {time.perf_counter() - started:.2f}s')
+
+        self.stdout.write(self.style.SUCCESS('Successfully benchmarked user activity analytics'))
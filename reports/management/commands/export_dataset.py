@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from reports.exports import DATASET_FIELDS, EXPORT_FORMATS, dataset_rows, parse_export_filters, stream_dataset
+
+
+class Command(BaseCommand):
+    help = 'Stream a report dataset as CSV or JSON Lines for warehouse loads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASET_FIELDS))
+        parser.add_argument('--format', dest='export_format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip')
+        parser.add_argument('--updated-since', help='Only rows changed since this ISO 8601 date or datetime')
+        parser.add_argument('--min-id', help='Smallest id to export')
+        parser.add_argument('--max-id', help='Largest id to export')
+        parser.add_argument('--output', '-o', help='File to write (default: standard output)')
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_export_filters({
+                'updated_since': options['updated_since'],
+                'min_id': options['min_id'],
+                'max_id': options['max_id'],
+            })
+        except ValueError as error:
+            raise CommandError(error)
+
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        rows = counted(dataset_rows(options['dataset'], **filters))
+        chunks = stream_dataset(options['dataset'], options['export_format'], options['gzip'], rows=rows)
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+
+        # Данные могут идти в stdout, поэтому итог пишем в stderr
+        self.stderr.write(self.style.SUCCESS(f'Successfully exported {count} {options["dataset"]} rows'))
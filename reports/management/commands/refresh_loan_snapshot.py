@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from reports.snapshot import loan_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Append new and changed loans to the columnar loan snapshot used by report analytics'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rebuild the snapshot from all loans, including the archive')
+        parser.add_argument('--loop', type=int, metavar='SECONDS',
+                            help='Keep running and refresh the snapshot every SECONDS')
+
+    def handle(self, *args, **options):
+        rebuild = options['rebuild']
+        while True:
+            started = time.perf_counter()
+            snapshot = loan_snapshot.refresh(rebuild=rebuild)
+            self.stdout.write(self.style.SUCCESS(
+                f'Successfully {"rebuilt" if rebuild else "refreshed"} loan snapshot: '
+                f'{len(snapshot)} loans up to id {snapshot.max_id} in {time.perf_counter() - started:.2f}s'
+            ))
+
+            if not options['loop']:
+                break
+            rebuild = False
+            time.sleep(options['loop'])
@@ -0,0 +1,34 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from reports.rollups import first_activity_day, rollup_pending
+
+
+def _parse_day(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date "{value}", expected YYYY-MM-DD')
+
+
+class Command(BaseCommand):
+    help = 'Fill daily circulation rollups for days completed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true',
+                            help='Recompute every day from the first loan or reservation, ignoring the watermark')
+        parser.add_argument('--since', metavar='YYYY-MM-DD', help='Recompute starting from this day')
+        parser.add_argument('--until', metavar='YYYY-MM-DD', help='Last day to roll up (default and latest: yesterday)')
+        parser.add_argument('--chunk-days', type=int, default=31, help='Days per transaction')
+
+    def handle(self, *args, **options):
+        first_day = _parse_day(options['since']) if options['since'] else None
+        last_day = _parse_day(options['until']) if options['until'] else None
+        if options['backfill'] and first_day is None:
+            first_day = first_activity_day()
+            if first_day is None:
+                self.stdout.write(self.style.SUCCESS('Successfully rolled up 0 days (no loans yet)'))
+                return
+
+        days, rows = rollup_pending(first_day, last_day, chunk_days=max(1, options['chunk_days']))
+        self.stdout.write(self.style.SUCCESS(f'Successfully rolled up {days} days into {rows} rows'))
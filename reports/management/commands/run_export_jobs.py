@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from reports.jobs import cleanup_export_jobs, process_next_job
+
+
+class Command(BaseCommand):
+    help = 'Run queued report export jobs and clean up old export files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=int, metavar='SECONDS',
+                            help='Keep running and poll the queue every SECONDS instead of exiting when it is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted, requeued = cleanup_export_jobs()
+            if deleted or requeued:
+                self.stdout.write(f'Removed {deleted} old export jobs, requeued {requeued} stalled ones')
+
+            processed = 0
+            while (job := process_next_job()) is not None:
+                processed += 1
+                if job.status == 'done':
+                    self.stdout.write(f'Job {job.pk}: {job.rows_written} {job.dataset} rows -> {job.file.name}')
+                else:
+                    self.stdout.write(self.style.ERROR(f'Job {job.pk} failed: {job.error}'))
+            self.stdout.write(self.style.SUCCESS(f'Successfully processed {processed} export jobs'))
+
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from reports.popularity import rebuild_popularity, slide_windows
+
+
+class Command(BaseCommand):
+    help = 'Slide the weekly, monthly and yearly book popularity windows (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rebuild day buckets and windows from all loans, including the archive')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            books = rebuild_popularity()
+            self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt popularity for {books} books'))
+        else:
+            updated = slide_windows()
+            self.stdout.write(self.style.SUCCESS(f'Successfully updated {updated} popularity windows'))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-18 04:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('books', '0004_book_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CirculationRollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CirculationDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('user_type', models.CharField(blank=True, max_length=20)),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('renewals', models.PositiveIntegerField(default=0)),
+                ('new_overdues', models.PositiveIntegerField(default=0)),
+                ('reservations', models.PositiveIntegerField(default=0)),
+                ('genre', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='circulation_rollups', to='books.genre')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='reports_cir_day_6d54b0_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0001_circulation_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset', models.CharField(choices=[('books', 'Books'), ('loans', 'Loans'), ('users', 'Users'), ('reservations', 'Reservations')], max_length=20)),
+                ('export_format', models.CharField(choices=[('xlsx', 'Excel'), ('csv', 'CSV'), ('jsonl', 'JSON Lines')], default='xlsx', max_length=10)),
+                ('compress', models.BooleanField(default=False)),
+                ('filters', models.JSONField(blank=True, default=dict)),
+                ('dedup_key', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('rows_written', models.PositiveIntegerField(default=0)),
+                ('total_rows', models.PositiveIntegerField(blank=True, null=True)),
+                ('file', models.FileField(blank=True, upload_to='exports/')),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='export_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='reports_exp_status_b9ce26_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('dedup_key',), name='unique_active_export_job')],
+            },
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.8 on 2026-10-18 05:31
+
+import django.db.models.deletion
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def fill_popularity(apps, schema_editor):
+    # Начальные корзины и окна по уже существующим займам, как update_popularity --rebuild
+    BookPopularity = apps.get_model('reports', 'BookPopularity')
+    BookPopularityBucket = apps.get_model('reports', 'BookPopularityBucket')
+    today = timezone.localdate()
+    counts = defaultdict(int)
+    for model_name in ('Loan', 'ArchivedLoan'):
+        rows = (
+            apps.get_model('loans', model_name).objects.order_by()
+            .annotate(day=TruncDate('borrowed_date'))
+            .values_list('book_id', 'day')
+            .annotate(count=Count('id'))
+        )
+        for book_id, day, count in rows.iterator(chunk_size=5000):
+            counts[(book_id, day)] += count
+
+    windows = defaultdict(lambda: {'week': 0, 'month': 0, 'year': 0, 'all_time': 0})
+    for (book_id, day), count in counts.items():
+        age = (today - day).days
+        totals = windows[book_id]
+        totals['all_time'] += count
+        for period, days in (('week', 7), ('month', 30), ('year', 365)):
+            if age < days:
+                totals[period] += count
+
+    BookPopularityBucket.objects.bulk_create([
+        BookPopularityBucket(book_id=book_id, day=day, loans=count) for (book_id, day), count in counts.items()
+    ], batch_size=5000)
+    BookPopularity.objects.bulk_create([
+        BookPopularity(book_id=book_id, **totals) for book_id, totals in windows.items()
+    ], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_counters'),
+        ('loans', '0005_loan_archive'),
+        ('reports', '0002_export_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookPopularity',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='books.book')),
+                ('week', models.PositiveIntegerField(default=0)),
+                ('month', models.PositiveIntegerField(default=0)),
+                ('year', models.PositiveIntegerField(default=0)),
+                ('all_time', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-week', 'book'], name='popularity_week_idx'), models.Index(fields=['-month', 'book'], name='popularity_month_idx'), models.Index(fields=['-year', 'book'], name='popularity_year_idx'), models.Index(fields=['-all_time', 'book'], name='popularity_all_time_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BookPopularityBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='popularity_buckets', to='books.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='reports_boo_day_816516_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'day'), name='unique_book_popularity_bucket')],
+            },
+        ),
+        migrations.RunPython(fill_popularity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:01
+
+from django.db import migrations, models
+from django.db.models import Count
+
+METRICS = ('loans', 'returns', 'renewals', 'new_overdues', 'reservations')
+
+
+def merge_duplicate_rollups(apps, schema_editor):
+    # Строки-дубли от параллельных record_renewal сливаются в первую строку разреза
+    CirculationDailyRollup = apps.get_model('reports', 'CirculationDailyRollup')
+    duplicates = (
+        CirculationDailyRollup.objects.order_by().values_list('day', 'genre_id', 'user_type')
+        .annotate(rows=Count('id')).filter(rows__gt=1)
+    )
+    for day, genre_id, user_type, _ in duplicates:
+        rows = list(CirculationDailyRollup.objects.filter(day=day, genre_id=genre_id, user_type=user_type).order_by('pk'))
+        first = rows[0]
+        for row in rows[1:]:
+            for metric in METRICS:
+                setattr(first, metric, getattr(first, metric) + getattr(row, metric))
+        first.save(update_fields=METRICS)
+        CirculationDailyRollup.objects.filter(pk__in=[row.pk for row in rows[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_counters'),
+        ('reports', '0003_book_popularity'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rollups, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='circulationdailyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('genre__isnull', False)), fields=('day', 'genre', 'user_type'), name='unique_rollup_day_genre_user_type'),
+        ),
+        migrations.AddConstraint(
+            model_name='circulationdailyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('genre__isnull', True)), fields=('day', 'user_type'), name='unique_rollup_day_user_type_without_genre'),
+        ),
+    ]
@@ -1,3 +1,144 @@
 from django.db import models
 
-# Create your models here.
+
+class CirculationDailyRollup(models.Model):
+    """
+    Итоги выдачи за один день в разрезе жанра книги и типа читателя.
+    Заполняется командой rollup_circulation (см. reports.rollups).
+    """
+    day = models.DateField()
+    genre = models.ForeignKey('books.Genre', on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='circulation_rollups')
+    user_type = models.CharField(max_length=20, blank=True)
+    loans = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    renewals = models.PositiveIntegerField(default=0)
+    new_overdues = models.PositiveIntegerField(default=0)
+    reservations = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.day} {self.genre_id or '-'} {self.user_type or '-'}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+        # Одна строка на разрез; NULL в genre уникальность не проверяет, поэтому отдельное условие
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'genre', 'user_type'], condition=models.Q(genre__isnull=False),
+                                    name='unique_rollup_day_genre_user_type'),
+            models.UniqueConstraint(fields=['day', 'user_type'], condition=models.Q(genre__isnull=True),
+                                    name='unique_rollup_day_user_type_without_genre'),
+        ]
+
+
+class CirculationRollupWatermark(models.Model):
+    """Последний день, полностью посчитанный в CirculationDailyRollup (одна строка)."""
+    day = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.day)
+
+
+class ExportJob(models.Model):
+    """Выгрузка, которую выполняет команда run_export_jobs вне HTTP-запроса (см. reports.jobs)."""
+    DATASET_CHOICES = (
+        ('books', 'Books'),
+        ('loans', 'Loans'),
+        ('users', 'Users'),
+        ('reservations', 'Reservations'),
+    )
+    FORMAT_CHOICES = (
+        ('xlsx', 'Excel'),
+        ('csv', 'CSV'),
+        ('jsonl', 'JSON Lines'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    dataset = models.CharField(max_length=20, choices=DATASET_CHOICES)
+    export_format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='xlsx')
+    compress = models.BooleanField(default=False)
+    filters = models.JSONField(default=dict, blank=True)
+    # Хэш параметров: одинаковые запросы, пока задача не завершена, получают одну задачу
+    dedup_key = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    requested_by = models.ForeignKey('accounts.User', on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='export_jobs')
+    rows_written = models.PositiveIntegerField(default=0)
+    total_rows = models.PositiveIntegerField(null=True, blank=True)
+    file = models.FileField(upload_to='exports/', blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def progress(self):
+        if self.status == 'done':
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(99, round(self.rows_written * 100 / self.total_rows))
+
+    def __str__(self):
+        return f"{self.dataset}.{self.export_format} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='unique_active_export_job'
+            ),
+        ]
+
+
+class BookPopularityBucket(models.Model):
+    """Количество выдач книги за один день (см. reports.popularity)."""
+    book = models.ForeignKey('books.Book', on_delete=models.CASCADE, related_name='popularity_buckets')
+    day = models.DateField()
+    loans = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.book_id} {self.day}: {self.loans}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'day'], name='unique_book_popularity_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+
+class BookPopularity(models.Model):
+    """
+    Выдачи книги за скользящие окна: неделя, месяц, год и всё время.
+    Индексы по каждому окну дают топ-K одним коротким проходом по индексу.
+    """
+    book = models.OneToOneField('books.Book', on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    week = models.PositiveIntegerField(default=0)
+    month = models.PositiveIntegerField(default=0)
+    year = models.PositiveIntegerField(default=0)
+    all_time = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.book_id}: {self.week}/{self.month}/{self.year}/{self.all_time}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-week', 'book'], name='popularity_week_idx'),
+            models.Index(fields=['-month', 'book'], name='popularity_month_idx'),
+            models.Index(fields=['-year', 'book'], name='popularity_year_idx'),
+            models.Index(fields=['-all_time', 'book'], name='popularity_all_time_idx'),
+        ]
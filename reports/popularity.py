@@ -0,0 +1,135 @@
+"""
+Рейтинги популярности книг по скользящим окнам.
+
+Каждая выдача увеличивает счётчик книги за день (BookPopularityBucket) и
+все четыре окна в BookPopularity в той же транзакции — record_borrows()
+вызывается из подписки на loans.signals.circulation_changed (reports.signals). Раз в день окна
+«сдвигаются»: для книг, у которых корзина вышла за границу окна, сумма окна
+пересчитывается по корзинам. Топ-K — это короткий проход по индексу
+окна, без соединения с займами и сортировки.
+
+Окна считаются целыми днями, включая сегодняшний: неделя — 7 дней,
+месяц — 30, год — 365.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from loans.models import ArchivedLoan, Loan
+from .models import BookPopularity, BookPopularityBucket
+
+WINDOWS = {'week': 7, 'month': 30, 'year': 365}
+PERIODS = ('week', 'month', 'year', 'all_time')
+# Сколько дней за границей окна проверяется при сдвиге (если сдвиг пропускали)
+SLIDE_LOOKBACK_DAYS = 7
+SLIDE_CACHE_KEY = 'reports:popularity:slid_on'
+
+
+def _add(model, lookup, increments):
+    """UPDATE счётчиков с F() или INSERT, если строки ещё нет."""
+    updates = {field: F(field) + value for field, value in increments.items()}
+    if model.objects.filter(**lookup).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **increments)
+    except IntegrityError:
+        # Строку только что создал параллельный запрос
+        model.objects.filter(**lookup).update(**updates)
+
+
+def record_borrows(book_ids, now=None):
+    """Учитывает новые выдачи книг (id повторяется, если книгу выдали несколько раз)."""
+    day = timezone.localdate(now)
+    for book_id, count in sorted(Counter(book_ids).items()):
+        _add(BookPopularityBucket, {'book_id': book_id, 'day': day}, {'loans': count})
+        _add(BookPopularity, {'book_id': book_id}, {period: count for period in PERIODS})
+
+
+def _window_sum(first_day):
+    buckets = BookPopularityBucket.objects.filter(book=OuterRef('book'), day__gte=first_day)
+    return Coalesce(
+        Subquery(buckets.order_by().values('book').annotate(total=Sum('loans')).values('total'),
+                 output_field=IntegerField()),
+        0
+    )
+
+
+def slide_windows(today=None, lookback=SLIDE_LOOKBACK_DAYS):
+    """Пересчитывает окна книг, у которых корзины вышли за границу окна; возвращает число обновлений."""
+    today = today or timezone.localdate()
+    updated = 0
+    for period, days in WINDOWS.items():
+        first_day = today - timedelta(days=days - 1)
+        expired = BookPopularityBucket.objects.filter(
+            day__lt=first_day, day__gte=first_day - timedelta(days=lookback)
+        ).values('book_id')
+        updated += BookPopularity.objects.filter(book_id__in=expired).update(**{period: _window_sum(first_day)})
+    return updated
+
+
+def ensure_windows_fresh():
+    """Сдвигает окна при первом обращении за день, если ежедневная команда не запускалась."""
+    today = timezone.localdate()
+    if cache.get(SLIDE_CACHE_KEY) != today:
+        slide_windows(today)
+        cache.set(SLIDE_CACHE_KEY, today, 86400)
+
+
+def rebuild_popularity(today=None):
+    """Строит корзины и окна заново по всем займам, включая архив; возвращает число книг."""
+    today = today or timezone.localdate()
+    counts = defaultdict(int)
+    for queryset in (Loan.objects.all(), ArchivedLoan.objects.all()):
+        rows = (
+            queryset.order_by()
+            .annotate(day=TruncDate('borrowed_date'))
+            .values_list('book_id', 'day')
+            .annotate(count=Count('id'))
+        )
+        for book_id, day, count in rows.iterator(chunk_size=5000):
+            counts[(book_id, day)] += count
+
+    windows = defaultdict(lambda: dict.fromkeys(PERIODS, 0))
+    for (book_id, day), count in counts.items():
+        age = (today - day).days
+        totals = windows[book_id]
+        totals['all_time'] += count
+        for period, days in WINDOWS.items():
+            if age < days:
+                totals[period] += count
+
+    with transaction.atomic():
+        BookPopularityBucket.objects.all().delete()
+        BookPopularity.objects.all().delete()
+        BookPopularityBucket.objects.bulk_create([
+            BookPopularityBucket(book_id=book_id, day=day, loans=count)
+            for (book_id, day), count in counts.items()
+        ], batch_size=5000)
+        BookPopularity.objects.bulk_create([
+            BookPopularity(book_id=book_id, **totals) for book_id, totals in windows.items()
+        ], batch_size=5000)
+    cache.set(SLIDE_CACHE_KEY, today, 86400)
+    return len(windows)
+
+
+def top_books(period='all_time', limit=20):
+    """Самые выдаваемые книги за период: список Book с атрибутом loan_count."""
+    if period not in PERIODS:
+        period = 'all_time'
+    ensure_windows_fresh()
+    rows = (
+        BookPopularity.objects.filter(**{f'{period}__gt': 0})
+        .select_related('book__author', 'book__genre')
+        .order_by(f'-{period}', 'book')[:limit]
+    )
+    books = []
+    for row in rows:
+        row.book.loan_count = getattr(row, period)
+        books.append(row.book)
+    return books
@@ -0,0 +1,203 @@
+"""
+Ежедневные итоги выдачи для отчётов.
+
+CirculationDailyRollup хранит по строке на день, жанр книги и тип читателя:
+сколько займов выдано, возвращено, продлено, сколько стало просроченными
+(по дню срока возврата) и сколько создано броней. Команда rollup_circulation
+досчитывает закрытые дни после водяной отметки, поэтому статистика за период —
+это сумма не более чем 365 строк на разрез, а по горячим таблицам досчитываются
+только дни после отметки.
+
+Продления не имеют даты в Loan, поэтому их нельзя пересчитать задним числом:
+каждое продление увеличивает счётчик текущего дня через record_renewal()
+(подписка на loans.signals.circulation_changed в reports.signals),
+а пересчёт дня сохраняет уже накопленные продления.
+"""
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from loans.archive import needs_archive
+from loans.models import ArchivedLoan, Loan, Reservation
+from .models import CirculationDailyRollup, CirculationRollupWatermark
+
+METRICS = ('loans', 'returns', 'renewals', 'new_overdues', 'reservations')
+CHUNK_DAYS = 31
+
+# Заём стал просроченным в день срока, если не был возвращён вовремя
+BECAME_OVERDUE = Q(returned_date__isnull=True) | Q(returned_date__gt=F('due_date'))
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def _empty_row():
+    return dict.fromkeys(METRICS, 0)
+
+
+def _count_by_day(queryset, date_field, start, end):
+    return (
+        queryset.filter(**{f'{date_field}__gte': start, f'{date_field}__lt': end})
+        .order_by()
+        .annotate(day=TruncDate(date_field))
+        .values_list('day', 'book__genre_id', 'user__user_type')
+        .annotate(count=Count('id'))
+    )
+
+
+def compute_rollups(start, end):
+    """
+    Считает метрики (кроме продлений) за [start, end) по Loan, Reservation и,
+    если диапазон заходит в архив, по ArchivedLoan.
+    Возвращает {(день, genre_id, user_type): {метрика: количество}}.
+    """
+    # status__in по всем значениям позволяет искать по индексу (status, due_date)
+    all_statuses = [status for status, _ in Loan.STATUS_CHOICES]
+    sources = [
+        ('loans', Loan.objects.all(), 'borrowed_date'),
+        ('returns', Loan.objects.all(), 'returned_date'),
+        ('new_overdues', Loan.objects.filter(BECAME_OVERDUE, status__in=all_statuses), 'due_date'),
+        ('reservations', Reservation.objects.all(), 'reserved_date'),
+    ]
+    # Все даты архивного займа не позже даты его возврата
+    if needs_archive(start, date_field='returned_date'):
+        sources += [
+            ('loans', ArchivedLoan.objects.all(), 'borrowed_date'),
+            ('returns', ArchivedLoan.objects.all(), 'returned_date'),
+            ('new_overdues', ArchivedLoan.objects.filter(BECAME_OVERDUE), 'due_date'),
+        ]
+
+    rows = defaultdict(_empty_row)
+    for metric, queryset, date_field in sources:
+        for day, genre_id, user_type, count in _count_by_day(queryset, date_field, start, end):
+            rows[(day, genre_id, user_type or '')][metric] += count
+    return rows
+
+
+def get_watermark():
+    return CirculationRollupWatermark.objects.values_list('day', flat=True).first()
+
+
+def _advance_watermark(day):
+    # Пересчёт старого диапазона не должен сдвигать отметку назад
+    if not CirculationRollupWatermark.objects.exists():
+        CirculationRollupWatermark.objects.create(day=day)
+    else:
+        CirculationRollupWatermark.objects.filter(day__lt=day).update(day=day)
+
+
+def first_activity_day():
+    """Самый ранний день с займом или бронью (None — данных нет)."""
+    candidates = [
+        Loan.objects.aggregate(first=Min('borrowed_date'))['first'],
+        ArchivedLoan.objects.aggregate(first=Min('borrowed_date'))['first'],
+        Reservation.objects.aggregate(first=Min('reserved_date'))['first'],
+    ]
+    candidates = [value for value in candidates if value is not None]
+    if not candidates:
+        return None
+    return timezone.localtime(min(candidates)).date()
+
+
+def rollup_days(first_day, last_day):
+    """Пересчитывает дни first_day..last_day включительно; возвращает число записанных строк."""
+    with transaction.atomic():
+        existing = CirculationDailyRollup.objects.filter(day__gte=first_day, day__lte=last_day)
+        renewals = {
+            (day, genre_id, user_type): total
+            for day, genre_id, user_type, total in existing.order_by()
+            .values_list('day', 'genre_id', 'user_type').annotate(total=Sum('renewals'))
+            if total
+        }
+        rows = compute_rollups(day_start(first_day), day_start(last_day + datetime.timedelta(days=1)))
+        for key, total in renewals.items():
+            rows[key]['renewals'] += total
+
+        existing.delete()
+        CirculationDailyRollup.objects.bulk_create([
+            CirculationDailyRollup(day=day, genre_id=genre_id, user_type=user_type, **metrics)
+            for (day, genre_id, user_type), metrics in rows.items()
+        ], batch_size=1000)
+        _advance_watermark(last_day)
+    return len(rows)
+
+
+def rollup_pending(first_day=None, last_day=None, chunk_days=CHUNK_DAYS):
+    """
+    Досчитывает закрытые дни: от first_day (по умолчанию — день после водяной
+    отметки или первый день с данными) до last_day, но не позже вчерашнего дня.
+    Каждая пачка из chunk_days дней пишется в своей транзакции.
+    Возвращает (количество дней, количество строк).
+    """
+    # Текущий день не закрыт: после отметки его займы уже не попали бы в итоги
+    yesterday = timezone.localdate() - datetime.timedelta(days=1)
+    last_day = min(last_day or yesterday, yesterday)
+    if first_day is None:
+        watermark = get_watermark()
+        first_day = watermark + datetime.timedelta(days=1) if watermark else first_activity_day()
+    if first_day is None or first_day > last_day:
+        return 0, 0
+
+    days = rows = 0
+    chunk_start = first_day
+    while chunk_start <= last_day:
+        chunk_end = min(chunk_start + datetime.timedelta(days=chunk_days - 1), last_day)
+        rows += rollup_days(chunk_start, chunk_end)
+        days += (chunk_end - chunk_start).days + 1
+        chunk_start = chunk_end + datetime.timedelta(days=1)
+    return days, rows
+
+
+def record_renewal(loan_id, now=None):
+    """Учитывает продление займа в строке текущего дня."""
+    genre_id, user_type = Loan.objects.filter(pk=loan_id).values_list('book__genre_id', 'user__user_type').get()
+    key = {'day': timezone.localdate(now), 'genre_id': genre_id, 'user_type': user_type or ''}
+    # Строку разреза создаёт первый запрос дня; параллельная вставка упирается в уникальный индекс
+    CirculationDailyRollup.objects.bulk_create([CirculationDailyRollup(**key)], ignore_conflicts=True)
+    CirculationDailyRollup.objects.filter(**key).update(renewals=F('renewals') + 1)
+
+
+def period_totals(starts, genre=None, user_type=None):
+    """
+    Суммы метрик для нескольких периодов сразу: starts — {имя: первый день или None}.
+    Строки до водяной отметки суммируются одним запросом, дни после неё
+    досчитываются по горячим таблицам.
+    """
+    filters = {}
+    if genre is not None:
+        filters['genre'] = genre
+    if user_type:
+        filters['user_type'] = user_type
+
+    aggregates = {}
+    for name, first_day in starts.items():
+        condition = Q(day__gte=first_day) if first_day else None
+        for metric in METRICS:
+            aggregates[f'{name}_{metric}'] = Sum(metric, filter=condition, default=0)
+    sums = CirculationDailyRollup.objects.filter(**filters).aggregate(**aggregates)
+    totals = {
+        name: {metric: sums[f'{name}_{metric}'] for metric in METRICS}
+        for name in starts
+    }
+
+    # Дни после отметки содержат в таблице только продления
+    watermark = get_watermark()
+    live_day = watermark + datetime.timedelta(days=1) if watermark else first_activity_day()
+    if live_day is not None:
+        live_rows = compute_rollups(day_start(live_day), timezone.now())
+        for (day, genre_id, row_user_type), metrics in live_rows.items():
+            if genre is not None and genre_id != getattr(genre, 'pk', genre):
+                continue
+            if user_type and row_user_type != user_type:
+                continue
+            for name, first_day in starts.items():
+                if first_day and day < first_day:
+                    continue
+                for metric, count in metrics.items():
+                    totals[name][metric] += count
+    return totals
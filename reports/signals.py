@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save
+
+from accounts.models import User
+from books.models import Book
+from loans.models import Loan, Reservation
+from loans.signals import circulation_changed as bulk_circulation_changed
+from .popularity import record_borrows
+from .rollups import record_renewal
+from .stats import schedule_stats_invalidation
+
+
+def circulation_changed(sender, **kwargs):
+    schedule_stats_invalidation()
+
+
+def circulation_recorded(sender, borrowed_book_ids=(), renewed_loan_ids=(), now=None, **kwargs):
+    # Выдачи — в рейтинги популярности, продления — в ежедневные итоги, в транзакции операции
+    if borrowed_book_ids:
+        record_borrows(borrowed_book_ids, now)
+    for loan_id in renewed_loan_ids:
+        record_renewal(loan_id, now)
+
+
+def user_changed(sender, created=False, **kwargs):
+    # Пользователь сохраняется при каждом входе (last_login) — считаем только новых
+    if created:
+        schedule_stats_invalidation()
+
+
+for model in (Book, Loan, Reservation):
+    post_save.connect(circulation_changed, sender=model, dispatch_uid=f'circulation_stats_{model.__name__}_save')
+    post_delete.connect(circulation_changed, sender=model, dispatch_uid=f'circulation_stats_{model.__name__}_delete')
+
+post_save.connect(user_changed, sender=User, dispatch_uid='circulation_stats_User_save')
+# Массовые изменения в loans (bulk_create, UPDATE, архив) сигналов моделей не вызывают
+bulk_circulation_changed.connect(circulation_changed, dispatch_uid='circulation_stats_bulk')
+bulk_circulation_changed.connect(circulation_recorded, dispatch_uid='circulation_popularity_rollups')
+post_delete.connect(circulation_changed, sender=User, dispatch_uid='circulation_stats_User_delete')
@@ -0,0 +1,394 @@
+"""
+Колоночный снимок займов для аналитических запросов.
+
+Снимок — набор массивов NumPy по всем займам (горячая таблица и архив),
+отсортированных по id: book_id/user_id (int32), borrowed/due/returned
+(int64, секунды Unix; NOT_RETURNED — заём не возвращён), status (uint8,
+STATUS_CODES) и renewals (uint8). Каждое поколение пишется в отдельный
+каталог LOAN_SNAPSHOT_DIR/<поколение>/ как .npy-файлы, затем файл CURRENT
+атомарно переключается на него. Воркеры открывают файлы через mmap, поэтому
+страницы снимка общие для всех процессов на машине.
+
+Обновление инкрементальное: дописываются займы с id больше max_id, а
+займы, которые в снимке ещё не возвращены или вернулись после прошлого
+обновления, перечитываются из Loan (закрытые займы не меняются). Удалённые
+займы пропадают только при полной пересборке (refresh_loan_snapshot --rebuild).
+
+Обновление целиком (чтение, запись поколения, переключение CURRENT и
+удаление старых поколений) идёт под файловой блокировкой LOAN_SNAPSHOT_DIR/.lock,
+поэтому команда refresh_loan_snapshot и воркеры на одной машине не пишут
+одновременно. Поколение старше текущего не публикуется, удаляются только
+поколения старше опубликованного, а предыдущее остаётся — процессы, успевшие
+прочитать CURRENT, ещё откроют его. Веб-запрос устаревший снимок на диск не
+переписывает: обновление запускается в фоновом потоке, запрос получает
+текущий снимок.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connection
+
+from loans.archive import needs_archive
+from loans.models import ArchivedLoan, Loan
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+SNAPSHOT_DIR = str(getattr(settings, 'LOAN_SNAPSHOT_DIR', settings.BASE_DIR / 'snapshots' / 'loans'))
+MAX_AGE = getattr(settings, 'LOAN_SNAPSHOT_MAX_AGE', 300)  # секунд
+OPEN_ATTEMPTS = 3
+# Возврат фиксируется с timezone.now() до коммита: запас на долгие транзакции
+RETURN_SLACK = timedelta(minutes=10)
+FETCH_SIZE = 50000
+
+STATUS_CODES = {status: code for code, (status, _) in enumerate(Loan.STATUS_CHOICES)}
+NOT_RETURNED = -1
+COLUMNS = ('id', 'book_id', 'user_id', 'borrowed', 'due', 'returned', 'status', 'renewals')
+SOURCE_FIELDS = ('id', 'book_id', 'user_id', 'borrowed_date', 'due_date', 'returned_date', 'status', 'renewals')
+
+
+def _epoch_seconds(values):
+    # SQLite отдаёт строки, PostgreSQL — aware datetime
+    stamps = pd.to_datetime(values, utc=True, format='ISO8601').tz_convert(None).to_numpy('datetime64[s]')
+    return np.where(np.isnat(stamps), NOT_RETURNED, stamps.astype(np.int64))
+
+
+def _empty_columns():
+    return {
+        'id': np.empty(0, np.int64), 'book_id': np.empty(0, np.int32), 'user_id': np.empty(0, np.int32),
+        'borrowed': np.empty(0, np.int64), 'due': np.empty(0, np.int64), 'returned': np.empty(0, np.int64),
+        'status': np.empty(0, np.uint8), 'renewals': np.empty(0, np.uint8),
+    }
+
+
+def _concat(parts):
+    columns = _empty_columns()
+    return {name: np.concatenate([columns[name]] + [part[name] for part in parts]) for name in COLUMNS}
+
+
+def read_columns(queryset):
+    """Читает займы queryset серверным курсором порциями в колонки снимка."""
+    sql, params = queryset.order_by().values_list(*SOURCE_FIELDS).query.sql_with_params()
+    parts = []
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            ids, book_ids, user_ids, borrowed, due, returned, statuses, renewals = zip(*rows)
+            parts.append({
+                'id': np.fromiter(ids, np.int64, len(rows)),
+                'book_id': np.fromiter(book_ids, np.int32, len(rows)),
+                'user_id': np.fromiter(user_ids, np.int32, len(rows)),
+                'borrowed': _epoch_seconds(borrowed),
+                'due': _epoch_seconds(due),
+                'returned': _epoch_seconds(returned),
+                'status': np.fromiter((STATUS_CODES.get(status, 0) for status in statuses), np.uint8, len(rows)),
+                'renewals': np.fromiter(renewals, np.uint8, len(rows)),
+            })
+    return _concat(parts)
+
+
+@contextmanager
+def snapshot_lock(root, blocking=True):
+    """Монопольная блокировка каталога снимков; отдаёт False, если blocking=False и она занята."""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, '.lock'), 'a+') as lock_file:
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            if blocking:
+                raise
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _generation_time(name):
+    """Время сборки поколения в мс из имени каталога '<мс>-<суффикс>'; None — не поколение."""
+    prefix = name.split('-', 1)[0]
+    return int(prefix) if prefix.isdigit() else None
+
+
+def current_generation(root):
+    try:
+        with open(os.path.join(root, 'CURRENT')) as pointer:
+            return pointer.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _sorted_by_id(columns):
+    order = np.argsort(columns['id'], kind='stable')
+    return {name: values[order] for name, values in columns.items()}
+
+
+def _upsert(columns, changed):
+    """Заменяет строки с совпадающим id и дописывает новые; результат отсортирован по id."""
+    if not len(changed['id']):
+        return columns
+    changed = _sorted_by_id(changed)
+    positions = np.searchsorted(columns['id'], changed['id'])
+    positions = np.minimum(positions, max(len(columns['id']) - 1, 0))
+    found = (columns['id'][positions] == changed['id']) if len(columns['id']) else np.zeros(len(changed['id']), bool)
+    merged = {name: np.array(values) for name, values in columns.items()}
+    for name in COLUMNS:
+        merged[name][positions[found]] = changed[name][found]
+    new = {name: values[~found] for name, values in changed.items()}
+    if not len(new['id']):
+        return merged
+    return _sorted_by_id(_concat([merged, new]))
+
+
+class LoanSnapshot:
+    """Снимок, открытый через mmap, и векторные запросы к нему."""
+
+    def __init__(self, columns, built_at):
+        self.columns = columns
+        self.built_at = built_at
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    @property
+    def built_on(self):
+        return datetime.fromtimestamp(self.built_at, dt_timezone.utc)
+
+    @property
+    def max_id(self):
+        return int(self.columns['id'][-1]) if len(self) else 0
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        columns = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in COLUMNS}
+        return cls(columns, meta['built_at'])
+
+    def save(self, root=SNAPSHOT_DIR):
+        """
+        Пишет новое поколение и переключает на него CURRENT; возвращает каталог
+        опубликованного поколения. Если CURRENT уже указывает на более новое,
+        новое не публикуется и возвращается текущее.
+        """
+        with snapshot_lock(root):
+            return self._publish(root)
+
+    def _publish(self, root):
+        """save() под уже взятой блокировкой каталога."""
+        previous = current_generation(root)
+        built_ms = int(self.built_at * 1000)
+        if previous is not None and (_generation_time(previous) or 0) > built_ms \
+                and os.path.isdir(os.path.join(root, previous)):
+            return os.path.join(root, previous)
+
+        path = tempfile.mkdtemp(prefix=f'{built_ms}-', dir=root)
+        for name in COLUMNS:
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(self.columns[name]))
+        with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+            json.dump({'built_at': self.built_at, 'rows': len(self), 'max_id': self.max_id}, meta_file)
+
+        with tempfile.NamedTemporaryFile('w', dir=root, delete=False) as tmp:
+            tmp.write(os.path.basename(path))
+        os.replace(tmp.name, os.path.join(root, 'CURRENT'))
+
+        # Уже открытые mmap остаются доступны и после удаления файлов
+        for name in os.listdir(root):
+            built = _generation_time(name)
+            if built is not None and built < built_ms and name != previous \
+                    and os.path.isdir(os.path.join(root, name)):
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        return path
+
+    @classmethod
+    def build(cls, since=None):
+        """Снимок всех займов; since — только взятых не раньше since (разовый расчёт, не для публикации)."""
+        started = time.time()
+        querysets = [Loan.objects.all()]
+        if since is None or needs_archive(since):
+            querysets.append(ArchivedLoan.objects.all())
+        if since is not None:
+            querysets = [queryset.filter(borrowed_date__gte=since) for queryset in querysets]
+        columns = _concat([read_columns(queryset) for queryset in querysets])
+        return cls(_sorted_by_id(columns), started)
+
+    def refreshed(self):
+        """Новый снимок с новыми и изменившимися займами."""
+        started = time.time()
+        if not len(self):
+            return self.build()
+        max_id = self.max_id
+        returned_since = datetime.fromtimestamp(self.built_at, dt_timezone.utc) - RETURN_SLACK
+        changed = _concat([
+            read_columns(Loan.objects.filter(id__gt=max_id)),
+            read_columns(ArchivedLoan.objects.filter(id__gt=max_id)),
+            read_columns(Loan.objects.filter(id__lte=max_id, returned_date__isnull=True)),
+            read_columns(Loan.objects.filter(id__lte=max_id, returned_date__gte=returned_since)),
+        ])
+        return LoanSnapshot(_upsert(self.columns, changed), started)
+
+    def _open_mask(self):
+        return self.columns['returned'] == NOT_RETURNED
+
+    def counts(self, now):
+        """Итоги для дашборда: всего, на руках, просрочено, возвращено."""
+        now = int(now.timestamp())
+        is_open = self._open_mask()
+        open_count = int(np.count_nonzero(is_open))
+        return {
+            'total_loans': len(self),
+            'loans_out': open_count,
+            'overdue_loans': int(np.count_nonzero(is_open & (self.columns['due'] < now))),
+            'returned_loans': len(self) - open_count,
+        }
+
+    def period_stats(self, start, now):
+        """Выдачи, возвраты, продления и просрочки для займов периода start..now (start=None — за всё время)."""
+        start, now = int(start.timestamp()) if start else 0, int(now.timestamp())
+        borrowed = self.columns['borrowed']
+        # Дальше работаем только со строками периода
+        rows = np.flatnonzero((borrowed >= start) & (borrowed <= now))
+        returned = self.columns['returned'][rows]
+        due = self.columns['due'][rows]
+        is_open = returned == NOT_RETURNED
+        all_returned = self.columns['returned']
+        return {
+            'loans': len(rows),
+            'returns': int(np.count_nonzero((all_returned >= start) & (all_returned <= now))),
+            'still_out': int(np.count_nonzero(is_open)),
+            'overdue': int(np.count_nonzero(is_open & (due < now))),
+            'returned_late': int(np.count_nonzero(~is_open & (returned > due))),
+            'renewals': int(self.columns['renewals'][rows].sum(dtype=np.int64)),
+        }
+
+    def _top(self, ids, limit):
+        if not len(ids):
+            return []
+        counts = np.bincount(ids)
+        limit = min(limit, np.count_nonzero(counts))
+        top = np.argpartition(counts, -limit)[-limit:]
+        # По убыванию числа займов, при равенстве — по id
+        top = top[np.lexsort((top, -counts[top]))]
+        return [(int(key), int(counts[key])) for key in top]
+
+    def top_books(self, start=None, limit=20):
+        """[(book_id, выдач)] по займам с borrowed >= start (None — за всё время)."""
+        book_ids = self.columns['book_id']
+        if start is not None:
+            book_ids = book_ids[self.columns['borrowed'] >= int(start.timestamp())]
+        return self._top(book_ids, limit)
+
+    def top_readers(self, start=None, limit=50):
+        """[(user_id, займов)] по займам с borrowed >= start."""
+        user_ids = self.columns['user_id']
+        if start is not None:
+            user_ids = user_ids[self.columns['borrowed'] >= int(start.timestamp())]
+        return self._top(user_ids, limit)
+
+    def loans_since(self, start):
+        """Проекция займов с borrowed >= start в формате reports.analytics.load_loans."""
+        selected = self.columns['borrowed'] >= int(start.timestamp())
+        returned = self.columns['returned'][selected].astype('datetime64[s]')
+        returned[self.columns['returned'][selected] == NOT_RETURNED] = np.datetime64('NaT')
+        return {
+            'user_id': self.columns['user_id'][selected].astype(np.int64),
+            'borrowed_date': self.columns['borrowed'][selected].astype('datetime64[s]').astype('datetime64[us]'),
+            'due_date': self.columns['due'][selected].astype('datetime64[s]').astype('datetime64[us]'),
+            'returned_date': returned.astype('datetime64[us]'),
+        }
+
+
+class SnapshotStore:
+    """Текущий снимок воркера: переоткрывается, когда CURRENT указывает на новое поколение."""
+
+    def __init__(self, root=SNAPSHOT_DIR, max_age=MAX_AGE):
+        self.root = root
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._generation = None
+        self._refreshing = None
+
+    def _open_current(self):
+        """Открывает поколение из CURRENT; False — за OPEN_ATTEMPTS попыток открыть не удалось."""
+        for _ in range(OPEN_ATTEMPTS):
+            generation = current_generation(self.root)
+            if generation is None or generation == self._generation:
+                return True
+            try:
+                self._snapshot = LoanSnapshot.open(os.path.join(self.root, generation))
+                self._generation = generation
+                return True
+            except FileNotFoundError:
+                # Поколение только что заменили — перечитываем CURRENT
+                continue
+        return False
+
+    def refresh(self, rebuild=False, blocking=True):
+        """
+        Строит (или дописывает) снимок, сохраняет новое поколение и открывает
+        его. blocking=False — не ждать, если снимок обновляет другой процесс
+        (тогда возвращается None).
+        """
+        with snapshot_lock(self.root, blocking) as locked:
+            if not locked:
+                return None
+            current = None if rebuild else self.get(refresh=False)
+            snapshot = LoanSnapshot.build() if current is None else current.refreshed()
+            path = snapshot._publish(self.root)
+            with self._lock:
+                self._snapshot = LoanSnapshot.open(path)
+                self._generation = os.path.basename(path)
+                return self._snapshot
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh(blocking=False)
+        finally:
+            connection.close()
+
+    def get(self, refresh=True):
+        """Снимок не старше max_age (плюс время фонового обновления); при отсутствии строится."""
+        with self._lock:
+            opened = self._open_current()
+            snapshot = self._snapshot
+            if opened and snapshot is not None and refresh \
+                    and time.time() - snapshot.built_at > self.max_age \
+                    and (self._refreshing is None or not self._refreshing.is_alive()):
+                self._refreshing = threading.Thread(
+                    target=self._refresh_in_background, name='loan-snapshot-refresh', daemon=True
+                )
+                self._refreshing.start()
+        if not refresh or (opened and snapshot is not None):
+            return snapshot if opened else None
+        if not opened:
+            # CURRENT указывает на удалённый каталог — пересобираем и публикуем заново
+            return self.refresh(rebuild=True)
+        # Снимка ещё нет: строим сами; если строит другой процесс — считаем в памяти, не сохраняя
+        return self.refresh(blocking=False) or LoanSnapshot.build()
+
+
+loan_snapshot = SnapshotStore()
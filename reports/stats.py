@@ -0,0 +1,102 @@
+"""
+Сводная статистика выдачи для all_loans, дашборда отчётов и /dashboard/.
+
+Каждая таблица читается одним запросом с условной агрегацией, результат
+кэшируется на STATS_CACHE_TIMEOUT секунд. Любая запись в книги, займы или
+брони увеличивает номер версии, поэтому после изменений кэш не используется.
+Массовые UPDATE в loans не вызывают сигналов моделей — о них сообщает
+сигнал loans.signals.circulation_changed (подписка в reports.signals).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from accounts.models import User
+from books.models import Book
+from loans.archive import ARCHIVE_AFTER, count_loans
+from loans.models import ArchivedLoan, Loan, Reservation
+
+STATS_CACHE_TIMEOUT = getattr(settings, 'CIRCULATION_STATS_CACHE_TIMEOUT', 30)  # секунд
+VERSION_CACHE_KEY = 'reports:circulation_stats:version'
+RECENT_WINDOW = timedelta(days=7)
+
+
+def _version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        version = 1
+        cache.add(VERSION_CACHE_KEY, version, None)
+    return version
+
+
+def invalidate_circulation_stats():
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 1, None)
+
+
+def schedule_stats_invalidation():
+    """Сбрасывает кэш после фиксации текущей транзакции."""
+    transaction.on_commit(invalidate_circulation_stats)
+
+
+def compute_circulation_stats(now=None):
+    now = now or timezone.now()
+    recent = now - RECENT_WINDOW
+
+    books = Book.objects.aggregate(
+        total_books=Count('id'),
+        total_copies=Sum('total_copies'),
+        available_copies=Sum('available_copies'),
+    )
+    loans = Loan.objects.aggregate(
+        total_loans=Count('id'),
+        active_loans=Count('id', filter=Q(status='active')),
+        overdue_loans=Count('id', filter=Q(status='overdue')),
+        returned_loans=Count('id', filter=Q(status='returned')),
+        recent_loans_7d=Count('id', filter=Q(borrowed_date__gte=recent)),
+        recent_returns_7d=Count('id', filter=Q(returned_date__gte=recent)),
+    )
+    # Архивные займы все возвращены: входят в итоги, но не в выборку горячей таблицы (пагинатор all_loans)
+    archived_loans = ArchivedLoan.objects.count()
+    loans['hot_total_loans'] = loans['total_loans']
+    loans['hot_returned_loans'] = loans['returned_loans']
+    loans['total_loans'] += archived_loans
+    loans['returned_loans'] += archived_loans
+    if RECENT_WINDOW > ARCHIVE_AFTER:
+        # Архив может содержать займы из окна «за последние дни»
+        loans['recent_loans_7d'] = count_loans(recent)
+        loans['recent_returns_7d'] = count_loans(recent, date_field='returned_date')
+    reservations = Reservation.objects.aggregate(
+        pending_reservations=Count('id', filter=Q(status='pending')),
+        available_reservations=Count('id', filter=Q(status='available')),
+    )
+
+    total_copies = books['total_copies'] or 0
+    available_copies = books['available_copies'] or 0
+    return {
+        **books,
+        **loans,
+        **reservations,
+        'total_copies': total_copies,
+        'available_copies': available_copies,
+        'total_users': User.objects.count(),
+        # В выдаче — и активные, и просроченные займы
+        'loans_out': loans['active_loans'] + loans['overdue_loans'],
+        'utilization_rate': round((1 - (available_copies / total_copies)) * 100, 2) if total_copies > 0 else 0,
+        'generated_at': now.isoformat(),
+    }
+
+
+def get_circulation_stats():
+    key = f'reports:circulation_stats:{_version()}'
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_circulation_stats()
+        cache.set(key, stats, STATS_CACHE_TIMEOUT)
+    return stats
@@ -1,3 +1,507 @@
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from accounts.models import User
+from books.models import Author, Book, Genre
+from loans import circulation
+from loans.archive import archive_loans
+from loans.models import Loan
+from loans.sweeper import sweep_overdue_loans
+
+from . import analytics, exports, jobs
+from .models import BookPopularity, CirculationDailyRollup, ExportJob
+from .popularity import PERIODS, SLIDE_CACHE_KEY, rebuild_popularity, record_borrows, slide_windows, top_books
+from .rollups import day_start, get_watermark, period_totals, record_renewal, rollup_days, rollup_pending
+from .snapshot import LoanSnapshot, SnapshotStore, current_generation
+from .stats import compute_circulation_stats, get_circulation_stats
+
+
+def empty_snapshot(built_at):
+    return LoanSnapshot(LoanSnapshot.build().columns, built_at)
+
+
+class SnapshotGenerationTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+
+    def generations(self):
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def test_save_prunes_only_older_generations(self):
+        first = os.path.basename(empty_snapshot(100).save(self.root))
+        second = os.path.basename(empty_snapshot(200).save(self.root))
+        # Поколение, которое другой процесс ещё пишет: новее публикуемого
+        pending = tempfile.mkdtemp(prefix='400000-', dir=self.root)
+        third = os.path.basename(empty_snapshot(300).save(self.root))
+
+        self.assertEqual(current_generation(self.root), third)
+        self.assertNotIn(first, self.generations())
+        # Предыдущее поколение остаётся для процессов, которые уже прочитали CURRENT
+        self.assertIn(second, self.generations())
+        self.assertIn(os.path.basename(pending), self.generations())
+
+    def test_older_snapshot_does_not_replace_current(self):
+        newer = empty_snapshot(300).save(self.root)
+        self.assertEqual(empty_snapshot(200).save(self.root), newer)
+        self.assertEqual(current_generation(self.root), os.path.basename(newer))
+        self.assertEqual(self.generations(), [os.path.basename(newer)])
+
+
+class SnapshotStoreTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        book = Book.objects.create(title='War and Peace', author=author, isbn='9780000000001',
+                                   publication_year=1869, publisher='Russky Vestnik')
+        reader = User.objects.create_user('reader', password='secret')
+        self.loan = Loan.objects.create(user=reader, book=book, due_date=timezone.now() + timedelta(days=14))
+
+    def test_dangling_current_rebuilds(self):
+        with open(os.path.join(self.root, 'CURRENT'), 'w') as pointer:
+            pointer.write('123-gone')
+        store = SnapshotStore(self.root)
+
+        self.assertIsNone(store.get(refresh=False))
+        snapshot = store.get()
+        self.assertEqual(snapshot.max_id, self.loan.pk)
+        self.assertTrue(os.path.isdir(os.path.join(self.root, current_generation(self.root))))
+
+    def test_refresh_picks_up_new_loans(self):
+        store = SnapshotStore(self.root)
+        self.assertEqual(len(store.get()), 1)
+        loan = Loan.objects.create(user=self.loan.user, book=self.loan.book,
+                                   due_date=timezone.now() + timedelta(days=14))
+        self.assertEqual(store.refresh().max_id, loan.pk)
+        # Другой процесс открывает опубликованное поколение
+        self.assertEqual(len(SnapshotStore(self.root).get(refresh=False)), 2)
+
+
+class UserActivitySourceTests(TestCase):
+    """Отчёт активности читает опубликованный снимок и ничего не строит; без снимка — читает базу."""
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.store = SnapshotStore(self.root)
+        patcher = mock.patch.object(analytics, 'loan_snapshot', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        self.book = Book.objects.create(title='War and Peace', author=author, isbn='9780000000001',
+                                        publication_year=1869, publisher='Russky Vestnik')
+        self.reader = User.objects.create_user('reader', password='secret')
+        self.borrow()
+        self.start = timezone.now() - timedelta(days=30)
+
+    def borrow(self):
+        return Loan.objects.create(user=self.reader, book=self.book, due_date=timezone.now() + timedelta(days=14))
+
+    def test_without_snapshot_reads_database(self):
+        loans, built_on = analytics.load_loans(self.start)
+        self.assertEqual(len(loans['user_id']), 1)
+        self.assertLess(abs(built_on - timezone.now()), timedelta(minutes=1))
+        self.assertIsNone(current_generation(self.root))
+
+    def test_stale_snapshot_is_served_without_rebuild(self):
+        snapshot = empty_snapshot(time.time() - 3600)
+        snapshot.save(self.root)
+        self.borrow()
+        generation = current_generation(self.root)
+
+        loans, built_on = analytics.load_loans(self.start)
+        self.assertEqual(len(loans['user_id']), 1)
+        self.assertEqual(built_on, snapshot.built_on)
+        self.assertEqual(current_generation(self.root), generation)
+        self.assertIsNone(self.store._refreshing)
+
+    def test_report_shows_snapshot_time(self):
+        self.store.refresh()
+        manager = User.objects.create_user('manager', password='secret', user_type='management')
+        self.client.force_login(manager)
+        response = self.client.get(reverse('user_activity'))
+        built_on = timezone.localtime(self.store.get(refresh=False).built_on)
+        self.assertEqual(response.context['data_as_of'], self.store.get(refresh=False).built_on)
+        self.assertContains(response, f'Loan data as of {built_on:%Y-%m-%d %H:%M}')
+
+
+class CirculationStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        self.book = Book.objects.create(title='War and Peace', author=author, isbn='9780000000001',
+                                        publication_year=1869, publisher='Russky Vestnik')
+        self.reader = User.objects.create_user('reader', password='secret')
+
+    def test_dashboard_renders_stats_for_staff_only(self):
+        librarian = User.objects.create_user('librarian', password='secret', user_type='librarian')
+        self.client.force_login(librarian)
+        response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, 'Total Books')
+        self.assertEqual(response.context['stats']['total_books'], 1)
+
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Total Books')
+
+    def test_bulk_status_sweep_invalidates_stats(self):
+        Loan.objects.bulk_create([Loan(user=self.reader, book=self.book, status='active',
+                                       due_date=timezone.now() - timedelta(days=1))])
+        self.assertEqual(get_circulation_stats()['overdue_loans'], 0)
+        # UPDATE без сигналов моделей — сводку сбрасывает loans.signals.circulation_changed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(sweep_overdue_loans(), 1)
+        self.assertEqual(get_circulation_stats()['overdue_loans'], 1)
+
+
+    def test_totals_include_archived_loans(self):
+        now = timezone.now()
+        Loan.objects.bulk_create([
+            Loan(user=self.reader, book=self.book, due_date=now - timedelta(days=400),
+                 returned_date=now - timedelta(days=400 + i), status='returned')
+            for i in range(3)
+        ] + [Loan(user=self.reader, book=self.book, due_date=now + timedelta(days=1))])
+        before = compute_circulation_stats()
+        self.assertEqual(archive_loans(), 3)
+        after = compute_circulation_stats()
+        for key in ('total_loans', 'returned_loans', 'active_loans'):
+            self.assertEqual(after[key], before[key])
+        self.assertEqual((after['total_loans'], after['returned_loans']), (4, 3))
+        self.assertEqual((after['hot_total_loans'], after['hot_returned_loans']), (1, 0))
+
+        librarian = User.objects.create_user('librarian', password='secret', user_type='librarian')
+        self.client.force_login(librarian)
+        self.assertEqual(self.client.get(reverse('all_loans')).context['page_obj'].paginator.count, 1)
+
+
+class RollupTests(TestCase):
+    """Ежедневные итоги совпадают с данными, одна строка на разрез, продления не теряются при пересчёте."""
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.genre = Genre.objects.create(name='Novel')
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        self.novel = Book.objects.create(title='War and Peace', author=author, isbn='9780000000001', genre=self.genre,
+                                         publication_year=1869, publisher='Russky Vestnik', total_copies=10)
+        self.other = Book.objects.create(title='Sermons', author=author, isbn='9780000000002',
+                                         publication_year=1870, publisher='Russky Vestnik', total_copies=10)
+        self.reader = User.objects.create_user('reader', password='secret')
+        self.librarian = User.objects.create_user('librarian', password='secret', user_type='librarian')
+        # (книга, читатель, дней назад взят, дней назад возвращён)
+        for book, user, borrowed, returned in (
+            (self.novel, self.reader, 40, 30), (self.novel, self.reader, 6, 2), (self.novel, self.librarian, 5, None),
+            (self.other, self.reader, 3, 1), (self.other, self.librarian, 2, None),
+        ):
+            self.loan(book, user, borrowed, returned)
+
+    def at(self, days_ago):
+        return day_start(self.today - timedelta(days=days_ago)) + timedelta(hours=12)
+
+    def loan(self, book, user, borrowed, returned=None):
+        loan = Loan.objects.create(user=user, book=book, due_date=self.at(borrowed - 14))
+        Loan.objects.filter(pk=loan.pk).update(
+            borrowed_date=self.at(borrowed), returned_date=self.at(returned) if returned is not None else None,
+            status='returned' if returned is not None else 'active'
+        )
+        return loan
+
+    def test_rollup_advances_watermark_and_keeps_totals(self):
+        starts = {'week': self.today - timedelta(days=7), 'all': None}
+        live = period_totals(starts)
+        self.assertEqual((live['all']['loans'], live['all']['returns']), (5, 3))
+        self.assertEqual((live['week']['loans'], live['week']['returns']), (4, 2))
+
+        days, _ = rollup_pending()
+        self.assertEqual(get_watermark(), self.today - timedelta(days=1))
+        self.assertEqual(days, 40)
+        self.assertEqual(rollup_pending(), (0, 0))
+        self.assertEqual(period_totals(starts), live)
+
+        # Сегодняшние займы досчитываются по горячей таблице
+        Loan.objects.create(user=self.reader, book=self.novel, due_date=timezone.now() + timedelta(days=14))
+        totals = period_totals(starts)
+        self.assertEqual((totals['all']['loans'], totals['week']['loans']), (6, 5))
+
+    def test_period_totals_filters(self):
+        rollup_pending()
+        starts = {'all': None}
+        self.assertEqual(period_totals(starts, genre=self.genre)['all']['loans'], 3)
+        self.assertEqual(period_totals(starts, user_type='librarian')['all']['loans'], 2)
+        self.assertEqual(period_totals(starts, genre=self.genre, user_type='reader')['all']['returns'], 2)
+
+    def test_renewals_share_one_row_and_survive_recompute(self):
+        loan = Loan.objects.filter(book=self.novel, returned_date__isnull=True).get()
+        for _ in range(2):
+            record_renewal(loan.pk)
+        record_renewal(Loan.objects.filter(book=self.other, returned_date__isnull=True).get().pk)
+        rows = CirculationDailyRollup.objects.filter(day=self.today, renewals__gt=0)
+        self.assertCountEqual(rows.values_list('genre_id', 'renewals'), [(None, 1), (self.genre.pk, 2)])
+
+        rollup_days(self.today, self.today)
+        self.assertCountEqual(
+            CirculationDailyRollup.objects.filter(day=self.today).values_list('genre_id', 'renewals'),
+            [(None, 1), (self.genre.pk, 2)]
+        )
+        self.assertEqual(period_totals({'all': None})['all']['renewals'], 3)
+
+    def test_one_row_per_day_and_slice(self):
+        for genre in (self.genre, None):
+            CirculationDailyRollup.objects.create(day=self.today, genre=genre, user_type='reader')
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                CirculationDailyRollup.objects.create(day=self.today, genre=genre, user_type='reader')
+
+
+class CirculationAccountingTests(TestCase):
+    """Выдачи и продления доходят до рейтингов и итогов через loans.signals.circulation_changed."""
+
+    def setUp(self):
+        cache.clear()
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        self.book = Book.objects.create(title='War and Peace', author=author, isbn='9780000000001',
+                                        publication_year=1869, publisher='Russky Vestnik', total_copies=3,
+                                        available_copies=3)
+        self.readers = [User.objects.create_user(f'reader-{i}', password='secret') for i in range(3)]
+
+    def test_borrows_and_renewals_are_recorded(self):
+        loan = circulation.borrow_book(self.readers[0], self.book)
+        circulation.batch_checkout([(self.book.isbn, reader.membership_id) for reader in self.readers[1:]])
+        self.assertEqual(BookPopularity.objects.get(book=self.book).week, 3)
+
+        circulation.renew_loan(loan)
+        self.assertEqual(
+            CirculationDailyRollup.objects.filter(day=timezone.localdate()).values_list('renewals', flat=True).get(), 1
+        )
+
+    def test_failed_renewal_records_nothing(self):
+        loan = circulation.borrow_book(self.readers[0], self.book)
+        Loan.objects.filter(pk=loan.pk).update(renewals=F('max_renewals'))
+        with self.assertRaises(circulation.CirculationError):
+            circulation.renew_loan(loan)
+        self.assertFalse(CirculationDailyRollup.objects.exists())
+
+
+class EnqueueExportTests(TestCase):
+    def test_conflicting_job_finished_before_lookup(self):
+        key = jobs.job_dedup_key('books', 'xlsx', False, {})
+        other = ExportJob.objects.create(dataset='books', export_format='xlsx', dedup_key=key)
+        lookup = jobs._reusable_job
+        calls = []
+
+        def racing_lookup(key):
+            calls.append(key)
+            if len(calls) == 1:
+                # Другой запрос ещё не зафиксировал свою задачу
+                return None
+            # ... а к повторной проверке она уже выполнена
+            ExportJob.objects.filter(pk=other.pk).update(status='done', finished_at=timezone.now())
+            return lookup(key)
+
+        with mock.patch.object(jobs, '_reusable_job', side_effect=racing_lookup):
+            job = jobs.enqueue_export('books')
+        self.assertEqual(job.pk, other.pk)
+        self.assertEqual(len(calls), 2)
+
+    def test_new_job_after_conflicting_job_failed(self):
+        key = jobs.job_dedup_key('books', 'xlsx', False, {})
+        other = ExportJob.objects.create(dataset='books', export_format='xlsx', dedup_key=key)
+        lookup = jobs._reusable_job
+        calls = []
+
+        def racing_lookup(key):
+            calls.append(key)
+            if len(calls) == 1:
+                return None
+            ExportJob.objects.filter(pk=other.pk).update(status='failed', finished_at=timezone.now())
+            return lookup(key)
+
+        with mock.patch.object(jobs, '_reusable_job', side_effect=racing_lookup):
+            job = jobs.enqueue_export('books')
+        self.assertNotEqual(job.pk, other.pk)
+        self.assertEqual(job.status, 'pending')
+
+
+class DatasetExportTests(TestCase):
+    """Потоковые CSV и JSON Lines выгрузки: строки, gzip и фильтры инкрементальной выгрузки."""
+
+    def setUp(self):
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        self.books = [
+            Book.objects.create(title=title, author=author, isbn=f'978000000000{i}', publication_year=1869,
+                                publisher='Russky Vestnik')
+            for i, title in enumerate(('War and Peace', 'Anna Karenina, vol. 1', 'Resurrection'))
+        ]
+        self.manager = User.objects.create_user('manager', password='secret', user_type='management')
+        self.client.force_login(self.manager)
+
+    def export(self, name='books', **params):
+        return self.client.get(reverse(f'export_{name}_excel'), params)
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_csv_rows(self):
+        with mock.patch.object(exports, 'FLUSH_ROWS', 2):
+            response = self.export(format='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('filename="books.csv"', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(self.content(response).decode())))
+        self.assertEqual(rows[0], exports.dataset_columns('books'))
+        self.assertEqual([row[1] for row in rows[1:]], [book.title for book in self.books])
+        self.assertEqual(rows[1][rows[0].index('genre_id')], '')
+        self.assertEqual(rows[1][rows[0].index('created_at')], self.books[0].created_at.isoformat())
+
+    def test_jsonl_rows(self):
+        response = self.export(format='jsonl')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in self.content(response).decode().splitlines()]
+        self.assertEqual([line['id'] for line in lines], [book.pk for book in self.books])
+        self.assertEqual(lines[0]['author_last_name'], 'Tolstoy')
+        self.assertIsNone(lines[0]['genre_name'])
+
+    def test_gzip(self):
+        plain = self.content(self.export(format='jsonl'))
+        response = self.export(format='jsonl', gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('filename="books.jsonl.gz"', response['Content-Disposition'])
+        self.assertEqual(gzip.decompress(self.content(response)), plain)
+
+    def ids(self, name='books', **params):
+        response = self.export(name, format='jsonl', **params)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line)['id'] for line in self.content(response).decode().splitlines()]
+
+    def test_id_range(self):
+        first, second, third = (book.pk for book in self.books)
+        self.assertEqual(self.ids(min_id=second), [second, third])
+        self.assertEqual(self.ids(max_id=second), [first, second])
+        self.assertEqual(self.ids(min_id=second, max_id=second), [second])
+
+    def test_updated_since(self):
+        now = timezone.now()
+        Book.objects.filter(pk=self.books[0].pk).update(updated_at=now - timedelta(days=10))
+        Book.objects.filter(pk=self.books[1].pk).update(updated_at=now - timedelta(days=3))
+        since = (timezone.localdate() - timedelta(days=5)).isoformat()
+        self.assertEqual(self.ids(updated_since=since), [self.books[1].pk, self.books[2].pk])
+        self.assertEqual(self.ids(updated_since=(now - timedelta(hours=1)).isoformat()), [self.books[2].pk])
+
+        # Займы отбираются по дате выдачи или возврата
+        reader = User.objects.create_user('reader', password='secret')
+        old = Loan.objects.create(user=reader, book=self.books[0], due_date=now)
+        returned = Loan.objects.create(user=reader, book=self.books[1], due_date=now, returned_date=now)
+        Loan.objects.filter(pk__in=[old.pk, returned.pk]).update(borrowed_date=now - timedelta(days=30))
+        self.assertEqual(self.ids('loans', updated_since=since), [returned.pk])
+
+    def test_xlsx_rows_and_widths(self):
+        response = self.export()
+        self.assertEqual(response['Content-Type'], exports.XLSX_CONTENT_TYPE)
+        sheet = load_workbook(io.BytesIO(self.content(response)), read_only=True)['Books']
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(rows[0], exports.BOOK_HEADERS)
+        self.assertEqual([row[0] for row in rows[1:]], [book.title for book in self.books])
+        self.assertEqual(rows[1][1:4], ('Leo', 'Tolstoy', '9780000000000'))
+
+    def test_xlsx_widths_from_sample(self):
+        stream = io.BytesIO()
+        rows = iter([['short', 1], ['a much longer value', 2], ['x' * 200, 3]])
+        self.assertEqual(exports.write_xlsx(stream, 'Sheet', ('name', 'n'), rows, sample_size=2), 3)
+        sheet = load_workbook(stream)['Sheet']
+        # Ширина — по первым sample_size строкам: длинная строка после образца её не меняет
+        self.assertEqual(sheet.column_dimensions['A'].width, len('a much longer value') + 2)
+        self.assertEqual(sheet.cell(row=4, column=1).value, 'x' * 200)
+        self.assertEqual(exports.column_widths(('name',), [['x' * 200]]), [exports.MAX_COLUMN_WIDTH])
+
+    def test_bad_format_and_filters(self):
+        for params in ({'format': 'xml'}, {'format': 'csv', 'updated_since': 'yesterday'},
+                       {'format': 'csv', 'min_id': '-1'}, {'format': 'jsonl', 'max_id': 'ten'}):
+            response = self.export(**params)
+            self.assertEqual(response.status_code, 400, params)
+        self.assertContains(self.export(format='csv', min_id='x'), 'Invalid min_id', status_code=400)
+
+
+class PopularityTests(TestCase):
+    """Окна популярности: сдвиг убирает старые выдачи, топ совпадает с полным пересчётом."""
+
+    def setUp(self):
+        cache.clear()
+        self.today = timezone.localdate()
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        self.books = [
+            Book.objects.create(title=f'Book {i}', author=author, isbn=f'978000000000{i}', publication_year=1869,
+                                publisher='Russky Vestnik', total_copies=10, available_copies=10)
+            for i in range(4)
+        ]
+        self.reader = User.objects.create_user('reader', password='secret')
+        # (книга, дней назад, выдач): старые выдачи лидируют за год, свежие — за неделю
+        for book, days_ago, count in ((0, 20, 5), (0, 200, 2), (1, 2, 3), (1, 40, 1), (2, 0, 2), (3, 400, 9)):
+            for _ in range(count):
+                self.borrow(self.books[book], days_ago)
+
+    def borrow(self, book, days_ago):
+        # Выдача в прошлом: заём с этой датой и её учёт в тот день
+        moment = day_start(self.today - timedelta(days=days_ago)) + timedelta(minutes=1)
+        loan = Loan.objects.create(user=self.reader, book=book, due_date=moment + timedelta(days=14))
+        Loan.objects.filter(pk=loan.pk).update(borrowed_date=moment)
+        record_borrows([book.pk], now=moment)
+
+    def ranking(self, period):
+        return [(book.pk, book.loan_count) for book in top_books(period)]
+
+    def test_slide_drops_old_borrows(self):
+        # До сдвига выдачи из прошлого учтены во всех окнах
+        self.assertEqual(BookPopularity.objects.get(book=self.books[3]).week, 9)
+        slide_windows(self.today, lookback=500)
+        window = BookPopularity.objects.get(book=self.books[0])
+        self.assertEqual((window.week, window.month, window.year, window.all_time), (0, 5, 7, 7))
+        self.assertEqual(self.ranking('week'), [(self.books[1].pk, 3), (self.books[2].pk, 2)])
+        self.assertEqual(self.ranking('all_time')[0], (self.books[3].pk, 9))
+
+    def test_top_books_match_rebuild(self):
+        slide_windows(self.today, lookback=500)
+        cache.set(SLIDE_CACHE_KEY, self.today)
+        incremental = {period: self.ranking(period) for period in PERIODS}
+        self.assertEqual(rebuild_popularity(self.today), 4)
+        self.assertEqual({period: self.ranking(period) for period in PERIODS}, incremental)
+        self.assertEqual(incremental['month'], [
+            (self.books[0].pk, 5), (self.books[1].pk, 3), (self.books[2].pk, 2),
+        ])
+
+    def test_daily_slides_match_rebuild(self):
+        # Ежедневные сдвиги с обычным lookback дают те же окна, что и пересчёт в тот же день
+        rebuild_popularity(self.today)
+        day = self.today
+        for _ in range(40):
+            day += timedelta(days=1)
+            slide_windows(day)
+        windows = list(BookPopularity.objects.order_by('book').values_list('book', *PERIODS))
+        rebuild_popularity(day)
+        self.assertEqual(list(BookPopularity.objects.order_by('book').values_list('book', *PERIODS)), windows)
+        self.assertEqual(windows[0], (self.books[0].pk, 0, 0, 7, 7))
 
-# Create your tests here.
+    def test_trending_api(self):
+        slide_windows(self.today, lookback=500)
+        cache.set(SLIDE_CACHE_KEY, self.today)
+        response = self.client.get('/api/books/trending/', {'period': 'week', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(book['id'], book['loan_count']) for book in response.json()], [(self.books[1].pk, 3)])
+        # Неизвестный период — за всё время, limit ограничен
+        response = self.client.get('/api/books/trending/', {'period': 'decade', 'limit': 'many'})
+        self.assertEqual([book['id'] for book in response.json()][:1], [self.books[3].pk])
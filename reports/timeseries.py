@@ -0,0 +1,133 @@
+"""
+Временные ряды выдачи для графиков отчётов.
+
+Выдачи (borrowed_date) и возвраты (returned_date) группируются в базе одним
+запросом на таблицу: TruncDay/TruncWeek/TruncMonth по дням, неделям, месяцам
+или ExtractIsoWeekDay + ExtractHour для тепловой карты «день недели × час».
+Пропущенные корзины заполняются нулями на сервере, ответ — компактные
+массивы.
+
+Закрытые корзины (до начала текущей) не меняются: дата выдачи и возврата —
+момент операции. Они кэшируются на CLOSED_CACHE_TIMEOUT под ключом, в
+который входит начало текущей корзины; при каждом запросе пересчитывается
+только текущая корзина. Для тепловой карты текущей корзиной считается
+сегодняшний день.
+"""
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DateField
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay, TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from loans.archive import needs_archive
+from loans.models import ArchivedLoan, Loan
+
+METRICS = {'borrows': 'borrowed_date', 'returns': 'returned_date'}
+GRANULARITIES = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth, 'hour': None}
+DEFAULT_DAYS = {'day': 30, 'week': 182, 'month': 365, 'hour': 90}
+MAX_DAYS = {'day': 366, 'week': 731, 'month': 1827, 'hour': 366}
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+CLOSED_CACHE_TIMEOUT = getattr(settings, 'TIMESERIES_CACHE_TIMEOUT', 86400)
+CACHE_KEY = 'reports:timeseries:{metric}:{granularity}:{days}:{genre}:{user_type}:{open_bucket}'
+
+
+def bucket_start(day, granularity):
+    """Начало корзины, в которую попадает дата day."""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(day, granularity):
+    if granularity == 'week':
+        return day + timedelta(days=7)
+    if granularity == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def _aware(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _bucket_counts(metric, granularity, start, end, filters):
+    """Counter {корзина: количество} для date_field в [start, end); end=None — до текущего момента."""
+    field = METRICS[metric]
+    lookups = {f'{field}__gte': start, **filters}
+    if end is not None:
+        lookups[f'{field}__lt'] = end
+    models = [Loan]
+    if needs_archive(start, field):
+        models.append(ArchivedLoan)
+
+    counts = Counter()
+    for model in models:
+        queryset = model.objects.filter(**lookups).order_by()
+        if granularity == 'hour':
+            rows = queryset.annotate(
+                weekday=ExtractIsoWeekDay(field), hour=ExtractHour(field)
+            ).values_list('weekday', 'hour').annotate(count=Count('id'))
+            for weekday, hour, count in rows:
+                counts[(weekday, hour)] += count
+        else:
+            trunc = GRANULARITIES[granularity]
+            rows = queryset.annotate(
+                bucket=trunc(field, output_field=DateField())
+            ).values_list('bucket').annotate(count=Count('id'))
+            for bucket, count in rows:
+                counts[bucket] += count
+    return counts
+
+
+def get_series(metric, granularity, days, genre_id=None, user_type='', now=None):
+    """Counter по корзинам: закрытые из кэша, текущая — свежим запросом."""
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    first = bucket_start(today - timedelta(days=days - 1), granularity)
+    open_bucket = today if granularity == 'hour' else bucket_start(today, granularity)
+
+    filters = {}
+    if genre_id:
+        filters['book__genre_id'] = genre_id
+    if user_type:
+        filters['user__user_type'] = user_type
+
+    key = CACHE_KEY.format(
+        metric=metric, granularity=granularity, days=days, genre=genre_id or '-',
+        user_type=user_type or '-', open_bucket=open_bucket.isoformat()
+    )
+    closed = cache.get(key)
+    if closed is None:
+        closed = _bucket_counts(metric, granularity, _aware(first), _aware(open_bucket), filters)
+        cache.set(key, closed, CLOSED_CACHE_TIMEOUT)
+    return first, open_bucket, closed + _bucket_counts(metric, granularity, _aware(open_bucket), None, filters)
+
+
+def build_timeseries(metrics, granularity, days, genre_id=None, user_type='', now=None):
+    """JSON-совместимый словарь: подписи корзин и по массиву значений на метрику."""
+    series = {}
+    labels = []
+    for metric in metrics:
+        first, open_bucket, counts = get_series(metric, granularity, days, genre_id, user_type, now)
+        if granularity == 'hour':
+            series[metric] = [[counts[(weekday, hour)] for hour in range(24)] for weekday in range(1, 8)]
+            continue
+        buckets = []
+        bucket = first
+        while bucket <= open_bucket:
+            buckets.append(bucket)
+            bucket = next_bucket(bucket, granularity)
+        labels = [bucket.isoformat() for bucket in buckets]
+        series[metric] = [counts[bucket] for bucket in buckets]
+
+    result = {'granularity': granularity, 'days': days, 'series': series}
+    if granularity == 'hour':
+        result.update(rows=list(WEEKDAYS), columns=list(range(24)))
+    else:
+        result['labels'] = labels
+    return result
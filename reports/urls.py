@@ -3,11 +3,19 @@ from . import views
 
 urlpatterns = [
     path('', views.reports_dashboard, name='reports_dashboard'),
+    path('stats/', views.circulation_stats_api, name='circulation_stats_api'),
+    path('snapshot/', views.loan_snapshot_api, name='loan_snapshot_api'),
+    path('timeseries/', views.timeseries_report, name='timeseries_report'),
+    path('api/timeseries/', views.timeseries_api, name='timeseries_api'),
     path('popular-books/', views.popular_books_report, name='popular_books'),
     path('user-activity/', views.user_activity_report, name='user_activity'),
     path('loan-statistics/', views.loan_statistics_report, name='loan_statistics'),
     path('export/books/', views.export_books_excel, name='export_books_excel'),
     path('export/loans/', views.export_loans_excel, name='export_loans_excel'),
     path('export/users/', views.export_users_excel, name='export_users_excel'),
+    path('export/reservations/', views.export_reservations_excel, name='export_reservations_excel'),
     path('export/', views.export_data, name='export_data'),
+    path('export/jobs/', views.export_job_create, name='export_job_create'),
+    path('export/jobs/<int:job_id>/', views.export_job_status, name='export_job_status'),
+    path('export/jobs/<int:job_id>/download/', views.export_job_download, name='export_job_download'),
 ]
\ No newline at end of file
@@ -1,12 +1,23 @@
-import pandas as pd
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import HttpResponse
-from django.db.models import Count, Sum, Q, Avg
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse
+from django.db.models import Count, Q, Avg
+from django.urls import reverse
 from django.utils import timezone
+from django.views.decorators.http import require_POST
 from datetime import timedelta
-from books.models import Book
-from loans.models import Loan, Reservation
+from books.models import Book, Genre
+from loans.models import Loan
+from loans.archive import count_loans
+from loans.sweeper import ensure_loan_statuses_fresh
+from . import exports, timeseries
+from .analytics import get_user_activity
+from .jobs import enqueue_export
+from .models import ExportJob
+from .popularity import top_books
+from .rollups import day_start, get_watermark, period_totals
+from .snapshot import loan_snapshot
+from .stats import get_circulation_stats
 from accounts.models import User
 
 
@@ -17,70 +28,116 @@ def is_management(user):
 @login_required
 @user_passes_test(is_management)
 def reports_dashboard(request):
-    # Basic statistics
-    total_books = Book.objects.count()
-    total_copies = Book.objects.aggregate(total=Sum('total_copies'))['total'] or 0
-    available_copies = Book.objects.aggregate(available=Sum('available_copies'))['available'] or 0
-    total_users = User.objects.count()
-    active_loans = Loan.objects.filter(returned_date__isnull=True).count()
-    overdue_loans = Loan.objects.filter(
-        returned_date__isnull=True,
-        due_date__lt=timezone.now()
-    ).count()
-    pending_reservations = Reservation.objects.filter(status='pending').count()
-
-    # Recent activity (last 7 days)
-    week_ago = timezone.now() - timedelta(days=7)
-    recent_loans = Loan.objects.filter(borrowed_date__gte=week_ago).count()
-    recent_returns = Loan.objects.filter(returned_date__gte=week_ago).count()
+    ensure_loan_statuses_fresh()
+    stats = get_circulation_stats()
 
     context = {
-        'total_books': total_books,
-        'total_copies': total_copies,
-        'available_copies': available_copies,
-        'total_users': total_users,
-        'active_loans': active_loans,
-        'overdue_loans': overdue_loans,
-        'pending_reservations': pending_reservations,
-        'recent_loans_7d': recent_loans,
-        'recent_returns_7d': recent_returns,
-        'utilization_rate': round((1 - (available_copies / total_copies)) * 100, 2) if total_copies > 0 else 0
+        'total_books': stats['total_books'],
+        'total_copies': stats['total_copies'],
+        'available_copies': stats['available_copies'],
+        'total_users': stats['total_users'],
+        'active_loans': stats['loans_out'],
+        'overdue_loans': stats['overdue_loans'],
+        'pending_reservations': stats['pending_reservations'],
+        'recent_loans_7d': stats['recent_loans_7d'],
+        'recent_returns_7d': stats['recent_returns_7d'],
+        'utilization_rate': stats['utilization_rate']
     }
 
     return render(request, 'reports/reports.html', context)
 
 
+@login_required
+def dashboard(request):
+    # Сводка считается только для ролей, которым она доступна; остальным карточки не показываются
+    stats = None
+    if is_management(request.user):
+        ensure_loan_statuses_fresh()
+        stats = get_circulation_stats()
+    return render(request, 'dashboard.html', {'stats': stats})
+
+
 @login_required
 @user_passes_test(is_management)
-def popular_books_report(request):
-    time_period = request.GET.get('period', 'all')
+def circulation_stats_api(request):
+    ensure_loan_statuses_fresh()
+    return JsonResponse(get_circulation_stats())
+
+
+@login_required
+@user_passes_test(is_management)
+def loan_snapshot_api(request):
+    # Считается по колоночному снимку займов в памяти (reports.snapshot), без запросов к Loan
+    days = {'week': 7, 'month': 30, 'year': 365}
+    period = request.GET.get('period', 'month')
+    if period not in days and period != 'all':
+        return HttpResponseBadRequest('Unknown period')
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid limit')
+
     now = timezone.now()
+    start = now - timedelta(days=days[period]) if period in days else None
+    snapshot = loan_snapshot.get()
+    books = snapshot.top_books(start, limit)
+    readers = snapshot.top_readers(start, limit)
+    titles = dict(Book.objects.filter(pk__in=[book_id for book_id, _ in books]).values_list('id', 'title'))
+    usernames = dict(User.objects.filter(pk__in=[user_id for user_id, _ in readers]).values_list('id', 'username'))
+
+    return JsonResponse({
+        'period': period,
+        'built_at': snapshot.built_on,
+        'counts': snapshot.counts(now),
+        'period_stats': snapshot.period_stats(start, now),
+        'top_books': [
+            {'id': book_id, 'title': titles.get(book_id, ''), 'loans': count} for book_id, count in books
+        ],
+        'top_readers': [
+            {'id': user_id, 'username': usernames.get(user_id, ''), 'loans': count} for user_id, count in readers
+        ],
+    })
+
+
+@login_required
+@user_passes_test(is_management)
+def timeseries_api(request):
+    granularity = request.GET.get('granularity', 'day')
+    if granularity not in timeseries.GRANULARITIES:
+        return HttpResponseBadRequest('Unknown granularity')
+    metrics = [metric for metric in request.GET.get('metric', 'borrows,returns').split(',') if metric]
+    if not metrics or any(metric not in timeseries.METRICS for metric in metrics):
+        return HttpResponseBadRequest('Unknown metric')
+    try:
+        days = int(request.GET.get('days', timeseries.DEFAULT_DAYS[granularity]))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid days')
+    days = min(max(days, 1), timeseries.MAX_DAYS[granularity])
+
+    genre_id = request.GET.get('genre', '')
+    genre_id = int(genre_id) if genre_id.isdigit() else None
+    user_type = request.GET.get('user_type', '')
+    if user_type and user_type not in dict(User.USER_TYPES):
+        return HttpResponseBadRequest('Unknown user type')
+
+    return JsonResponse(timeseries.build_timeseries(metrics, granularity, days, genre_id, user_type))
+
+
+@login_required
+@user_passes_test(is_management)
+def timeseries_report(request):
+    return render(request, 'reports/timeseries.html', {
+        'genres': Genre.objects.order_by('name'),
+        'user_types': User.USER_TYPES,
+        'default_days': timeseries.DEFAULT_DAYS,
+    })
 
-    if time_period == 'year':
-        start_date = now - timedelta(days=365)
-        popular_books = Book.objects.filter(
-            loans__borrowed_date__gte=start_date
-        ).annotate(
-            loan_count=Count('loans')
-        ).order_by('-loan_count')[:20]
-    elif time_period == 'month':
-        start_date = now - timedelta(days=30)
-        popular_books = Book.objects.filter(
-            loans__borrowed_date__gte=start_date
-        ).annotate(
-            loan_count=Count('loans')
-        ).order_by('-loan_count')[:20]
-    elif time_period == 'week':
-        start_date = now - timedelta(days=7)
-        popular_books = Book.objects.filter(
-            loans__borrowed_date__gte=start_date
-        ).annotate(
-            loan_count=Count('loans')
-        ).order_by('-loan_count')[:20]
-    else:
-        popular_books = Book.objects.annotate(
-            loan_count=Count('loans')
-        ).order_by('-loan_count')[:20]
+
+@login_required
+@user_passes_test(is_management)
+def popular_books_report(request):
+    time_period = request.GET.get('period', 'all')
+    popular_books = top_books('all_time' if time_period == 'all' else time_period, limit=20)
 
     return render(request, 'reports/popular_books.html', {
         'popular_books': popular_books,
@@ -101,22 +158,23 @@ def user_activity_report(request):
     elif time_period == 'week':
         start_date = now - timedelta(days=7)
     else:
+        time_period = 'month'
         start_date = now - timedelta(days=30)
 
-    active_users = User.objects.filter(
-        loans__borrowed_date__gte=start_date
-    ).annotate(
-        loan_count=Count('loans'),
-        active_loans=Count('loans', filter=Q(loans__returned_date__isnull=True)),
-        overdue_loans=Count('loans', filter=Q(loans__returned_date__isnull=True, loans__due_date__lt=now))
-    ).order_by('-loan_count')[:50]
+    # Считается векторно по узкой проекции займов и кэшируется (reports.analytics)
+    activity = get_user_activity(time_period, start_date)
 
     # Recent activity statistics
-    recent_loans = Loan.objects.filter(borrowed_date__gte=start_date).count()
-    recent_returns = Loan.objects.filter(returned_date__gte=start_date).count()
+    recent_loans = activity['loans']
+    recent_returns = count_loans(start_date, date_field='returned_date')
 
     return render(request, 'reports/user_activity.html', {
-        'active_users': active_users,
+        'active_users': activity['top_users'],
+        'by_user_type': activity['by_user_type'],
+        'by_signup_month': activity['by_signup_month'],
+        'readers': activity['readers'],
+        'generated_at': activity['generated_at'],
+        'data_as_of': activity['data_as_of'],
         'recent_loans': recent_loans,
         'recent_returns': recent_returns,
         'period': time_period
@@ -126,205 +184,152 @@ def user_activity_report(request):
 @login_required
 @user_passes_test(is_management)
 def loan_statistics_report(request):
-    # Loan statistics for different periods
-    now = timezone.now()
-
+    # Периоды считаются целыми днями по ежедневным итогам (reports.rollups)
+    today = timezone.localdate()
     periods = {
-        'week': now - timedelta(days=7),
-        'month': now - timedelta(days=30),
-        'year': now - timedelta(days=365),
+        'week': today - timedelta(days=7),
+        'month': today - timedelta(days=30),
+        'year': today - timedelta(days=365),
         'all': None
     }
 
-    stats = {}
-    for period_name, start_date in periods.items():
-        loans_query = Loan.objects.all()
-        if start_date:
-            loans_query = loans_query.filter(borrowed_date__gte=start_date)
+    genre_id = request.GET.get('genre', '')
+    genre = Genre.objects.filter(pk=genre_id).first() if genre_id.isdigit() else None
+    user_type = request.GET.get('user_type', '')
+    if user_type not in dict(User.USER_TYPES):
+        user_type = ''
+
+    totals = period_totals(periods, genre=genre, user_type=user_type)
+
+    # Невозвращённые займы есть только в горячей таблице: один запрос по индексу статуса
+    ensure_loan_statuses_fresh()
+    outstanding = Loan.objects.filter(status__in=['active', 'overdue'])
+    if genre is not None:
+        outstanding = outstanding.filter(book__genre=genre)
+    if user_type:
+        outstanding = outstanding.filter(user__user_type=user_type)
+    aggregates = {}
+    for period_name, first_day in periods.items():
+        since = Q(borrowed_date__gte=day_start(first_day)) if first_day else Q()
+        aggregates[f'{period_name}_active'] = Count('id', filter=since or None)
+        aggregates[f'{period_name}_overdue'] = Count('id', filter=since & Q(status='overdue'))
+    outstanding = outstanding.aggregate(**aggregates)
 
+    stats = {}
+    for period_name in periods:
+        period = totals[period_name]
+        active_loans = outstanding[f'{period_name}_active']
         stats[period_name] = {
-            'total_loans': loans_query.count(),
-            'active_loans': loans_query.filter(returned_date__isnull=True).count(),
-            'overdue_loans': loans_query.filter(returned_date__isnull=True, due_date__lt=now).count(),
-            'returned_loans': loans_query.filter(returned_date__isnull=False).count(),
+            'total_loans': period['loans'],
+            'active_loans': active_loans,
+            'overdue_loans': outstanding[f'{period_name}_overdue'],
+            'returned_loans': max(0, period['loans'] - active_loans),
+            'renewals': period['renewals'],
+            'new_overdues': period['new_overdues'],
+            'reservations': period['reservations'],
         }
 
     return render(request, 'reports/loan_statistics.html', {
         'stats': stats,
-        'periods': list(periods.keys())
+        'periods': list(periods.keys()),
+        'genres': Genre.objects.order_by('name'),
+        'user_types': User.USER_TYPES,
+        'selected_genre': genre,
+        'selected_user_type': user_type,
+        'rollup_watermark': get_watermark(),
     })
 
 
+def _export(request, name):
+    # ?format=csv|jsonl — потоковая выгрузка для хранилища данных, по умолчанию Excel
+    export_format = request.GET.get('format', 'xlsx')
+    if export_format == 'xlsx':
+        headers, rows, sheet_title = exports.XLSX_DATASETS[name]
+        return exports.xlsx_response(f'{name}_report.xlsx', sheet_title, headers, rows())
+    if export_format not in exports.EXPORT_FORMATS:
+        return HttpResponseBadRequest(f'Unknown format "{export_format}"')
+    try:
+        filters = exports.parse_export_filters(request.GET)
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    compress = request.GET.get('gzip') in ('1', 'true')
+    return exports.dataset_response(name, export_format, compress, **filters)
+
+
 @login_required
 @user_passes_test(is_management)
 def export_books_excel(request):
-    books = Book.objects.all().values(
-        'title', 'author__first_name', 'author__last_name', 'isbn',
-        'genre__name', 'publication_year', 'publisher',
-        'total_copies', 'available_copies'
-    )
+    return _export(request, 'books')
+
+
+@login_required
+@user_passes_test(is_management)
+def export_loans_excel(request):
+    return _export(request, 'loans')
 
-    df = pd.DataFrame(books)
-    df.rename(columns={
-        'author__first_name': 'Author First Name',
-        'author__last_name': 'Author Last Name',
-        'genre__name': 'Genre',
-        'publication_year': 'Publication Year',
-        'total_copies': 'Total Copies',
-        'available_copies': 'Available Copies'
-    }, inplace=True)
 
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="books_report.xlsx"'
+@login_required
+@user_passes_test(is_management)
+def export_users_excel(request):
+    return _export(request, 'users')
 
-    with pd.ExcelWriter(response, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Books', index=False)
 
-    return response
+@login_required
+@user_passes_test(is_management)
+def export_reservations_excel(request):
+    return _export(request, 'reservations')
+
+
+def _job_data(job):
+    return {
+        'id': job.pk,
+        'dataset': job.dataset,
+        'format': job.export_format,
+        'status': job.status,
+        'rows_written': job.rows_written,
+        'total_rows': job.total_rows,
+        'progress': job.progress,
+        'error': job.error,
+        'download_url': reverse('export_job_download', args=[job.pk]) if job.status == 'done' else None,
+    }
 
 
 @login_required
 @user_passes_test(is_management)
-def export_loans_excel(request):
-    loans = Loan.objects.select_related('user', 'book').all()
-
-    data = []
-    for loan in loans:
-        borrowed_date = loan.borrowed_date.strftime('%Y-%m-%d %H:%M') if loan.borrowed_date else ''
-        due_date = loan.due_date.strftime('%Y-%m-%d %H:%M') if loan.due_date else ''
-        returned_date = loan.returned_date.strftime('%Y-%m-%d %H:%M') if loan.returned_date else ''
-
-        data.append({
-            'Username': loan.user.username,
-            'User First Name': loan.user.first_name or '',
-            'User Last Name': loan.user.last_name or '',
-            'Book Title': loan.book.title,
-            'ISBN': loan.book.isbn,
-            'Borrowed Date': borrowed_date,
-            'Due Date': due_date,
-            'Returned Date': returned_date,
-            'Status': loan.get_status_display(),
-            'Renewals': loan.renewals,
-            'Is Overdue': 'Yes' if loan.is_overdue() else 'No',
-        })
-
-    df = pd.DataFrame(data)
-
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="loans_report.xlsx"'
-
-    with pd.ExcelWriter(response, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Loans', index=False)
-
-        # Авто-ширина колонок
-        worksheet = writer.sheets['Loans']
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            worksheet.column_dimensions[column_letter].width = adjusted_width
-
-    return response
+@require_POST
+def export_job_create(request):
+    dataset = request.POST.get('dataset')
+    export_format = request.POST.get('format', 'xlsx')
+    if dataset not in exports.XLSX_DATASETS or export_format not in dict(ExportJob.FORMAT_CHOICES):
+        return JsonResponse({'error': 'Unknown dataset or format'}, status=400)
+    try:
+        job = enqueue_export(
+            dataset, export_format, compress=request.POST.get('gzip') in ('1', 'true'),
+            filters={name: request.POST.get(name) for name in ('updated_since', 'min_id', 'max_id')},
+            user=request.user
+        )
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse(_job_data(job), status=202)
 
 
 @login_required
 @user_passes_test(is_management)
-def export_users_excel(request):
-    users = User.objects.all()
-
-    # Подготавливаем данные с преобразованием дат
-    data = []
-    for user in users:
-        date_joined = user.date_joined.strftime('%Y-%m-%d %H:%M') if user.date_joined else ''
-
-        data.append({
-            'Username': user.username,
-            'First Name': user.first_name or '',
-            'Last Name': user.last_name or '',
-            'Email': user.email or '',
-            'User Type': user.get_user_type_display(),
-            'Membership ID': user.membership_id or '',
-            'Is Active': 'Yes' if user.is_active else 'No',
-            'Date Joined': date_joined,
-        })
-
-    df = pd.DataFrame(data)
-
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="users_report.xlsx"'
-
-    with pd.ExcelWriter(response, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Users', index=False)
-
-        # Авто-ширина колонок
-        worksheet = writer.sheets['Users']
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            worksheet.column_dimensions[column_letter].width = adjusted_width
-
-    return response
+def export_job_status(request, job_id):
+    return JsonResponse(_job_data(get_object_or_404(ExportJob, pk=job_id)))
 
 
 @login_required
 @user_passes_test(is_management)
-def export_reservations_excel(request):
-    reservations = Reservation.objects.select_related('user', 'book').all()
-
-    data = []
-    for reservation in reservations:
-        reserved_date = reservation.reserved_date.strftime('%Y-%m-%d %H:%M') if reservation.reserved_date else ''
-        expiry_date = reservation.expiry_date.strftime('%Y-%m-%d %H:%M') if reservation.expiry_date else ''
-
-        data.append({
-            'Username': reservation.user.username,
-            'Book Title': reservation.book.title,
-            'ISBN': reservation.book.isbn,
-            'Reserved Date': reserved_date,
-            'Expiry Date': expiry_date,
-            'Status': reservation.get_status_display(),
-            'Priority': reservation.priority,
-            'Notified': 'Yes' if reservation.notified else 'No',
-        })
-
-    df = pd.DataFrame(data)
-
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="reservations_report.xlsx"'
-
-    with pd.ExcelWriter(response, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Reservations', index=False)
-
-        worksheet = writer.sheets['Reservations']
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            worksheet.column_dimensions[column_letter].width = adjusted_width
-
-    return response
+def export_job_download(request, job_id):
+    job = get_object_or_404(ExportJob, pk=job_id, status='done')
+    if not job.file:
+        raise Http404
+    return FileResponse(job.file.open('rb'), as_attachment=True, filename=job.file.name.rsplit('/', 1)[-1])
 
 
 @login_required
 @user_passes_test(is_management)
 def export_data(request):
-    return render(request, 'reports/export_data.html')
\ No newline at end of file
+    recent_jobs = ExportJob.objects.select_related('requested_by').order_by('-created_at')[:10]
+    return render(request, 'reports/export_data.html', {'recent_jobs': recent_jobs})
\ No newline at end of file
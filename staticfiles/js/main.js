@@ -33,22 +33,6 @@ $(document).on('click', '#logout-btn', function(e) {
     }
 });
 
-// Notification system
-function checkUnreadNotifications() {
-    $.get('/notifications/api/unread-count/')
-        .done(function(data) {
-            const badge = $('#notification-badge');
-            if (data.unread_count > 0) {
-                badge.text(data.unread_count).show();
-            } else {
-                badge.hide();
-            }
-        })
-        .fail(function(xhr, status, error) {
-            console.error('Failed to fetch notifications:', error);
-        });
-}
-
 // Auto-complete search
 function initSearchAutocomplete() {
     const searchInput = $('#search-input');
@@ -77,11 +61,7 @@ function initSearchAutocomplete() {
 
 // Initialize when document is ready
 $(document).ready(function() {
-    // Check for unread notifications
-    if ($('#navbarDropdown').length) {
-        checkUnreadNotifications();
-        setInterval(checkUnreadNotifications, 60000); // Check every minute
-    }
+    // Unread notification count is kept up to date by templates/base.html
 
     // Initialize search autocomplete
     initSearchAutocomplete();